@@ -0,0 +1 @@
+"""سكربتات قياس الأداء لنظام رفاه"""
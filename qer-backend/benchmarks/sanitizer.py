@@ -0,0 +1,101 @@
+"""
+قياس أداء تنظيف المدخلات (sanitize_input)
+
+يقارن الطريقة القديمة (استدعاء ذاتي و re.sub لكل نمط على كل نص) بمحرك التنظيف
+ذي التعبير الواحد لكل فئة حقل، على حمولة استيراد روابط مجمّعة، ويتحقق من تطابق
+النتائج على نصوص عدائية يكشف فيها الحذف نمطاً جديداً:
+
+    python -m benchmarks.sanitizer --items 10000
+"""
+
+import argparse
+import random
+import re
+import string
+import time
+
+from src.security.sanitizer import InputSanitizer, TEXT
+
+
+def legacy_sanitize(data):
+    """الطريقة القديمة كما كانت في SecurityManager.sanitize_input"""
+    if isinstance(data, str):
+        data = re.sub(r'<[^>]+>', '', data)
+        data = re.sub(r'javascript:', '', data, flags=re.IGNORECASE)
+        sql_patterns = [
+            r'(\b(SELECT|INSERT|UPDATE|DELETE|DROP|CREATE|ALTER|EXEC|UNION)\b)',
+            r'(--|#|/\*|\*/)',
+            r'(\bOR\b.*=.*\bOR\b)',
+            r'(\bAND\b.*=.*\bAND\b)'
+        ]
+        for pattern in sql_patterns:
+            data = re.sub(pattern, '', data, flags=re.IGNORECASE)
+    elif isinstance(data, dict):
+        return {key: legacy_sanitize(value) for key, value in data.items()}
+    elif isinstance(data, list):
+        return [legacy_sanitize(item) for item in data]
+    return data
+
+
+# نصوص يكشف فيها حذف نمط نمطاً آخر، والناتج المتوقع منها
+ADVERSARIAL = {
+    'jav<b>ascript:alert(1)': 'alert(1)',
+    'SEL<b>ECT * FROM users': ' * FROM users',
+    'javascript:javascript:alert(1)': 'alert(1)'
+}
+
+
+def payload(items):
+    """حمولة استيراد روابط: رابط واسم مخصص وعنوان ووصف ووسوم لكل عنصر"""
+    words = ['عرض', 'خصم', 'رفاه', 'offer', 'sale', 'new', 'select', 'campaign', '<b>hot</b>']
+    alphabet = string.ascii_letters + string.digits
+    return {
+        'urls': [
+            {
+                'original_url': f'https://example.com/products/{i}?ref=campaign#section-{i % 7}',
+                'custom_alias': ''.join(random.choice(alphabet) for _ in range(8)),
+                'title': ' '.join(random.choice(words) for _ in range(6)),
+                'description': ' '.join(random.choice(words) for _ in range(40)),
+                'tags': [random.choice(words) for _ in range(3)],
+                'is_active': True
+            }
+            for i in range(items)
+        ]
+    }
+
+
+def measure(name, func, data, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(data)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print(f'{name:22} {best * 1000:9.1f} ms')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    random.seed(0)
+    data = payload(args.items)
+    sanitizer = InputSanitizer()
+
+    old = measure('legacy (all text)', legacy_sanitize, data, args.repeat)
+    new = measure('engine (all text)', lambda value: sanitizer.sanitize(value, default=TEXT), data, args.repeat)
+    print('results match' if old == new else 'RESULTS DIFFER')
+
+    adversarial = list(ADVERSARIAL)
+    old = legacy_sanitize(adversarial)
+    new = sanitizer.sanitize(adversarial, default=TEXT)
+    expected = list(ADVERSARIAL.values())
+    print('adversarial match' if old == new == expected else f'ADVERSARIAL DIFFER: {old} {new}')
+    measure('engine (url schema)', lambda value: sanitizer.sanitize(value, 'url'), data, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
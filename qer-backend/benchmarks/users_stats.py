@@ -0,0 +1,121 @@
+"""
+قياس أداء إحصائيات المستخدمين (/users-stats)
+
+يقارن الطريقة القديمة (تحميل روابط كل مستخدم على حدة) بالاستعلام المجمع الواحد
+على قاعدة SQLite مؤقتة:
+
+    python -m benchmarks.users_stats --users 5000 --urls 500000
+"""
+
+import argparse
+import os
+import random
+import string
+import tempfile
+import time
+from datetime import datetime
+from flask import Flask
+from sqlalchemy import event
+
+from src.models.user import db, User
+from src.models.url import ShortenedUrl
+import src.models.analytics  # noqa: F401
+from src.models.analytics import Analytics
+from src.migrations import apply_performance_indexes
+
+
+class QueryCounter:
+    """عدّاد الاستعلامات المنفذة على المحرك"""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def reset(self):
+        self.count = 0
+
+
+def seed(users, urls, chunk_size=10000):
+    """تعبئة القاعدة ببيانات عشوائية عبر إدخال مجمّع"""
+    now = datetime.utcnow()
+    db.session.execute(User.__table__.insert(), [
+        {
+            'username': f'user{i}', 'email': f'user{i}@rfah.me', 'password_hash': 'x',
+            'full_name': f'مستخدم {i}', 'is_active': True, 'is_admin': False,
+            'created_at': now
+        }
+        for i in range(users)
+    ])
+
+    alphabet = string.ascii_letters + string.digits
+    for start in range(0, urls, chunk_size):
+        db.session.execute(ShortenedUrl.__table__.insert(), [
+            {
+                'original_url': f'https://example.com/{i}',
+                'short_code': ''.join(random.choice(alphabet) for _ in range(10)),
+                'clicks': random.randint(0, 500),
+                'is_active': True,
+                'user_id': random.randint(1, users),
+                'created_at': now,
+                'updated_at': now
+            }
+            for i in range(start, min(start + chunk_size, urls))
+        ])
+    db.session.commit()
+
+
+def per_user_loop():
+    """الطريقة القديمة: استعلام لكل مستخدم وتحميل كل روابطه"""
+    result = []
+    for user in User.query.filter_by(is_active=True).all():
+        user_urls = ShortenedUrl.get_by_user(user.id, include_deleted=False)
+        total_clicks = sum(url.clicks for url in user_urls)
+        result.append((user.id, len(user_urls), total_clicks))
+    return result
+
+
+def grouped_query():
+    """الطريقة الجديدة: استعلام مجمع واحد"""
+    return [(row.user_id, row.total_urls, row.total_clicks) for row in Analytics.users_stats_query().all()]
+
+
+def measure(name, func, counter):
+    counter.reset()
+    db.session.expunge_all()
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    print(f'{name:15} {elapsed:8.2f}s {counter.count:8d} queries')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--urls', type=int, default=500000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        print(f'seeding {args.users} users / {args.urls} urls ...')
+        seed(args.users, args.urls)
+        # نفس فهارس الإنتاج حتى تكون المقارنة عادلة للطريقة القديمة
+        apply_performance_indexes()
+
+        counter = QueryCounter(db.engine)
+        old = measure('per-user loop', per_user_loop, counter)
+        new = measure('grouped query', grouped_query, counter)
+        print('results match' if sorted(old) == sorted(new) else 'RESULTS DIFFER')
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,9 @@
 """
 
 from .analytics_engine import AnalyticsEngine
+from .partitions import ClickPartitionRouter, click_router
+from .cold_archive import ColdArchive, cold_archive
+from .sampling import ClickSampler, click_sampler
 
-__all__ = ['AnalyticsEngine']
-
+__all__ = ['AnalyticsEngine', 'ClickPartitionRouter', 'click_router', 'ColdArchive', 'cold_archive',
+           'ClickSampler', 'click_sampler']
@@ -9,10 +9,16 @@ from collections import defaultdict
 import json
 from src.models.user import User, db
 from src.models.url import ShortenedUrl as URL
-from src.models.analytics import ClickLog
+from src.models.analytics import ClickDailyAggregate
+from src.models.dimensions import dimension_cache, BrowserDim, ReferrerDomainDim
+from src.analytics.partitions import click_router
 
 class AnalyticsEngine:
-    """محرك التحليلات الرئيسي"""
+    """محرك التحليلات الرئيسي
+
+    كل قراءات النقرات تمر عبر موجّه الأقسام الشهرية (click_router): الأقسام الحية
+    ومقاطع الأرشيف البارد، مع ملخصات الأقسام المحذوفة في العدادات اليومية والتوزيعات.
+    """
     
     def __init__(self, app=None):
         self.app = app
@@ -32,7 +38,7 @@ class AnalyticsEngine:
         # بناء الاستعلام الأساسي
         base_query = db.session.query(URL)
         if user_id:
-            base_query = base_query.filter(URL.created_by == user_id)
+            base_query = base_query.filter(URL.user_id == user_id)
         
         # إجمالي الروابط
         total_urls = base_query.filter(URL.deleted_at.is_(None)).count()
@@ -56,24 +62,14 @@ class AnalyticsEngine:
         ).count()
         
         # إجمالي النقرات
-        clicks_query = db.session.query(func.sum(URL.click_count))
+        clicks_query = db.session.query(func.sum(URL.clicks))
         if user_id:
-            clicks_query = clicks_query.filter(URL.created_by == user_id)
+            clicks_query = clicks_query.filter(URL.user_id == user_id)
         
         total_clicks = clicks_query.filter(URL.deleted_at.is_(None)).scalar() or 0
         
         # النقرات في الفترة المحددة
-        period_clicks_query = db.session.query(func.count(ClickLog.id)).join(URL)
-        if user_id:
-            period_clicks_query = period_clicks_query.filter(URL.created_by == user_id)
-        
-        period_clicks = period_clicks_query.filter(
-            and_(
-                ClickLog.clicked_at >= start_date,
-                ClickLog.clicked_at <= end_date,
-                URL.deleted_at.is_(None)
-            )
-        ).scalar() or 0
+        period_clicks = self._period_clicks(start_date, end_date, user_id=user_id)
         
         # الروابط الجديدة في الفترة
         new_urls = base_query.filter(
@@ -88,7 +84,7 @@ class AnalyticsEngine:
         ctr = (period_clicks / total_urls * 100) if total_urls > 0 else 0
         
         # أكثر الروابط نشاطاً
-        top_urls_query = base_query.filter(URL.deleted_at.is_(None)).order_by(desc(URL.click_count)).limit(5)
+        top_urls_query = base_query.filter(URL.deleted_at.is_(None)).order_by(desc(URL.clicks)).limit(5)
         top_urls = []
         
         for url in top_urls_query:
@@ -96,7 +92,7 @@ class AnalyticsEngine:
                 'id': url.id,
                 'title': url.title,
                 'short_code': url.short_code,
-                'click_count': url.click_count,
+                'click_count': url.clicks,
                 'created_at': url.created_at.isoformat()
             })
         
@@ -123,7 +119,7 @@ class AnalyticsEngine:
         
         # إحصائيات الروابط
         user_urls = URL.query.filter(
-            and_(URL.created_by == user_id, URL.deleted_at.is_(None))
+            and_(URL.user_id == user_id, URL.deleted_at.is_(None))
         )
         
         total_urls = user_urls.count()
@@ -135,19 +131,12 @@ class AnalyticsEngine:
         ).count()
         
         # إحصائيات النقرات
-        total_clicks = db.session.query(func.sum(URL.click_count)).filter(
-            and_(URL.created_by == user_id, URL.deleted_at.is_(None))
+        total_clicks = db.session.query(func.sum(URL.clicks)).filter(
+            and_(URL.user_id == user_id, URL.deleted_at.is_(None))
         ).scalar() or 0
         
         # النقرات في الفترة المحددة
-        period_clicks = db.session.query(func.count(ClickLog.id)).join(URL).filter(
-            and_(
-                URL.created_by == user_id,
-                ClickLog.clicked_at >= start_date,
-                ClickLog.clicked_at <= end_date,
-                URL.deleted_at.is_(None)
-            )
-        ).scalar() or 0
+        period_clicks = self._period_clicks(start_date, end_date, user_id=user_id)
         
         # متوسط النقرات لكل رابط
         avg_clicks_per_url = (total_clicks / total_urls) if total_urls > 0 else 0
@@ -156,7 +145,7 @@ class AnalyticsEngine:
         daily_activity = self._get_daily_activity(user_id, start_date, end_date)
         
         # أفضل الروابط
-        top_urls = user_urls.order_by(desc(URL.click_count)).limit(10).all()
+        top_urls = user_urls.order_by(desc(URL.clicks)).limit(10).all()
         top_urls_data = []
         
         for url in top_urls:
@@ -166,7 +155,7 @@ class AnalyticsEngine:
                 'id': url.id,
                 'title': url.title,
                 'short_code': url.short_code,
-                'click_count': url.click_count,
+                'click_count': url.clicks,
                 'created_at': url.created_at.isoformat(),
                 'stats': url_stats
             })
@@ -201,13 +190,7 @@ class AnalyticsEngine:
             return None
         
         # النقرات في الفترة المحددة
-        period_clicks = ClickLog.query.filter(
-            and_(
-                ClickLog.url_id == url_id,
-                ClickLog.clicked_at >= start_date,
-                ClickLog.clicked_at <= end_date
-            )
-        ).count()
+        period_clicks = click_router.count(start_date, end_date, url_id=url_id)
         
         # النقرات اليومية
         daily_clicks = self._get_daily_clicks(url_id, start_date, end_date)
@@ -234,7 +217,7 @@ class AnalyticsEngine:
             'url_id': url_id,
             'title': url.title,
             'short_code': url.short_code,
-            'total_clicks': url.click_count,
+            'total_clicks': url.clicks,
             'period_clicks': period_clicks,
             'daily_average': round(daily_avg, 2),
             'daily_clicks': daily_clicks,
@@ -244,7 +227,7 @@ class AnalyticsEngine:
             'referrer_stats': referrer_stats,
             'peak_hours': peak_hours,
             'created_at': url.created_at.isoformat(),
-            'last_clicked': url.last_clicked_at.isoformat() if url.last_clicked_at else None
+            'last_clicked': self._last_clicked(url)
         }
     
     def get_comparative_analysis(self, user_ids, days=30):
@@ -288,17 +271,14 @@ class AnalyticsEngine:
         start_date = end_date - timedelta(days=days)
         
         # الروابط الأكثر نمواً
+        clicks = click_router.clicks_between(start_date, end_date)
         growing_urls = db.session.query(
             URL.id,
             URL.title,
             URL.short_code,
-            func.count(ClickLog.id).label('recent_clicks')
-        ).join(ClickLog).filter(
-            and_(
-                ClickLog.clicked_at >= start_date,
-                ClickLog.clicked_at <= end_date,
-                URL.deleted_at.is_(None)
-            )
+            func.count().label('recent_clicks')
+        ).select_from(clicks).join(URL, URL.id == clicks.c.url_id).filter(
+            URL.deleted_at.is_(None)
         ).group_by(URL.id).order_by(desc('recent_clicks')).limit(10).all()
         
         # المستخدمون الأكثر نشاطاً
@@ -306,13 +286,11 @@ class AnalyticsEngine:
             User.id,
             User.username,
             User.full_name,
-            func.count(ClickLog.id).label('recent_clicks')
-        ).join(URL, URL.created_by == User.id).join(ClickLog).filter(
+            func.count().label('recent_clicks')
+        ).select_from(clicks).join(URL, URL.id == clicks.c.url_id).join(User, URL.user_id == User.id).filter(
             and_(
-                ClickLog.clicked_at >= start_date,
-                ClickLog.clicked_at <= end_date,
                 URL.deleted_at.is_(None),
-                User.deleted_at.is_(None)
+                User.is_active == True
             )
         ).group_by(User.id).order_by(desc('recent_clicks')).limit(10).all()
         
@@ -384,20 +362,12 @@ class AnalyticsEngine:
     
     def _get_daily_activity(self, user_id, start_date, end_date):
         """الحصول على النشاط اليومي للمستخدم"""
-        daily_data = db.session.query(
-            func.date(ClickLog.clicked_at).label('date'),
-            func.count(ClickLog.id).label('clicks')
-        ).join(URL).filter(
-            and_(
-                URL.created_by == user_id,
-                ClickLog.clicked_at >= start_date,
-                ClickLog.clicked_at <= end_date,
-                URL.deleted_at.is_(None)
-            )
-        ).group_by(func.date(ClickLog.clicked_at)).all()
+        url_ids = [row.id for row in db.session.query(URL.id).filter(
+            and_(URL.user_id == user_id, URL.deleted_at.is_(None))
+        )]
         
         # تحويل إلى قاموس
-        activity_dict = {str(row.date): row.clicks for row in daily_data}
+        activity_dict = dict(click_router.daily_totals(start_date, end_date, url_ids=url_ids)) if url_ids else {}
         
         # ملء الأيام المفقودة بالصفر
         current_date = start_date.date()
@@ -415,19 +385,8 @@ class AnalyticsEngine:
     
     def _get_daily_clicks(self, url_id, start_date, end_date):
         """الحصول على النقرات اليومية لرابط محدد"""
-        daily_data = db.session.query(
-            func.date(ClickLog.clicked_at).label('date'),
-            func.count(ClickLog.id).label('clicks')
-        ).filter(
-            and_(
-                ClickLog.url_id == url_id,
-                ClickLog.clicked_at >= start_date,
-                ClickLog.clicked_at <= end_date
-            )
-        ).group_by(func.date(ClickLog.clicked_at)).all()
-        
         # تحويل إلى قاموس
-        clicks_dict = {str(row.date): row.clicks for row in daily_data}
+        clicks_dict = dict(click_router.daily_totals(start_date, end_date, url_id=url_id))
         
         # ملء الأيام المفقودة بالصفر
         current_date = start_date.date()
@@ -445,17 +404,15 @@ class AnalyticsEngine:
     
     def _get_geographic_stats(self, url_id, start_date, end_date):
         """الحصول على الإحصائيات الجغرافية"""
+        # البلد والمدينة لا يُلخَّصان، فالأشهر المحذوفة خارج هذا التوزيع
+        clicks = click_router.clicks_between(start_date, end_date)
         geo_data = db.session.query(
-            ClickLog.country,
-            ClickLog.city,
-            func.count(ClickLog.id).label('clicks')
-        ).filter(
-            and_(
-                ClickLog.url_id == url_id,
-                ClickLog.clicked_at >= start_date,
-                ClickLog.clicked_at <= end_date
-            )
-        ).group_by(ClickLog.country, ClickLog.city).order_by(desc('clicks')).limit(20).all()
+            clicks.c.country,
+            clicks.c.city,
+            func.count().label('clicks')
+        ).select_from(clicks).filter(
+            clicks.c.url_id == url_id
+        ).group_by(clicks.c.country, clicks.c.city).order_by(desc('clicks')).limit(20).all()
         
         return [
             {
@@ -468,79 +425,50 @@ class AnalyticsEngine:
     
     def _get_device_stats(self, url_id, start_date, end_date):
         """الحصول على إحصائيات الأجهزة"""
-        device_data = db.session.query(
-            ClickLog.device_type,
-            func.count(ClickLog.id).label('clicks')
-        ).filter(
-            and_(
-                ClickLog.url_id == url_id,
-                ClickLog.clicked_at >= start_date,
-                ClickLog.clicked_at <= end_date
-            )
-        ).group_by(ClickLog.device_type).order_by(desc('clicks')).all()
+        device_data = click_router.breakdown('device_type', start_date, end_date, url_id=url_id)
         
         return [
             {
-                'device_type': row.device_type or 'غير محدد',
-                'clicks': row.clicks
+                'device_type': device_type or 'غير محدد',
+                'clicks': clicks
             }
-            for row in device_data
+            for device_type, clicks in device_data
         ]
     
     def _get_browser_stats(self, url_id, start_date, end_date):
         """الحصول على إحصائيات المتصفحات"""
-        browser_data = db.session.query(
-            ClickLog.browser,
-            func.count(ClickLog.id).label('clicks')
-        ).filter(
-            and_(
-                ClickLog.url_id == url_id,
-                ClickLog.clicked_at >= start_date,
-                ClickLog.clicked_at <= end_date
-            )
-        ).group_by(ClickLog.browser).order_by(desc('clicks')).all()
+        browser_data = click_router.breakdown('browser_id', start_date, end_date, url_id=url_id)
         
         return [
             {
-                'browser': row.browser or 'غير محدد',
-                'clicks': row.clicks
+                'browser': dimension_cache.value_of(BrowserDim, browser_id) or 'غير محدد',
+                'clicks': clicks
             }
-            for row in browser_data
+            for browser_id, clicks in browser_data
         ]
     
     def _get_referrer_stats(self, url_id, start_date, end_date):
         """الحصول على إحصائيات المصادر"""
-        referrer_data = db.session.query(
-            ClickLog.referrer,
-            func.count(ClickLog.id).label('clicks')
-        ).filter(
-            and_(
-                ClickLog.url_id == url_id,
-                ClickLog.clicked_at >= start_date,
-                ClickLog.clicked_at <= end_date
-            )
-        ).group_by(ClickLog.referrer).order_by(desc('clicks')).limit(10).all()
+        referrer_data = click_router.breakdown('referrer_domain_id', start_date, end_date, url_id=url_id, limit=10)
         
         return [
             {
-                'referrer': row.referrer or 'مباشر',
-                'clicks': row.clicks
+                'referrer': dimension_cache.value_of(ReferrerDomainDim, domain_id) or 'مباشر',
+                'clicks': clicks
             }
-            for row in referrer_data
+            for domain_id, clicks in referrer_data
         ]
     
     def _get_peak_hours(self, url_id, start_date, end_date):
         """الحصول على أوقات الذروة"""
+        clicks = click_router.clicks_between(start_date, end_date)
+        hour = func.extract('hour', clicks.c.timestamp)
         hourly_data = db.session.query(
-            func.extract('hour', ClickLog.clicked_at).label('hour'),
-            func.count(ClickLog.id).label('clicks')
-        ).filter(
-            and_(
-                ClickLog.url_id == url_id,
-                ClickLog.clicked_at >= start_date,
-                ClickLog.clicked_at <= end_date
-            )
-        ).group_by(func.extract('hour', ClickLog.clicked_at)).order_by('hour').all()
+            hour.label('hour'),
+            func.count().label('clicks')
+        ).select_from(clicks).filter(
+            clicks.c.url_id == url_id
+        ).group_by(hour).order_by('hour').all()
         
         return [
             {
@@ -552,16 +480,14 @@ class AnalyticsEngine:
     
     def _get_hourly_trends(self, start_date, end_date):
         """الحصول على الاتجاهات الساعية"""
+        clicks = click_router.clicks_between(start_date, end_date)
+        hour = func.extract('hour', clicks.c.timestamp)
         hourly_data = db.session.query(
-            func.extract('hour', ClickLog.clicked_at).label('hour'),
-            func.count(ClickLog.id).label('clicks')
-        ).join(URL).filter(
-            and_(
-                ClickLog.clicked_at >= start_date,
-                ClickLog.clicked_at <= end_date,
-                URL.deleted_at.is_(None)
-            )
-        ).group_by(func.extract('hour', ClickLog.clicked_at)).order_by('hour').all()
+            hour.label('hour'),
+            func.count().label('clicks')
+        ).select_from(clicks).join(URL, URL.id == clicks.c.url_id).filter(
+            URL.deleted_at.is_(None)
+        ).group_by(hour).order_by('hour').all()
         
         return [
             {
@@ -573,25 +499,21 @@ class AnalyticsEngine:
     
     def _get_best_posting_times(self, user_id, start_date, end_date):
         """الحصول على أفضل أوقات النشر"""
+        clicks = click_router.clicks_between(start_date, end_date)
+        hour = func.extract('hour', clicks.c.timestamp)
+        day_of_week = func.extract('dow', clicks.c.timestamp)
         query = db.session.query(
-            func.extract('hour', ClickLog.clicked_at).label('hour'),
-            func.extract('dow', ClickLog.clicked_at).label('day_of_week'),
-            func.count(ClickLog.id).label('clicks')
-        ).join(URL)
+            hour.label('hour'),
+            day_of_week.label('day_of_week'),
+            func.count().label('clicks')
+        ).select_from(clicks).join(URL, URL.id == clicks.c.url_id)
         
         if user_id:
-            query = query.filter(URL.created_by == user_id)
+            query = query.filter(URL.user_id == user_id)
         
         time_data = query.filter(
-            and_(
-                ClickLog.clicked_at >= start_date,
-                ClickLog.clicked_at <= end_date,
-                URL.deleted_at.is_(None)
-            )
-        ).group_by(
-            func.extract('hour', ClickLog.clicked_at),
-            func.extract('dow', ClickLog.clicked_at)
-        ).order_by(desc('clicks')).limit(10).all()
+            URL.deleted_at.is_(None)
+        ).group_by(hour, day_of_week).order_by(desc('clicks')).limit(10).all()
         
         days_map = {
             0: 'الأحد', 1: 'الاثنين', 2: 'الثلاثاء', 3: 'الأربعاء',
@@ -607,6 +529,36 @@ class AnalyticsEngine:
             for row in time_data
         ]
     
+    def _period_clicks(self, start_date, end_date, user_id=None):
+        """نقرات الروابط غير المحذوفة في الفترة (الأقسام الحية والأرشيف مع ملخصات الأقسام المحذوفة)"""
+        clicks = click_router.clicks_between(start_date, end_date)
+        query = db.session.query(func.count()).select_from(clicks).join(
+            URL, URL.id == clicks.c.url_id
+        ).filter(URL.deleted_at.is_(None))
+        if user_id:
+            query = query.filter(URL.user_id == user_id)
+        total = query.scalar() or 0
+        
+        if click_router.dropped_partitions(start_date, end_date):
+            rollups = db.session.query(func.sum(ClickDailyAggregate.clicks)).join(
+                URL, URL.id == ClickDailyAggregate.url_id
+            ).filter(
+                ClickDailyAggregate.day >= start_date.date(),
+                ClickDailyAggregate.day <= end_date.date(),
+                URL.deleted_at.is_(None)
+            )
+            if user_id:
+                rollups = rollups.filter(URL.user_id == user_id)
+            total += rollups.scalar() or 0
+        
+        return total
+    
+    def _last_clicked(self, url):
+        """آخر نقرة على الرابط منذ إنشائه"""
+        since = url.created_at or datetime.utcnow() - timedelta(days=30)
+        last_click = click_router.url_summaries(since, datetime.utcnow(), [url.id])[url.id]['last_click']
+        return last_click.isoformat() if last_click else None
+    
     def _calculate_performance_score(self, total_urls, total_clicks, active_urls, period_clicks, days):
         """حساب نقاط الأداء"""
         score = 0
@@ -0,0 +1,477 @@
+"""
+الأرشيف البارد المضغوط لسجلات النقرات والمراجعة القديمة
+ينقل السجلات الأقدم من عمر محدد إلى ملفات مقاطع عمودية (ملف لكل شهر)
+ويتيح قراءتها عند الطلب حتى تبقى قاعدة SQLite الحية صغيرة وسريعة.
+تشغيل الأرشفة محمي بقفل ملف في مجلد الأرشيف، فلا يكتب عاملان المقاطع نفسها،
+وحذف المقاطع المنتهية يتم عبر purge() من سياستي الاحتفاظ بالنقرات والمراجعة
+"""
+
+import gzip
+import json
+import os
+import struct
+from datetime import datetime, timedelta
+from threading import Lock
+from sqlalchemy import MetaData, Table, Column, event, select
+from sqlalchemy.pool import Pool
+from src.models.user import db
+from src.security.epoch import try_lock
+
+# ترويسة ملف المقطع
+SEGMENT_MAGIC = b'RFAHSEG1'
+FOOTER_STRUCT = struct.Struct('<Q8s')  # طول الفهرس + التوقيع
+
+EPOCH = datetime(1970, 1, 1)
+
+# مفتاح ما حُمّل في جداول المسح المؤقتة ضمن معلومات اتصال قاعدة البيانات
+SCAN_INFO_KEY = 'cold_archive_loaded'
+SCAN_TABLE_PREFIX = 'archive_scan_'
+
+
+def _encode_timestamps(values):
+    """ترميز الطوابع الزمنية بالفروقات (ميكروثانية) لتصغير حجمها بعد الضغط"""
+    encoded = []
+    previous = 0
+    for value in values:
+        if value is None:
+            encoded.append(None)
+            continue
+        micros = int((value - EPOCH) / timedelta(microseconds=1))
+        encoded.append(micros - previous)
+        previous = micros
+    return encoded
+
+
+def _decode_timestamps(deltas):
+    values = []
+    previous = 0
+    for delta in deltas:
+        if delta is None:
+            values.append(None)
+            continue
+        previous += delta
+        values.append(EPOCH + timedelta(microseconds=previous))
+    return values
+
+
+class _Codec:
+    """ضغط zstd إن كانت المكتبة مثبتة وإلا gzip"""
+
+    def __init__(self, name):
+        self.name = name
+
+    @classmethod
+    def preferred(cls, requested=None):
+        if requested in (None, 'zstd'):
+            try:
+                import zstandard  # noqa: F401
+                return cls('zstd')
+            except ImportError:
+                pass
+        return cls('gzip')
+
+    def compress(self, data):
+        if self.name == 'zstd':
+            import zstandard
+            return zstandard.ZstdCompressor(level=10).compress(data)
+        return gzip.compress(data, compresslevel=9)
+
+    def decompress(self, data):
+        if self.name == 'zstd':
+            import zstandard
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+
+def write_segment(path, table_name, columns, batches, codec):
+    """كتابة مقطع عمودي دفعةً دفعة: كتلة مضغوطة لكل عمود في كل دفعة ثم فهرس JSON في التذييل
+
+    لا يبقى في الذاكرة إلا دفعة واحدة من الصفوف، فيُؤرشف الشهر الكبير دون تحميله كاملاً.
+    """
+    column_names = [column.name for column in columns]
+    timestamp_columns = {column.name for column in columns if column.type.python_type is datetime}
+
+    index = {
+        'table': table_name,
+        'codec': codec.name,
+        'rows': 0,
+        'min_timestamp': None,
+        'max_timestamp': None,
+        'columns': {
+            name: {'encoding': 'delta_micros' if name in timestamp_columns else 'json', 'blocks': []}
+            for name in column_names
+        }
+    }
+    earliest = latest = None
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as handle:
+        handle.write(SEGMENT_MAGIC)
+        offset = len(SEGMENT_MAGIC)
+
+        for rows in batches:
+            if not rows:
+                continue
+            index['rows'] += len(rows)
+            timestamps = [row['timestamp'] for row in rows if row['timestamp'] is not None]
+            if timestamps:
+                earliest = min(timestamps) if earliest is None else min(earliest, *timestamps)
+                latest = max(timestamps) if latest is None else max(latest, *timestamps)
+
+            for name in column_names:
+                values = [row[name] for row in rows]
+                if name in timestamp_columns:
+                    values = _encode_timestamps(values)
+
+                block = codec.compress(json.dumps(values, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+                handle.write(block)
+                index['columns'][name]['blocks'].append([offset, len(block)])
+                offset += len(block)
+
+        if earliest is not None:
+            index['min_timestamp'] = earliest.isoformat()
+            index['max_timestamp'] = latest.isoformat()
+
+        footer = json.dumps(index, separators=(',', ':')).encode('utf-8')
+        handle.write(footer)
+        handle.write(FOOTER_STRUCT.pack(len(footer), SEGMENT_MAGIC))
+        handle.flush()
+        os.fsync(handle.fileno())
+
+    # الاستبدال الذري يمنع ظهور ملف ناقص للقراء
+    os.replace(tmp_path, path)
+    return index
+
+
+def read_segment_index(path):
+    """قراءة فهرس التذييل فقط دون فك ضغط الأعمدة"""
+    with open(path, 'rb') as handle:
+        handle.seek(-FOOTER_STRUCT.size, os.SEEK_END)
+        length, magic = FOOTER_STRUCT.unpack(handle.read(FOOTER_STRUCT.size))
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f'ملف مقطع غير صالح: {path}')
+        handle.seek(-(FOOTER_STRUCT.size + length), os.SEEK_END)
+        return json.loads(handle.read(length))
+
+
+def read_segment(path, columns=None):
+    """قراءة أعمدة مقطع (كلها أو المطلوبة فقط) كقاموس اسم ← قائمة قيم"""
+    index = read_segment_index(path)
+    codec = _Codec(index['codec'])
+    names = columns or list(index['columns'].keys())
+
+    data = {}
+    with open(path, 'rb') as handle:
+        for name in names:
+            meta = index['columns'][name]
+            # مقاطع الصيغة الأولى تحفظ كل عمود في كتلة واحدة
+            blocks = meta['blocks'] if 'blocks' in meta else [(meta['offset'], meta['length'])]
+            values = []
+            for offset, length in blocks:
+                handle.seek(offset)
+                block = json.loads(codec.decompress(handle.read(length)))
+                # فروقات الطوابع تبدأ من الصفر في كل كتلة
+                values.extend(_decode_timestamps(block) if meta['encoding'] == 'delta_micros' else block)
+            data[name] = values
+    return index, data
+
+
+class ColdArchive:
+    """مؤرشف السجلات القديمة إلى مقاطع مضغوطة"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self._metadata = MetaData()
+        self._lock = Lock()
+        self._indexes = {}  # مسار المقطع ← (وقت التعديل، الفهرس)؛ المقاطع لا تتغير بعد كتابتها
+        self._latest = {}  # الجدول ← (وقت تعديل المجلد، أحدث طابع زمني)
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """تهيئة الأرشيف مع التطبيق"""
+        self.app = app
+        instance_dir = os.getenv('INSTANCE_DIR', app.instance_path)
+        app.config.setdefault('ARCHIVE_DIR', os.path.join(instance_dir, 'archive'))
+        app.config.setdefault('ARCHIVE_CODEC', None)  # zstd إن توفرت وإلا gzip
+        app.config.setdefault('CLICK_ARCHIVE_AFTER_DAYS', 180)
+        app.config.setdefault('AUDIT_ARCHIVE_AFTER_DAYS', 90)
+        app.config.setdefault('ARCHIVE_DELETE_CHUNK_SIZE', 1000)
+        app.config.setdefault('ARCHIVE_BATCH_SIZE', 5000)  # صفوف كل دفعة تُقرأ من القاعدة وكل كتلة في المقطع
+        app.extensions['cold_archive'] = self
+
+    # ==================== الأرشفة ====================
+
+    def run(self, archive=True):
+        """تطبيق مدة الاحتفاظ بالنقرات ثم أرشفة النقرات وسجلات المراجعة حسب الأعمار المضبوطة
+
+        تشغيل واحد في كل الخادم: يعيد None إن كان عامل آخر يؤرشف الآن
+        (ما فاته يُؤرشف في التشغيل التالي لأن الاختيار يقرأ الحالة من القاعدة).
+        الاحتفاظ يسبق الأرشفة حتى لا يُؤرشف شهر انتهت مدته ثم يُحذف في نفس التشغيل.
+        """
+        from src.analytics.partitions import click_router
+
+        lock = self.acquire()
+        if lock is None:
+            return None
+        try:
+            report = {'dropped_partitions': click_router.apply_retention()}
+            if archive:
+                report['click_partitions'] = self.archive_clicks()
+                report['audit_segments'] = self.archive_audit_logs()
+            return report
+        finally:
+            lock.close()
+
+    def acquire(self):
+        """قفل الأرشفة المشترك بين العمليات (None إن كان عامل آخر يؤرشف الآن)"""
+        return try_lock(os.path.join(self.app.config['ARCHIVE_DIR'], '.lock'))
+
+    def archive_clicks(self, older_than_days=None):
+        """أرشفة الأقسام الشهرية المكتملة الأقدم من العمر المحدد ثم حذف جداولها"""
+        from src.analytics.partitions import click_router, month_start
+        from src.models.analytics import ClickPartition
+
+        days = older_than_days or self.app.config['CLICK_ARCHIVE_AFTER_DAYS']
+        cutoff = month_start(datetime.utcnow() - timedelta(days=days))
+
+        partitions = ClickPartition.query.filter(
+            ClickPartition.status == 'live',
+            ClickPartition.month_end <= cutoff
+        ).order_by(ClickPartition.month_start).all()
+
+        archived = []
+        for partition in partitions:
+            table = click_router._table(partition.table_name)
+            result = db.session.execute(
+                select(table).order_by(table.c.timestamp)
+                .execution_options(yield_per=self.app.config['ARCHIVE_BATCH_SIZE'])
+            ).mappings()
+
+            self._write('click_logs', partition.month_start, table.columns, result.partitions())
+
+            # القسم كامل داخل الأرشيف، فحذفه بـ DROP أرخص من الحذف على دفعات
+            table.drop(db.session.connection(), checkfirst=True)
+            partition.status = 'archived'
+            db.session.commit()
+
+            click_router._ensured.discard(partition.table_name)
+            archived.append(partition.table_name)
+
+        return archived
+
+    def archive_audit_logs(self, older_than_days=None):
+        """أرشفة سجلات المراجعة الأقدم من العمر المحدد (شهراً بشهر) ثم حذفها على دفعات"""
+        from src.analytics.partitions import month_start, next_month
+        from src.security.audit_logger import AuditLog
+
+        days = older_than_days or self.app.config['AUDIT_ARCHIVE_AFTER_DAYS']
+        cutoff = month_start(datetime.utcnow() - timedelta(days=days))
+        table = AuditLog.__table__
+
+        written = []
+        while True:
+            oldest = db.session.query(db.func.min(AuditLog.timestamp)).filter(
+                AuditLog.timestamp < cutoff
+            ).scalar()
+            if not oldest:
+                break
+
+            start = month_start(oldest)
+            end = min(next_month(start), cutoff)
+            result = db.session.execute(
+                select(table).where(
+                    table.c.timestamp >= start,
+                    table.c.timestamp < end
+                ).order_by(table.c.id)
+                .execution_options(yield_per=self.app.config['ARCHIVE_BATCH_SIZE'])
+            ).mappings()
+
+            # تُحفظ المعرفات فقط أثناء الكتابة، والحذف بعد اكتمال المقطع
+            ids = []
+
+            def batches():
+                for rows in result.partitions():
+                    ids.extend(row['id'] for row in rows)
+                    yield rows
+
+            written.append(self._write('audit_logs', start, table.columns, batches()))
+            self.delete_in_chunks(table, ids)
+
+        return written
+
+    def delete_in_chunks(self, table, ids):
+        """حذف السجلات المؤرشفة على دفعات قصيرة حتى لا يطول قفل الكتابة"""
+        chunk_size = self.app.config['ARCHIVE_DELETE_CHUNK_SIZE']
+        for i in range(0, len(ids), chunk_size):
+            chunk = ids[i:i + chunk_size]
+            db.session.execute(table.delete().where(table.c.id.in_(chunk)))
+            db.session.commit()
+
+    def purge(self, table_name, before):
+        """حذف المقاطع التي تقع كل سجلاتها قبل التاريخ، وإرجاع فهارسها (للتلخيص أو التقرير)"""
+        directory = os.path.join(self.app.config['ARCHIVE_DIR'], table_name)
+        if not os.path.isdir(directory):
+            return []
+
+        purged = []
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith('.seg'):
+                continue
+            path = os.path.join(directory, filename)
+            index = self._index(path)
+            if index is None:
+                continue
+            if index['max_timestamp']:
+                latest = datetime.fromisoformat(index['max_timestamp'])
+            else:
+                # مقطع فارغ: شهره من اسم الملف
+                latest = datetime.strptime(filename[:6], '%Y%m')
+            if latest >= before:
+                continue
+            os.remove(path)
+            self._indexes.pop(path, None)
+            purged.append(dict(index, path=path))
+        return purged
+
+    def _write(self, table_name, start, columns, batches):
+        directory = os.path.join(self.app.config['ARCHIVE_DIR'], table_name)
+        os.makedirs(directory, exist_ok=True)
+
+        with self._lock:
+            part = 0
+            while True:
+                path = os.path.join(directory, f'{start:%Y%m}-{part:03d}.seg')
+                if not os.path.exists(path):
+                    break
+                part += 1
+
+            codec = _Codec.preferred(self.app.config['ARCHIVE_CODEC'])
+            write_segment(path, table_name, list(columns), batches, codec)
+
+        return path
+
+    # ==================== القراءة عند الطلب ====================
+
+    def segments(self, table_name, start=None, end=None):
+        """ملفات المقاطع المتقاطعة مع الفترة (اعتماداً على اسم الملف ثم التذييل)"""
+        directory = os.path.join(self.app.config['ARCHIVE_DIR'], table_name)
+        if not os.path.isdir(directory):
+            return []
+
+        paths = []
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith('.seg'):
+                continue
+            path = os.path.join(directory, filename)
+            index = self._index(path)
+            if index is None or not index['rows']:
+                continue
+            if end and datetime.fromisoformat(index['min_timestamp']) > end:
+                continue
+            if start and datetime.fromisoformat(index['max_timestamp']) < start:
+                continue
+            paths.append(path)
+        return paths
+
+    def archived_until(self, table_name):
+        """أحدث طابع زمني داخل الأرشيف (None إن لم يكن هناك أرشيف)
+
+        يُعاد حسابه فقط إذا تغير وقت تعديل المجلد (إضافة مقطع أو حذفه).
+        """
+        directory = os.path.join(self.app.config['ARCHIVE_DIR'], table_name)
+        try:
+            version = os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        cached = self._latest.get(table_name)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        latest = None
+        for path in self.segments(table_name):
+            value = datetime.fromisoformat(self._index(path)['max_timestamp'])
+            latest = value if not latest or value > latest else latest
+        self._latest[table_name] = (version, latest)
+        return latest
+
+    def _index(self, path):
+        """فهرس التذييل من الذاكرة ما لم يتغير الملف (None إن حُذف أثناء القراءة)"""
+        try:
+            version = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self._indexes.pop(path, None)
+            return None
+
+        cached = self._indexes.get(path)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        index = read_segment_index(path)
+        self._indexes[path] = (version, index)
+        return index
+
+    def scan_table(self, table_name, template, start=None, end=None):
+        """جدول مؤقت على اتصال الجلسة محمّل بمقاطع الفترة
+
+        يُحمّل كل مقطع مرة واحدة ما دام الاتصال مع الجلسة، ويُدمج الجدول الناتج مع الجداول
+        الحية بـ UNION ALL فتصبح القراءة من الأرشيف شفافة للاستعلامات.
+        يُحذف الجدول عند عودة الاتصال إلى المجمع (_drop_scan_tables)، فلا تكبر الاتصالات المعاد استخدامها.
+        """
+        connection = db.session.connection()
+        scan = self._scan_table(table_name, template)
+        loaded = connection.info.setdefault(SCAN_INFO_KEY, set())
+
+        if scan.name not in loaded:
+            scan.create(connection, checkfirst=True)
+            loaded.add(scan.name)
+
+        # حُذف مقطع محمّل على هذا الاتصال (انتهت مدة الاحتفاظ): إعادة التحميل من البداية
+        directory = os.path.join(self.app.config['ARCHIVE_DIR'], table_name)
+        mine = {path for path in loaded if os.path.dirname(path) == directory}
+        if any(not os.path.exists(path) for path in mine):
+            connection.execute(scan.delete())
+            loaded.difference_update(mine)
+
+        for path in self.segments(table_name, start, end):
+            if path in loaded:
+                continue
+            index, data = read_segment(path)
+            names = list(index['columns'].keys())
+            rows = [dict(zip(names, values)) for values in zip(*(data[name] for name in names))]
+            if rows:
+                connection.execute(scan.insert(), rows)
+            loaded.add(path)
+
+        return scan
+
+    def _scan_table(self, table_name, template):
+        name = f'{SCAN_TABLE_PREFIX}{table_name}'
+        if name in self._metadata.tables:
+            return self._metadata.tables[name]
+
+        # بدون مفتاح أساسي لأن معرفات الأقسام الشهرية قد تتكرر بين المقاطع
+        columns = [Column(column.name, column.type, nullable=True) for column in template.columns]
+        return Table(name, self._metadata, *columns, prefixes=['TEMPORARY'])
+
+
+cold_archive = ColdArchive()
+
+
+@event.listens_for(Pool, 'checkin')
+def _drop_scan_tables(dbapi_connection, connection_record):
+    """حذف جداول المسح المؤقتة من الاتصال العائد إلى المجمع مع ما حُمّل فيها"""
+    loaded = connection_record.info.pop(SCAN_INFO_KEY, None)
+    if not loaded or dbapi_connection is None:
+        return
+
+    cursor = dbapi_connection.cursor()
+    try:
+        for name in loaded:
+            if name.startswith(SCAN_TABLE_PREFIX):
+                cursor.execute(f'DROP TABLE IF EXISTS {name}')
+        dbapi_connection.commit()
+    finally:
+        cursor.close()
@@ -0,0 +1,461 @@
+"""
+تقسيم سجلات النقرات زمنياً إلى جداول شهرية
+يوجّه الكتابة إلى قسم الشهر المناسب، ويستبعد الأقسام خارج الفترة المطلوبة عند الاستعلام،
+ويطبق سياسة الاحتفاظ بتلخيص الأقسام المنتهية يومياً ثم حذفها بـ DROP TABLE
+"""
+
+from datetime import datetime, date, timedelta
+from sqlalchemy import MetaData, Table, Column, Index, select, union_all, func, inspect as sa_inspect
+from src.models.user import db
+from src.models.analytics import ClickLog, ClickPartition, ClickDailyAggregate, ClickDailyBreakdown
+from src.migrations.indexes import CLICK_LOG_INDEXES
+
+# الأبعاد التي تُحفظ في الملخص اليومي قبل حذف القسم
+BREAKDOWN_DIMENSIONS = ['device_type', 'browser_id', 'os_id', 'referrer_domain_id']
+
+
+def month_start(moment):
+    """بداية الشهر الذي يقع فيه التاريخ"""
+    return datetime(moment.year, moment.month, 1)
+
+
+def next_month(start):
+    """بداية الشهر التالي"""
+    if start.month == 12:
+        return datetime(start.year + 1, 1, 1)
+    return datetime(start.year, start.month + 1, 1)
+
+
+class ClickPartitionRouter:
+    """موجّه أقسام النقرات الشهرية"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self._metadata = MetaData()
+        self._ensured = set()
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """تهيئة الموجّه مع التطبيق"""
+        self.app = app
+        app.config.setdefault('CLICK_RETENTION_MONTHS', 24)  # 0 = بدون حذف
+        app.config.setdefault('CLICK_PARTITION_CHUNK_SIZE', 1000)
+        app.extensions['click_partition_router'] = self
+
+    # ==================== الكتابة ====================
+
+    @staticmethod
+    def table_name(start):
+        return f'click_logs_{start:%Y%m}'
+
+    def ensure_partition(self, moment):
+        """إنشاء قسم الشهر إن لم يكن موجوداً وإرجاع جدوله"""
+        start = month_start(moment)
+        name = self.table_name(start)
+        table = self._table(name)
+
+        if name in self._ensured:
+            return table
+
+        table.create(db.session.connection(), checkfirst=True)
+
+        if not ClickPartition.query.filter_by(table_name=name).first():
+            db.session.add(ClickPartition(
+                table_name=name,
+                month_start=start,
+                month_end=next_month(start)
+            ))
+            db.session.flush()
+
+        self._ensured.add(name)
+        return table
+
+    def record(self, click_log):
+        """كتابة نقرة في قسم شهرها بدلاً من الجدول الموحد"""
+        if click_log.timestamp is None:
+            click_log.timestamp = datetime.utcnow()
+
+        table = self.ensure_partition(click_log.timestamp)
+        values = {
+            column.name: getattr(click_log, attr.key)
+            for attr in sa_inspect(ClickLog).column_attrs
+            for column in attr.columns
+            if column.name != 'id'
+        }
+        db.session.execute(table.insert().values(**values))
+
+    # ==================== القراءة ====================
+
+    def live_partitions(self, start, end):
+        """الأقسام الحية المتقاطعة مع الفترة (استبعاد ما عداها)"""
+        return ClickPartition.query.filter(
+            ClickPartition.status == 'live',
+            ClickPartition.month_start <= end,
+            ClickPartition.month_end > start
+        ).order_by(ClickPartition.month_start).all()
+
+    def archived_partitions(self, start, end):
+        """الأقسام المنقولة إلى الأرشيف البارد المتقاطعة مع الفترة"""
+        return ClickPartition.query.filter(
+            ClickPartition.status == 'archived',
+            ClickPartition.month_start <= end,
+            ClickPartition.month_end > start
+        ).order_by(ClickPartition.month_start).all()
+
+    def dropped_partitions(self, start, end):
+        """الأقسام المحذوفة (الملخصة يومياً) المتقاطعة مع الفترة"""
+        return ClickPartition.query.filter(
+            ClickPartition.status == 'dropped',
+            ClickPartition.month_start <= end,
+            ClickPartition.month_end > start
+        ).order_by(ClickPartition.month_start).all()
+
+    def clicks_between(self, start, end=None):
+        """استعلام فرعي موحد (UNION ALL) للنقرات الخام في الفترة
+
+        يتضمن الجدول الموحد القديم click_logs إلى أن تُنقل سجلاته إلى الأقسام،
+        ومقاطع الأرشيف البارد إذا امتدت الفترة إلى أشهر مؤرشفة.
+        """
+        end = end or datetime.utcnow()
+        tables = [ClickLog.__table__]
+        tables.extend(self._table(p.table_name) for p in self.live_partitions(start, end))
+
+        if self.archived_partitions(start, end):
+            from src.analytics.cold_archive import cold_archive
+            tables.append(cold_archive.scan_table('click_logs', ClickLog.__table__, start, end))
+
+        selects = [
+            select(*[table.c[name] for name in self._column_names()]).where(
+                table.c.timestamp >= start,
+                table.c.timestamp <= end
+            )
+            for table in tables
+        ]
+        return union_all(*selects).subquery('clicks')
+
+    def daily_totals(self, start, end=None, url_id=None, url_ids=None):
+        """النقرات اليومية من الأقسام الحية مع ملخصات الأقسام المحذوفة"""
+        end = end or datetime.utcnow()
+        clicks = self.clicks_between(start, end)
+
+        query = db.session.query(
+            func.date(clicks.c.timestamp).label('date'),
+            func.count().label('clicks')
+        ).select_from(clicks)
+        query = self._filter_urls(query, clicks.c.url_id, url_id, url_ids)
+        totals = {str(row.date): row.clicks for row in query.group_by(func.date(clicks.c.timestamp)).all()}
+
+        if self.dropped_partitions(start, end):
+            agg = db.session.query(
+                ClickDailyAggregate.day,
+                func.sum(ClickDailyAggregate.clicks).label('clicks')
+            ).filter(
+                ClickDailyAggregate.day >= start.date(),
+                ClickDailyAggregate.day <= end.date()
+            )
+            agg = self._filter_urls(agg, ClickDailyAggregate.url_id, url_id, url_ids)
+            for row in agg.group_by(ClickDailyAggregate.day).all():
+                key = str(row.day)
+                totals[key] = totals.get(key, 0) + row.clicks
+
+        return sorted(totals.items())
+
+    def daily_totals_by_url(self, start, end, url_ids):
+        """النقرات اليومية لعدة روابط باستعلام مجمّع واحد: {url_id: [(اليوم، النقرات)]}"""
+        clicks = self.clicks_between(start, end)
+        day = func.date(clicks.c.timestamp)
+        totals = {url_id: {} for url_id in url_ids}
+
+        rows = db.session.query(
+            clicks.c.url_id, day.label('date'), func.count().label('clicks')
+        ).select_from(clicks).filter(
+            clicks.c.url_id.in_(url_ids)
+        ).group_by(clicks.c.url_id, day).all()
+        for row in rows:
+            totals[row.url_id][str(row.date)] = row.clicks
+
+        if self.dropped_partitions(start, end):
+            agg = ClickDailyAggregate.query.filter(
+                ClickDailyAggregate.url_id.in_(url_ids),
+                ClickDailyAggregate.day >= start.date(),
+                ClickDailyAggregate.day <= end.date()
+            ).all()
+            for row in agg:
+                days = totals[row.url_id]
+                days[str(row.day)] = days.get(str(row.day), 0) + row.clicks
+
+        return {url_id: sorted(days.items()) for url_id, days in totals.items()}
+
+    def url_summaries(self, start, end, url_ids):
+        """ملخص نقرات كل رابط في الفترة مع ملخصات الأقسام المحذوفة
+
+        يعيد {url_id: {'total', 'unique_visitors', 'first_click', 'last_click'}}. للأيام الملخصة
+        يُجمع عدد الزوار اليومي (حد أعلى تقريبي) وتُحسب أول نقرة وآخرها ببداية اليوم.
+        """
+        clicks = self.clicks_between(start, end)
+        summaries = {
+            url_id: {'total': 0, 'unique_visitors': 0, 'first_click': None, 'last_click': None}
+            for url_id in url_ids
+        }
+
+        rows = db.session.query(
+            clicks.c.url_id,
+            func.count().label('total'),
+            func.count(func.distinct(clicks.c.ip_address)).label('unique_visitors'),
+            func.min(clicks.c.timestamp).label('first_click'),
+            func.max(clicks.c.timestamp).label('last_click')
+        ).select_from(clicks).filter(clicks.c.url_id.in_(url_ids)).group_by(clicks.c.url_id).all()
+        for row in rows:
+            summaries[row.url_id].update(
+                total=row.total,
+                unique_visitors=row.unique_visitors,
+                first_click=self._as_datetime(row.first_click),
+                last_click=self._as_datetime(row.last_click)
+            )
+
+        if self.dropped_partitions(start, end):
+            rows = db.session.query(
+                ClickDailyAggregate.url_id,
+                func.sum(ClickDailyAggregate.clicks).label('clicks'),
+                func.sum(ClickDailyAggregate.unique_visitors).label('unique_visitors'),
+                func.min(ClickDailyAggregate.day).label('first_day'),
+                func.max(ClickDailyAggregate.day).label('last_day')
+            ).filter(
+                ClickDailyAggregate.url_id.in_(url_ids),
+                ClickDailyAggregate.day >= start.date(),
+                ClickDailyAggregate.day <= end.date()
+            ).group_by(ClickDailyAggregate.url_id).all()
+            for row in rows:
+                summary = summaries[row.url_id]
+                summary['total'] += row.clicks or 0
+                summary['unique_visitors'] += row.unique_visitors or 0
+                first_day = datetime.combine(self._as_date(row.first_day), datetime.min.time())
+                last_day = datetime.combine(self._as_date(row.last_day), datetime.min.time())
+                summary['first_click'] = min(filter(None, [summary['first_click'], first_day]))
+                summary['last_click'] = max(filter(None, [summary['last_click'], last_day]))
+
+        return summaries
+
+    def breakdown(self, dimension, start, end=None, url_id=None, limit=None):
+        """توزيع النقرات حسب بعد (يجمع الخام مع الملخصات اليومية)"""
+        end = end or datetime.utcnow()
+        clicks = self.clicks_between(start, end)
+        column = clicks.c[dimension]
+
+        query = db.session.query(column, func.count().label('clicks')).select_from(clicks)
+        query = self._filter_urls(query, clicks.c.url_id, url_id, None)
+        counts = {row[0]: row.clicks for row in query.group_by(column).all()}
+
+        if self.dropped_partitions(start, end):
+            agg = db.session.query(
+                ClickDailyBreakdown.value_key,
+                func.sum(ClickDailyBreakdown.clicks).label('clicks')
+            ).filter(
+                ClickDailyBreakdown.dimension == dimension,
+                ClickDailyBreakdown.day >= start.date(),
+                ClickDailyBreakdown.day <= end.date()
+            )
+            agg = self._filter_urls(agg, ClickDailyBreakdown.url_id, url_id, None)
+            for row in agg.group_by(ClickDailyBreakdown.value_key).all():
+                key = self._decode_value_key(dimension, row.value_key)
+                counts[key] = counts.get(key, 0) + row.clicks
+
+        result = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+        return result[:limit] if limit else result
+
+    def count(self, start, end=None, url_id=None):
+        """عدد النقرات في الفترة"""
+        return sum(clicks for _, clicks in self.daily_totals(start, end, url_id=url_id))
+
+    def unique_visitors(self, start, end=None, url_id=None):
+        """عدد الزوار الفريدين
+
+        للأيام الملخصة يُجمع عدد الزوار اليومي، وهو حد أعلى تقريبي
+        لأن الزائر نفسه قد يتكرر عبر الأيام.
+        """
+        end = end or datetime.utcnow()
+        clicks = self.clicks_between(start, end)
+        query = db.session.query(func.count(func.distinct(clicks.c.ip_address))).select_from(clicks)
+        query = self._filter_urls(query, clicks.c.url_id, url_id, None)
+        total = query.scalar() or 0
+
+        if self.dropped_partitions(start, end):
+            agg = db.session.query(func.sum(ClickDailyAggregate.unique_visitors)).filter(
+                ClickDailyAggregate.day >= start.date(),
+                ClickDailyAggregate.day <= end.date()
+            )
+            agg = self._filter_urls(agg, ClickDailyAggregate.url_id, url_id, None)
+            total += agg.scalar() or 0
+
+        return total
+
+    # ==================== الصيانة ====================
+
+    def migrate_legacy_clicks(self, chunk_size=None):
+        """نقل سجلات الجدول الموحد click_logs إلى الأقسام الشهرية على دفعات"""
+        chunk_size = chunk_size or self.app.config['CLICK_PARTITION_CHUNK_SIZE']
+        legacy = ClickLog.__table__
+        names = [name for name in self._column_names() if name != 'id']
+        moved = 0
+
+        while True:
+            rows = db.session.execute(
+                select(legacy).order_by(legacy.c.id).limit(chunk_size)
+            ).mappings().all()
+            if not rows:
+                break
+
+            by_month = {}
+            for row in rows:
+                by_month.setdefault(month_start(row['timestamp']), []).append(
+                    {name: row[name] for name in names}
+                )
+
+            for start, values in by_month.items():
+                db.session.execute(self.ensure_partition(start).insert(), values)
+
+            db.session.execute(legacy.delete().where(legacy.c.id <= rows[-1]['id']))
+            db.session.commit()
+            moved += len(rows)
+
+        return moved
+
+    def apply_retention(self, keep_months=None):
+        """تلخيص الأقسام المنتهية يومياً ثم حذفها بـ DROP TABLE
+
+        الأقسام التي نُقلت إلى الأرشيف البارد قبل انتهاء مدتها تُلخَّص من مقاطعها
+        ثم تُحذف المقاطع، فالأرشفة مرحلة وسطى لا بديل عن الاحتفاظ.
+        """
+        if keep_months is None:
+            keep_months = self.app.config['CLICK_RETENTION_MONTHS']
+        if not keep_months:
+            return []
+
+        cutoff = month_start(datetime.utcnow())
+        for _ in range(keep_months):
+            cutoff = month_start(cutoff - timedelta(days=1))
+
+        expired = ClickPartition.query.filter(
+            ClickPartition.status.in_(('live', 'archived')),
+            ClickPartition.month_end <= cutoff
+        ).order_by(ClickPartition.month_start).all()
+
+        dropped = []
+        for partition in expired:
+            if partition.status == 'archived':
+                from src.analytics.cold_archive import cold_archive
+                scan = cold_archive.scan_table(
+                    'click_logs', ClickLog.__table__, partition.month_start, partition.month_end
+                )
+                self.downsample(partition, scan)
+                cold_archive.purge('click_logs', partition.month_end)
+            else:
+                self.downsample(partition)
+                self._table(partition.table_name).drop(db.session.connection(), checkfirst=True)
+            partition.status = 'dropped'
+            partition.dropped_at = datetime.utcnow()
+            db.session.commit()
+
+            self._ensured.discard(partition.table_name)
+            dropped.append(partition.table_name)
+
+        # عينات الوضع التقريبي تتبع مدة الاحتفاظ نفسها
+        from src.analytics.sampling import click_sampler
+        click_sampler.prune(cutoff)
+
+        return dropped
+
+    def downsample(self, partition, table=None):
+        """كتابة الملخص اليومي لقسم شهري (من جدوله الحي أو من جدول مسح الأرشيف)"""
+        table = self._table(partition.table_name) if table is None else table
+        day = func.date(table.c.timestamp)
+        in_month = (table.c.timestamp >= partition.month_start) & (table.c.timestamp < partition.month_end)
+
+        totals = db.session.execute(
+            select(
+                day.label('day'),
+                table.c.url_id,
+                func.count().label('clicks'),
+                func.count(func.distinct(table.c.ip_address)).label('unique_visitors')
+            ).where(in_month).group_by(day, table.c.url_id)
+        ).all()
+        db.session.bulk_insert_mappings(ClickDailyAggregate, [
+            {
+                'day': self._as_date(row.day),
+                'url_id': row.url_id,
+                'clicks': row.clicks,
+                'unique_visitors': row.unique_visitors
+            }
+            for row in totals
+        ])
+
+        for dimension in BREAKDOWN_DIMENSIONS:
+            column = table.c[dimension]
+            rows = db.session.execute(
+                select(day.label('day'), table.c.url_id, column, func.count().label('clicks'))
+                .where(in_month).group_by(day, table.c.url_id, column)
+            ).all()
+            db.session.bulk_insert_mappings(ClickDailyBreakdown, [
+                {
+                    'day': self._as_date(row.day),
+                    'url_id': row.url_id,
+                    'dimension': dimension,
+                    'value_key': '' if row[2] is None else str(row[2]),
+                    'clicks': row.clicks
+                }
+                for row in rows
+            ])
+
+    # ==================== أدوات داخلية ====================
+
+    @staticmethod
+    def _column_names():
+        return [column.name for column in ClickLog.__table__.columns]
+
+    def _table(self, name):
+        """تعريف جدول القسم بنفس أعمدة click_logs (بدون قيود المفاتيح الخارجية)"""
+        if name in self._metadata.tables:
+            return self._metadata.tables[name]
+
+        columns = [
+            Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+            for column in ClickLog.__table__.columns
+        ]
+        table = Table(name, self._metadata, *columns)
+        for spec in CLICK_LOG_INDEXES:
+            Index(spec.name_for(name), *[table.c[column] for column in spec.columns])
+        return table
+
+    @staticmethod
+    def _filter_urls(query, column, url_id, url_ids):
+        if url_id is not None:
+            query = query.filter(column == url_id)
+        if url_ids is not None:
+            query = query.filter(column.in_(url_ids))
+        return query
+
+    @staticmethod
+    def _as_date(value):
+        if isinstance(value, date):
+            return value
+        return datetime.strptime(str(value), '%Y-%m-%d').date()
+
+    @staticmethod
+    def _as_datetime(value):
+        # الاستعلامات المجمعة عبر UNION تعيد النص كما خُزّن في SQLite
+        if value is None or isinstance(value, datetime):
+            return value
+        return datetime.fromisoformat(str(value))
+
+    @staticmethod
+    def _decode_value_key(dimension, value_key):
+        if value_key == '':
+            return None
+        if dimension.endswith('_id'):
+            return int(value_key)
+        return value_key
+
+
+click_router = ClickPartitionRouter()
@@ -0,0 +1,319 @@
+"""
+الوضع التقريبي للتحليلات عبر عينات الخزان الطبقية
+يحتفظ بعينة ثابتة الحجم من نقرات كل رابط في كل شهر مع العدد الفعلي للنقرات،
+فتُقدَّر الأعداد والتوزيعات للفترات الطويلة من العينة مع فترات ثقة بدلاً من مسح كل النقرات.
+الطبقة الشهرية تجعل الروابط قليلة النقرات يومياً تُعايَن أيضاً (الطبقة اليومية كانت تحفظها كاملة)،
+ويوم كل نقرة محفوظ في العينة لتقييد التقدير بالفترة المطلوبة
+"""
+
+import math
+import os
+import random
+from datetime import datetime
+from statistics import NormalDist
+from sqlalchemy import select, func
+from src.models.user import db
+from src.security.epoch import try_lock
+from src.models.analytics import (
+    ClickSample, ClickSampleStratum, ClickPartition, ClickDailyAggregate, ClickDailyBreakdown
+)
+from src.analytics.partitions import ClickPartitionRouter, click_router
+
+# الأعمدة المحفوظة في العينة (تكفي للتوزيعات والزوار الفريدين)
+SAMPLE_COLUMNS = ['ip_address', 'device_type', 'browser_id', 'os_id', 'referrer_domain_id']
+
+
+def _dialect_insert(model):
+    """INSERT يدعم ON CONFLICT حسب محرك قاعدة البيانات"""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+
+def _month_of(value):
+    """أول يوم في شهر التاريخ (مفتاح الطبقة)"""
+    return value.date().replace(day=1) if isinstance(value, datetime) else value.replace(day=1)
+
+
+class ClickSampler:
+    """مدير عينات النقرات والتقديرات التقريبية"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self._random = random.Random()
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """تهيئة المُعايِن مع التطبيق"""
+        self.app = app
+        instance_dir = os.getenv('INSTANCE_DIR', app.instance_path)
+        app.config.setdefault('CLICK_SAMPLE_SIZE', 1000)  # حجم العينة لكل رابط في الشهر
+        app.config.setdefault('APPROXIMATE_CONFIDENCE', 0.95)
+        app.config.setdefault('APPROXIMATE_AUTO_DAYS', 90)  # الحد الأدنى للفترة في الوضع التلقائي
+        app.config.setdefault('CLICK_SAMPLE_LOCK_FILE', os.path.join(instance_dir, 'click_samples.lock'))
+        app.extensions['click_sampler'] = self
+
+    @property
+    def sample_size(self):
+        return self.app.config['CLICK_SAMPLE_SIZE']
+
+    def wants_approximate(self, value, days):
+        """تفسير معامل approximate في الطلب: true / false / auto"""
+        value = (value or 'false').lower()
+        if value == 'auto':
+            return days >= self.app.config['APPROXIMATE_AUTO_DAYS']
+        return value in ('true', '1', 'yes')
+
+    # ==================== بناء العينة ====================
+
+    def observe(self, click_log):
+        """تحديث عينة الخزان بنقرة جديدة (الخوارزمية R)
+
+        عبارة واحدة لكل توجيه (زيادة العداد مع RETURNING)، والكتابة في العينة
+        فقط للنقرات المختارة، وهي نادرة بعد امتلاء خزان الشهر.
+        """
+        month = _month_of(click_log.timestamp)
+
+        stmt = _dialect_insert(ClickSampleStratum).values(month=month, url_id=click_log.url_id, seen=1)
+        seen = db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['month', 'url_id'],
+            set_={'seen': ClickSampleStratum.seen + 1}
+        ).returning(ClickSampleStratum.seen)).scalar()
+
+        if seen <= self.sample_size:
+            slot = seen - 1
+        else:
+            slot = self._random.randrange(seen)
+            if slot >= self.sample_size:
+                return
+
+        values = {name: getattr(click_log, name) for name in SAMPLE_COLUMNS}
+        values['day'] = click_log.timestamp.date()
+        stmt = _dialect_insert(ClickSample).values(month=month, url_id=click_log.url_id, slot=slot, **values)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['month', 'url_id', 'slot'],
+            set_=values
+        ))
+
+    def backfill(self):
+        """بناء العينات للأقسام الحية التي لا تملك طبقات بعد (قابلة للإعادة)
+
+        تشغيل واحد في كل الخادم تحت قفل ملف: يعيد None إن كان عامل آخر يبنيها الآن.
+        """
+        lock = try_lock(self.app.config['CLICK_SAMPLE_LOCK_FILE'])
+        if lock is None:
+            return None
+        try:
+            built = []
+            for partition in ClickPartition.query.filter_by(status='live').order_by(ClickPartition.month_start).all():
+                month = _month_of(partition.month_start)
+                exists = db.session.query(ClickSampleStratum.month).filter(
+                    ClickSampleStratum.month == month
+                ).first()
+                if exists:
+                    continue
+
+                self._backfill_table(click_router._table(partition.table_name), month)
+                built.append(partition.table_name)
+
+            return built
+        finally:
+            lock.close()
+
+    def _backfill_table(self, table, month):
+        """تمرير واحد على القسم مرتباً حسب الرابط مع تفريغ الخزان عند تغير الرابط"""
+        columns = [table.c.url_id, table.c.timestamp] + [table.c[name] for name in SAMPLE_COLUMNS]
+        result = db.session.execute(select(*columns).order_by(table.c.url_id, table.c.timestamp))
+
+        current_url = None
+        seen, sample = 0, []
+
+        for row in result.mappings():
+            if row['url_id'] != current_url:
+                self._flush(month, current_url, seen, sample)
+                current_url = row['url_id']
+                seen, sample = 0, []
+
+            seen += 1
+            values = {name: row[name] for name in SAMPLE_COLUMNS}
+            values['day'] = row['timestamp'].date()
+            if seen <= self.sample_size:
+                sample.append(values)
+            else:
+                slot = self._random.randrange(seen)
+                if slot < self.sample_size:
+                    sample[slot] = values
+
+        self._flush(month, current_url, seen, sample)
+        db.session.commit()
+
+    def _flush(self, month, url_id, seen, sample):
+        if url_id is None or not seen:
+            return
+
+        db.session.execute(ClickSampleStratum.__table__.insert(), [
+            {'month': month, 'url_id': url_id, 'seen': seen}
+        ])
+        db.session.execute(ClickSample.__table__.insert(), [
+            dict(values, month=month, url_id=url_id, slot=slot)
+            for slot, values in enumerate(sample)
+        ])
+
+    def prune(self, before):
+        """حذف طبقات وعينات الأشهر السابقة لبداية مدة الاحتفاظ (تُقرأ من الملخصات اليومية بعدها)"""
+        month = _month_of(before)
+        db.session.execute(ClickSample.__table__.delete().where(ClickSample.month < month))
+        db.session.execute(ClickSampleStratum.__table__.delete().where(ClickSampleStratum.month < month))
+        db.session.commit()
+
+    # ==================== التقديرات ====================
+
+    def _strata(self, start, end, url_id=None, url_ids=None):
+        """طبقات الأشهر المتقاطعة مع الفترة: (الشهر، الرابط) ← (حجم العينة، النقرات الفعلية)"""
+        months = [ClickSampleStratum.month >= _month_of(start), ClickSampleStratum.month <= end.date()]
+        seen = db.session.query(
+            ClickSampleStratum.month, ClickSampleStratum.url_id, ClickSampleStratum.seen
+        ).filter(*months)
+        seen = self._filter_urls(seen, ClickSampleStratum.url_id, url_id, url_ids)
+
+        sizes = db.session.query(
+            ClickSample.month, ClickSample.url_id, func.count().label('n')
+        ).filter(ClickSample.month >= _month_of(start), ClickSample.month <= end.date())
+        sizes = self._filter_urls(sizes, ClickSample.url_id, url_id, url_ids)
+        sizes = {(row.month, row.url_id): row.n for row in sizes.group_by(ClickSample.month, ClickSample.url_id).all()}
+
+        return {
+            (row.month, row.url_id): (sizes.get((row.month, row.url_id), 0), row.seen)
+            for row in seen.all()
+        }
+
+    def _in_period(self, query, start, end, url_id=None):
+        query = query.filter(ClickSample.day >= start.date(), ClickSample.day <= end.date())
+        return self._filter_urls(query, ClickSample.url_id, url_id, None)
+
+    def daily_totals(self, start, end=None, url_id=None, url_ids=None):
+        """تقدير النقرات اليومية: كل نقرة في العينة تمثل (نقرات الطبقة / حجم عينتها)
+
+        الأيام التي حُذفت أقسامها (وعيناتها) تؤخذ من الملخص اليومي بدقة.
+        """
+        end = end or datetime.utcnow()
+        strata = self._strata(start, end, url_id, url_ids)
+
+        query = db.session.query(
+            ClickSample.month, ClickSample.url_id, ClickSample.day, func.count().label('k')
+        ).filter(ClickSample.day >= start.date(), ClickSample.day <= end.date())
+        query = self._filter_urls(query, ClickSample.url_id, url_id, url_ids)
+
+        estimates = {}
+        for month, stratum_url, day, k in query.group_by(ClickSample.month, ClickSample.url_id, ClickSample.day).all():
+            n, population = strata.get((month, stratum_url), (k, k))
+            estimates[str(day)] = estimates.get(str(day), 0) + population * k / max(n, 1)
+        totals = {day: int(round(value)) for day, value in estimates.items()}
+
+        sampled_months = {month for month, _ in strata}
+        agg = db.session.query(
+            ClickDailyAggregate.day,
+            func.sum(ClickDailyAggregate.clicks).label('clicks')
+        ).filter(
+            ClickDailyAggregate.day >= start.date(),
+            ClickDailyAggregate.day <= end.date()
+        )
+        agg = self._filter_urls(agg, ClickDailyAggregate.url_id, url_id, url_ids)
+        for row in agg.group_by(ClickDailyAggregate.day).all():
+            if _month_of(row.day) not in sampled_months:
+                totals[str(row.day)] = totals.get(str(row.day), 0) + row.clicks
+
+        return sorted(totals.items())
+
+    def breakdown(self, dimension, start, end=None, url_id=None, limit=None):
+        """تقدير توزيع بعد من العينة مع فترة ثقة لكل قيمة
+
+        يُرجع قائمة (القيمة، التقدير، الحد الأدنى، الحد الأعلى) مرتبة تنازلياً.
+        التقدير طبقي: كل طبقة تُكبَّر بنسبة نقراتها الفعلية إلى حجم عينتها، ونقرات
+        العينة خارج الفترة تُحسب بقيمة صفر، والتباين يشمل تصحيح المجتمع المحدود
+        فيصبح صفراً للطبقات المكتملة.
+        """
+        end = end or datetime.utcnow()
+        column = getattr(ClickSample, dimension)
+        strata = self._strata(start, end, url_id)
+
+        counts = self._in_period(
+            db.session.query(ClickSample.month, ClickSample.url_id, column, func.count().label('k')),
+            start, end, url_id
+        )
+
+        estimates = {}
+        variances = {}
+        for month, stratum_url, value, k in counts.group_by(ClickSample.month, ClickSample.url_id, column).all():
+            n, population = strata.get((month, stratum_url), (k, k))
+            p = k / n
+            estimates[value] = estimates.get(value, 0) + population * p
+            if n > 1 and population > n:
+                variance = population ** 2 * (1 - n / population) * p * (1 - p) / (n - 1)
+                variances[value] = variances.get(value, 0) + variance
+
+        # ملخصات الأيام التي لا تملك عينات تُضاف بلا تباين
+        sampled_months = {month for month, _ in strata}
+        agg = db.session.query(
+            ClickDailyBreakdown.day, ClickDailyBreakdown.value_key, ClickDailyBreakdown.clicks
+        ).filter(
+            ClickDailyBreakdown.dimension == dimension,
+            ClickDailyBreakdown.day >= start.date(),
+            ClickDailyBreakdown.day <= end.date()
+        )
+        agg = self._filter_urls(agg, ClickDailyBreakdown.url_id, url_id, None)
+        for day, value_key, clicks in agg.all():
+            if _month_of(day) in sampled_months:
+                continue
+            value = self._decode_value_key(dimension, value_key)
+            estimates[value] = estimates.get(value, 0) + clicks
+
+        z = NormalDist().inv_cdf((1 + self.app.config['APPROXIMATE_CONFIDENCE']) / 2)
+        result = []
+        for value, estimate in estimates.items():
+            margin = z * math.sqrt(variances.get(value, 0))
+            result.append((
+                value,
+                int(round(estimate)),
+                max(0, int(math.floor(estimate - margin))),
+                int(math.ceil(estimate + margin))
+            ))
+
+        result.sort(key=lambda item: item[1], reverse=True)
+        return result[:limit] if limit else result
+
+    def unique_visitors(self, start, end=None, url_id=None):
+        """حدود الزوار الفريدين: (عدد العناوين المميزة في العينة، تقدير إجمالي النقرات)"""
+        end = end or datetime.utcnow()
+        query = self._in_period(
+            db.session.query(func.count(func.distinct(ClickSample.ip_address))), start, end, url_id
+        )
+        lower = query.scalar() or 0
+        upper = sum(clicks for _, clicks in self.daily_totals(start, end, url_id=url_id))
+        return lower, max(lower, upper)
+
+    def metadata(self, start, end=None, url_id=None):
+        """وصف التقريب المرفق باستجابة الواجهة"""
+        end = end or datetime.utcnow()
+        strata = self._strata(start, end, url_id)
+        sampled = self._in_period(db.session.query(func.count()).select_from(ClickSample), start, end, url_id).scalar()
+
+        return {
+            'method': 'stratified_reservoir',
+            'stratum': 'url_month',
+            'confidence': self.app.config['APPROXIMATE_CONFIDENCE'],
+            'sample_size_per_stratum': self.sample_size,
+            'strata': len(strata),
+            'sampled_clicks': sampled,
+            'population_clicks': sum(population for _, population in strata.values())
+        }
+
+    _filter_urls = staticmethod(ClickPartitionRouter._filter_urls)
+    _decode_value_key = staticmethod(ClickPartitionRouter._decode_value_key)
+
+
+click_sampler = ClickSampler()
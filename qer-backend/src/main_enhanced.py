@@ -18,8 +18,10 @@ from src.models.user import db, User
 from src.models.url import ShortenedUrl as URL
 from src.models.role import Role, Permission
 from src.models.analytics import ClickLog
-from src.security import SecurityManager, AuditLogger
-from src.analytics import AnalyticsEngine
+from src.models.url_search import url_search
+from src.security import SecurityManager, AuditLogger, permission_compiler, identity_manager, token_revocations, breached_passwords, audit_writer, audit_retention, audit_search
+from src.analytics import AnalyticsEngine, click_router, cold_archive, click_sampler
+from src.migrations import apply_performance_indexes
 
 # استيراد نقاط النهاية
 from src.routes.auth import auth_bp
@@ -41,13 +43,48 @@ def create_app(config_name='development'):
     app.config['LOCKOUT_DURATION'] = int(os.getenv('LOCKOUT_DURATION', '900'))  # 15 دقيقة
     app.config['RATE_LIMIT_REQUESTS'] = int(os.getenv('RATE_LIMIT_REQUESTS', '100'))
     app.config['RATE_LIMIT_WINDOW'] = int(os.getenv('RATE_LIMIT_WINDOW', '3600'))  # ساعة
+    app.config['RATE_LIMIT_USER_REQUESTS'] = int(os.getenv('RATE_LIMIT_USER_REQUESTS', '1000'))
+    app.config['ANALYTICS_RATE_LIMIT_UNITS'] = int(os.getenv('ANALYTICS_RATE_LIMIT_UNITS', '200'))
+    if os.getenv('IP_BLOCKLIST_FILE'):
+        app.config['IP_BLOCKLIST_FILE'] = os.getenv('IP_BLOCKLIST_FILE')  # قائمة نطاقات محظورة تُعاد قراءتها عند تعديلها
+    if os.getenv('RATE_LIMIT_DB'):
+        app.config['RATE_LIMIT_DB'] = os.getenv('RATE_LIMIT_DB')  # ملف مشترك بين العمال
     app.config['PASSWORD_MIN_LENGTH'] = int(os.getenv('PASSWORD_MIN_LENGTH', '8'))
     app.config['REQUIRE_STRONG_PASSWORD'] = os.getenv('REQUIRE_STRONG_PASSWORD', 'True').lower() == 'true'
+    if os.getenv('BREACHED_PASSWORDS_SOURCE'):
+        app.config['BREACHED_PASSWORDS_SOURCE'] = os.getenv('BREACHED_PASSWORDS_SOURCE')  # قائمة كلمات المرور المسربة
+    app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+    app.config['PASSWORD_HASH_QUEUE_SIZE'] = int(os.getenv('PASSWORD_HASH_QUEUE_SIZE', '16'))
     
     # إعدادات النطاق المخصص
     app.config['DOMAIN'] = os.getenv('DOMAIN', 'rfah.me')
     app.config['BASE_URL'] = os.getenv('BASE_URL', 'https://rfah.me')
     
+    # إعدادات تخزين النقرات
+    app.config['CLICK_MIGRATION_CHUNK_SIZE'] = int(os.getenv('CLICK_MIGRATION_CHUNK_SIZE', '1000'))
+    app.config['CLICK_RETENTION_MONTHS'] = int(os.getenv('CLICK_RETENTION_MONTHS', '24'))
+    app.config['CLICK_PARTITION_CHUNK_SIZE'] = app.config['CLICK_MIGRATION_CHUNK_SIZE']
+    
+    app.config['CLICK_SAMPLE_SIZE'] = int(os.getenv('CLICK_SAMPLE_SIZE', '1000'))  # لكل رابط في الشهر
+    app.config['APPROXIMATE_AUTO_DAYS'] = int(os.getenv('APPROXIMATE_AUTO_DAYS', '90'))
+    app.config['APPLY_PERFORMANCE_INDEXES'] = os.getenv('APPLY_PERFORMANCE_INDEXES', 'True').lower() == 'true'
+    
+    # إعدادات المراجعة: url_accessed=full لتسجيل كل وصول صفاً مستقلاً
+    if os.getenv('AUDIT_URL_ACCESS_POLICY'):
+        app.config['AUDIT_POLICIES'] = {'url_accessed': os.getenv('AUDIT_URL_ACCESS_POLICY')}
+    app.config['AUDIT_AGGREGATE_SAMPLES'] = int(os.getenv('AUDIT_AGGREGATE_SAMPLES', '5'))
+    app.config['AUDIT_RETENTION_DAYS'] = int(os.getenv('AUDIT_RETENTION_DAYS', '365'))
+    app.config['AUDIT_RETENTION_INTERVAL'] = int(os.getenv('AUDIT_RETENTION_INTERVAL', '0'))  # 86400 = يومياً
+    app.config['AUDIT_RETENTION_ARCHIVE'] = os.getenv('AUDIT_RETENTION_ARCHIVE', 'True').lower() == 'true'
+    
+    # إعدادات الأرشيف البارد
+    app.config['ARCHIVE_ON_STARTUP'] = os.getenv('ARCHIVE_ON_STARTUP', 'True').lower() == 'true'
+    app.config['CLICK_ARCHIVE_AFTER_DAYS'] = int(os.getenv('CLICK_ARCHIVE_AFTER_DAYS', '180'))
+    app.config['AUDIT_ARCHIVE_AFTER_DAYS'] = int(os.getenv('AUDIT_ARCHIVE_AFTER_DAYS', '90'))
+    if os.getenv('ARCHIVE_DIR'):
+        app.config['ARCHIVE_DIR'] = os.getenv('ARCHIVE_DIR')
+    
     # تهيئة قاعدة البيانات
     db.init_app(app)
     
@@ -58,6 +95,12 @@ def create_app(config_name='development'):
     security_manager = SecurityManager(app)
     audit_logger = AuditLogger(app)
     analytics_engine = AnalyticsEngine(app)
+    click_router.init_app(app)
+    cold_archive.init_app(app)
+    url_search.init_app(app)
+    click_sampler.init_app(app)
+    permission_compiler.init_app(app)
+    identity_manager.init_app(app)
     
     # تسجيل نقاط النهاية
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
@@ -114,7 +157,32 @@ def create_app(config_name='development'):
     # إنشاء الجداول والبيانات الأولية
     with app.app_context():
         db.create_all()
+        permission_compiler.ensure_schema()
+        token_revocations.purge_expired()
+        # فهارس البحث النصي ومحفزاتها قبل أي إدراج أو حذف في audit_logs و shortened_urls
+        audit_search.ensure_schema()
+        url_search.ensure_schema()
+        # عدادات المراجعة اليومية لسجلات سبقت إضافتها (قبل الأرشفة وإعادة الإدراج)
+        audit_logger.rebuild_counters_if_empty()
+        # أحداث مراجعة بقيت في الملف الاحتياطي أثناء تعطل القاعدة
+        audit_writer.replay_fallback()
+        # ترجمة قائمة كلمات المرور المسربة إن تغيرت منذ آخر تشغيل (عامل واحد تحت قفل ملف)
+        breached_passwords.compile_if_stale()
+        # نقل النقرات من الجدول الموحد إلى الأقسام الشهرية ثم تطبيق سياسة الاحتفاظ
+        click_router.migrate_legacy_clicks()
+        # بناء عينات الوضع التقريبي قبل أرشفة الأقسام أو حذفها (عامل واحد تحت قفل ملف)
+        click_sampler.backfill()
+        # سياسة الاحتفاظ ثم الأرشفة تحت قفل ملف واحد (عامل واحد فقط ينفذها)
+        cold_archive.run(archive=app.config['ARCHIVE_ON_STARTUP'])
+        if app.config['APPLY_PERFORMANCE_INDEXES']:
+            apply_performance_indexes()
         create_initial_data()
+        # تصريف أقنعة الأدوار بعد إنشاء الصلاحيات الأولية
+        permission_compiler.rebuild()
+        db.session.commit()
+    
+    # حذف سجلات المراجعة القديمة دورياً على دفعات (AUDIT_RETENTION_INTERVAL)
+    audit_retention.start_scheduler()
     
     return app
 
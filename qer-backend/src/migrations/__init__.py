@@ -0,0 +1,13 @@
+"""
+أدوات ترحيل قاعدة البيانات لنظام رفاه
+"""
+
+from .indexes import (
+    IndexSpec, IndexMigrator, PERFORMANCE_INDEXES, CLICK_LOG_INDEXES,
+    apply_performance_indexes, explain_query_plan, check_index_usage
+)
+
+__all__ = [
+    'IndexSpec', 'IndexMigrator', 'PERFORMANCE_INDEXES', 'CLICK_LOG_INDEXES',
+    'apply_performance_indexes', 'explain_query_plan', 'check_index_usage'
+]
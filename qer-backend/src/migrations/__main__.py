@@ -0,0 +1,53 @@
+"""
+تشغيل ترحيل الفهارس من سطر الأوامر
+
+    python -m src.migrations            # تطبيق الفهارس الناقصة
+    python -m src.migrations --check    # عرض خطط الاستعلامات الساخنة
+    python -m src.migrations --click-dimensions [--vacuum]   # ترميز نصوص النقرات القديمة (مرة واحدة)
+"""
+
+import os
+import sys
+from flask import Flask
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from src.models.user import db
+import src.models.url  # noqa: F401
+import src.models.analytics  # noqa: F401
+import src.security.audit_logger  # noqa: F401
+from src.models.dimensions import migrate_click_dimensions
+from src.migrations.indexes import apply_performance_indexes, check_index_usage
+
+
+def main(argv):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///rfah_system.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    with app.app_context():
+        if '--click-dimensions' in argv:
+            chunk_size = int(os.getenv('CLICK_MIGRATION_CHUNK_SIZE', '1000'))
+            converted = migrate_click_dimensions(chunk_size=chunk_size, vacuum='--vacuum' in argv)
+            print(f'{converted} click rows converted')
+            return 0
+
+        if '--check' not in argv:
+            for item in apply_performance_indexes(drop_obsolete='--keep-obsolete' not in argv):
+                print(f"{item['status']:8} {item['table']}.{item['index']}")
+
+        if '--check' in argv or '--verify' in argv:
+            failed = 0
+            for result in check_index_usage():
+                mark = 'OK  ' if result['uses_index'] else 'MISS'
+                failed += 0 if result['uses_index'] else 1
+                print(f"{mark} {result['query']}: {' | '.join(result['plan'])}")
+            return 1 if failed else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
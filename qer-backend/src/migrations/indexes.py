@@ -0,0 +1,281 @@
+"""
+فهارس الأداء لمسارات الاستعلام الساخنة
+تعريفات الفهارس المركبة والجزئية والمغطية مع أداة تطبيقها أثناء عمل النظام
+"""
+
+import time
+from sqlalchemy import inspect, text
+from src.models.user import db
+
+
+class IndexSpec:
+    """تعريف فهرس واحد
+
+    يمكن أن يحتوي الاسم على {table} ليُطبّق التعريف على عائلة جداول
+    (جدول click_logs الموحد وكل أقسامه الشهرية).
+    """
+
+    def __init__(self, name, table, columns, where=None, description=''):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.where = where
+        self.description = description
+
+    def name_for(self, table_name):
+        return self.name.format(table=table_name)
+
+    def create_sql(self, table_name, concurrently=False):
+        keyword = 'CREATE INDEX CONCURRENTLY IF NOT EXISTS' if concurrently else 'CREATE INDEX IF NOT EXISTS'
+        sql = f'{keyword} {self.name_for(table_name)} ON {table_name} ({", ".join(self.columns)})'
+        if self.where:
+            sql += f' WHERE {self.where}'
+        return sql
+
+
+# فهارس جدول النقرات، تُنشأ أيضاً مع كل قسم شهري جديد
+CLICK_LOG_INDEXES = [
+    IndexSpec(
+        'ix_{table}_timestamp', 'click_logs', ['timestamp'],
+        description='النطاقات الزمنية على مستوى النظام (الإحصائيات اليومية والاحتفاظ)'
+    ),
+    IndexSpec(
+        'ix_{table}_url_timestamp_covering', 'click_logs',
+        ['url_id', 'timestamp', 'ip_address', 'device_type', 'browser_id', 'os_id', 'referrer_domain_id'],
+        description='فهرس مغطٍّ لإحصائيات الرابط: العد والزوار الفريدون وتجميعات GROUP BY دون قراءة الجدول'
+    ),
+]
+
+# فهارس قديمة أصبحت زائدة بعد إضافة الفهرس المغطي (بادئته نفس الأعمدة)
+OBSOLETE_CLICK_LOG_INDEXES = ['ix_{table}_url_id_timestamp']
+
+PERFORMANCE_INDEXES = [
+    # الروابط: أغلب الاستعلامات تستبعد المحذوفة وتفرز حسب النقرات
+    IndexSpec(
+        'ix_shortened_urls_user_id', 'shortened_urls', ['user_id'],
+        description='روابط المستخدم بما فيها المحذوفة'
+    ),
+    IndexSpec(
+        'ix_shortened_urls_user_active', 'shortened_urls', ['user_id', 'is_active', 'clicks'],
+        where='deleted_at IS NULL',
+        description='روابط المستخدم غير المحذوفة (جزئي)'
+    ),
+    IndexSpec(
+        'ix_shortened_urls_active_clicks', 'shortened_urls', ['is_active', 'clicks'],
+        where='deleted_at IS NULL',
+        description='أكثر الروابط نقراً وعدّ الروابط النشطة ومجموع نقراتها (جزئي مغطٍّ)'
+    ),
+    IndexSpec(
+        'ix_shortened_urls_active_created', 'shortened_urls', ['is_active', 'created_at'],
+        where='deleted_at IS NULL',
+        description='الروابط الجديدة خلال فترة (جزئي)'
+    ),
+    IndexSpec(
+        'ix_shortened_urls_deleted_at', 'shortened_urls', ['deleted_at'],
+        where='deleted_at IS NOT NULL',
+        description='سلة المحذوفات (جزئي صغير)'
+    ),
+
+    # سجلات المراجعة: التصفية ثم الفرز تنازلياً حسب الوقت
+    IndexSpec(
+        'ix_audit_logs_event_type_timestamp', 'audit_logs', ['event_type', 'timestamp'],
+        description='تصفية السجلات حسب نوع الحدث'
+    ),
+    IndexSpec(
+        'ix_audit_logs_user_id_timestamp', 'audit_logs', ['user_id', 'timestamp'],
+        description='نشاط مستخدم محدد'
+    ),
+    IndexSpec(
+        'ix_audit_logs_ip_address_timestamp', 'audit_logs', ['ip_address', 'timestamp'],
+        description='نشاط عنوان IP محدد'
+    ),
+    IndexSpec(
+        'ix_audit_logs_timestamp_covering', 'audit_logs', ['timestamp', 'event_type', 'severity', 'success'],
+        description='فهرس مغطٍّ لتجميعات إحصائيات المراجعة'
+    ),
+
+    # التجميعات اليومية: المفتاح الأساسي يبدأ باليوم، والاستعلامات تبدأ بالرابط
+    IndexSpec(
+        'ix_click_daily_aggregates_url_day', 'click_daily_aggregates', ['url_id', 'day', 'clicks'],
+        description='المجاميع اليومية لرابط محدد'
+    ),
+    IndexSpec(
+        'ix_click_daily_breakdowns_dimension_url_day', 'click_daily_breakdowns',
+        ['dimension', 'url_id', 'day', 'value_key', 'clicks'],
+        description='توزيع بُعد محدد لرابط محدد'
+    ),
+]
+
+
+class IndexMigrator:
+    """تطبيق فهارس الأداء أثناء عمل النظام وبشكل قابل للإعادة
+
+    يُنشأ كل فهرس في معاملة مستقلة قصيرة حتى لا يُحجز قفل الكتابة طويلاً،
+    ومع مهلة انتظار حتى تنتظر عمليات gunicorn الأخرى بدلاً من الفشل.
+    في PostgreSQL يُستخدم CREATE INDEX CONCURRENTLY.
+    """
+
+    def __init__(self, engine=None, busy_timeout_ms=5000):
+        self.engine = engine or db.engine
+        self.busy_timeout_ms = busy_timeout_ms
+
+    @property
+    def dialect(self):
+        return self.engine.dialect.name
+
+    def click_log_tables(self):
+        """جدول click_logs الموحد مع الأقسام الشهرية الحية"""
+        names = inspect(self.engine).get_table_names()
+        return [name for name in names if name == 'click_logs' or (name.startswith('click_logs_') and name[11:].isdigit())]
+
+    def planned(self):
+        """قائمة (الجدول، التعريف) لكل الفهارس المطلوبة على الجداول الموجودة"""
+        existing_tables = set(inspect(self.engine).get_table_names())
+
+        plan = [(spec.table, spec) for spec in PERFORMANCE_INDEXES if spec.table in existing_tables]
+        for table_name in self.click_log_tables():
+            plan.extend((table_name, spec) for spec in CLICK_LOG_INDEXES)
+        return plan
+
+    def existing_indexes(self, table_name):
+        return {index['name'] for index in inspect(self.engine).get_indexes(table_name)}
+
+    def apply(self, drop_obsolete=True):
+        """إنشاء الفهارس الناقصة فقط وإرجاع تقرير بما تم"""
+        report = []
+        existing = {}
+
+        for table_name, spec in self.planned():
+            if table_name not in existing:
+                existing[table_name] = self.existing_indexes(table_name)
+
+            name = spec.name_for(table_name)
+            if name in existing[table_name]:
+                report.append({'index': name, 'table': table_name, 'status': 'exists'})
+                continue
+
+            started = time.monotonic()
+            self._execute(spec.create_sql(table_name, concurrently=self.dialect == 'postgresql'))
+            existing[table_name].add(name)
+            report.append({
+                'index': name,
+                'table': table_name,
+                'status': 'created',
+                'seconds': round(time.monotonic() - started, 3)
+            })
+
+        if drop_obsolete:
+            for table_name in self.click_log_tables():
+                indexes = existing.get(table_name) or self.existing_indexes(table_name)
+                for template in OBSOLETE_CLICK_LOG_INDEXES:
+                    name = template.format(table=table_name)
+                    if name in indexes:
+                        self._execute(f'DROP INDEX IF EXISTS {name}')
+                        report.append({'index': name, 'table': table_name, 'status': 'dropped'})
+
+        if self.dialect == 'sqlite' and any(item['status'] == 'created' for item in report):
+            # تحديث إحصائيات المخطط حتى يختار المخطط الفهارس الجديدة
+            self._execute('ANALYZE')
+
+        return report
+
+    def _execute(self, sql):
+        if self.dialect == 'postgresql':
+            # CONCURRENTLY لا يعمل داخل معاملة
+            with self.engine.connect() as conn:
+                conn.execution_options(isolation_level='AUTOCOMMIT').execute(text(sql))
+            return
+
+        with self.engine.begin() as conn:
+            if self.dialect == 'sqlite':
+                conn.execute(text(f'PRAGMA busy_timeout = {int(self.busy_timeout_ms)}'))
+            conn.execute(text(sql))
+
+
+def apply_performance_indexes(drop_obsolete=True):
+    """تطبيق فهارس الأداء على قاعدة بيانات التطبيق الحالي"""
+    return IndexMigrator().apply(drop_obsolete=drop_obsolete)
+
+
+# ==================== التحقق من خطط الاستعلام ====================
+
+def explain_query_plan(query, params=None):
+    """إرجاع أسطر EXPLAIN QUERY PLAN لاستعلام (نص SQL أو استعلام SQLAlchemy)"""
+    if isinstance(query, str):
+        rows = db.session.execute(text(f'EXPLAIN QUERY PLAN {query}'), params or {}).fetchall()
+        return [row[-1] for row in rows]
+
+    statement = query.statement if hasattr(query, 'statement') else query
+    compiled = statement.compile(db.engine)
+    # قيم المعاملات لا تؤثر على الخطة إلا قليلاً، فتكفي صيغتها النصية للتواريخ
+    values = tuple(
+        str(value) if hasattr(value, 'isoformat') else value
+        for value in (compiled.params[name] for name in (compiled.positiontup or []))
+    )
+    rows = db.session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', values).fetchall()
+    return [row[-1] for row in rows]
+
+
+def hot_path_queries():
+    """استعلامات ممثلة للمسارات الساخنة مع الفهرس المتوقع لكل منها"""
+    from datetime import datetime, timedelta
+    from sqlalchemy import func
+    from src.models.url import ShortenedUrl
+    from src.models.analytics import ClickLog
+    from src.security.audit_logger import AuditLog
+
+    since = datetime.utcnow() - timedelta(days=30)
+
+    return [
+        (
+            'top_urls',
+            ShortenedUrl.query.filter_by(is_active=True, deleted_at=None).order_by(ShortenedUrl.clicks.desc()).limit(10),
+            'ix_shortened_urls_active_clicks'
+        ),
+        (
+            'user_urls',
+            ShortenedUrl.query.filter_by(user_id=1, is_active=True, deleted_at=None),
+            'ix_shortened_urls_user_active'
+        ),
+        (
+            'deleted_urls',
+            ShortenedUrl.query.filter(ShortenedUrl.deleted_at.isnot(None)),
+            'ix_shortened_urls_deleted_at'
+        ),
+        (
+            'url_click_breakdown',
+            db.session.query(ClickLog.browser_id, func.count(ClickLog.id)).filter(
+                ClickLog.url_id == 1, ClickLog.timestamp >= since
+            ).group_by(ClickLog.browser_id),
+            'ix_click_logs_url_timestamp_covering'
+        ),
+        (
+            'url_unique_visitors',
+            db.session.query(func.count(func.distinct(ClickLog.ip_address))).filter(
+                ClickLog.url_id == 1, ClickLog.timestamp >= since
+            ),
+            'ix_click_logs_url_timestamp_covering'
+        ),
+        (
+            'audit_by_event',
+            AuditLog.query.filter(AuditLog.event_type == 'login_failed').order_by(AuditLog.timestamp.desc()).limit(50),
+            'ix_audit_logs_event_type_timestamp'
+        ),
+    ]
+
+
+def check_index_usage():
+    """التحقق من أن كل استعلام ساخن يستخدم الفهرس المتوقع (SQLite فقط)
+
+    يُرجع قائمة نتائج فيها الخطة الكاملة وهل ظهر الفهرس المتوقع فيها.
+    """
+    results = []
+    for name, query, expected in hot_path_queries():
+        plan = explain_query_plan(query)
+        results.append({
+            'query': name,
+            'expected_index': expected,
+            'uses_index': any(expected in line for line in plan),
+            'plan': plan
+        })
+    return results
@@ -1,7 +1,11 @@
 from src.models.user import db
-from datetime import datetime
-from sqlalchemy import func, extract
+from datetime import datetime, timedelta
+from sqlalchemy import func, extract, and_
 from user_agents import parse
+from src.models.dimensions import (
+    dimension_cache, split_referrer,
+    UserAgentDim, ReferrerDomainDim, ReferrerPathDim, BrowserDim, OsDim
+)
 
 class ClickLog(db.Model):
     __tablename__ = 'click_logs'
@@ -9,31 +13,67 @@ class ClickLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     url_id = db.Column(db.Integer, db.ForeignKey('shortened_urls.id'), nullable=False)
     ip_address = db.Column(db.String(45), nullable=True)  # دعم IPv6
-    user_agent = db.Column(db.Text, nullable=True)
-    referer = db.Column(db.Text, nullable=True)  # الموقع المرجعي
     country = db.Column(db.String(100), nullable=True)  # البلد
     city = db.Column(db.String(100), nullable=True)  # المدينة
     device_type = db.Column(db.String(50), nullable=True)  # نوع الجهاز
-    browser = db.Column(db.String(100), nullable=True)  # المتصفح
-    os = db.Column(db.String(100), nullable=True)  # نظام التشغيل
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     
+    # مفاتيح جداول الأبعاد (ترميز قاموسي للنصوص المتكررة)
+    user_agent_id = db.Column(db.Integer, db.ForeignKey('dim_user_agents.id'), nullable=True)
+    referrer_domain_id = db.Column(db.Integer, db.ForeignKey('dim_referrer_domains.id'), nullable=True)
+    referrer_path_id = db.Column(db.Integer, db.ForeignKey('dim_referrer_paths.id'), nullable=True)
+    browser_id = db.Column(db.Integer, db.ForeignKey('dim_browsers.id'), nullable=True)
+    os_id = db.Column(db.Integer, db.ForeignKey('dim_os.id'), nullable=True)
+    
+    # أعمدة نصية قديمة، تبقى فارغة للسجلات الجديدة وتُفرَّغ بواسطة migrate_click_dimensions
+    user_agent_text = db.Column('user_agent', db.Text, nullable=True)
+    referer_text = db.Column('referer', db.Text, nullable=True)
+    browser_text = db.Column('browser', db.String(100), nullable=True)
+    os_text = db.Column('os', db.String(100), nullable=True)
+    
     def __init__(self, url_id, ip_address=None, user_agent=None, referer=None):
         self.url_id = url_id
         self.ip_address = ip_address
-        self.user_agent = user_agent
-        self.referer = referer
+        self.user_agent_id = dimension_cache.intern(UserAgentDim, user_agent)
+        
+        domain, path = split_referrer(referer)
+        self.referrer_domain_id = dimension_cache.intern(ReferrerDomainDim, domain)
+        self.referrer_path_id = dimension_cache.intern(ReferrerPathDim, path)
         
         # تحليل معلومات المتصفح والجهاز
         if user_agent:
             self.parse_user_agent(user_agent)
     
+    @property
+    def user_agent(self):
+        return dimension_cache.value_of(UserAgentDim, self.user_agent_id) or self.user_agent_text
+    
+    @property
+    def referer(self):
+        if self.referrer_domain_id is None and self.referrer_path_id is None:
+            return self.referer_text
+        domain = dimension_cache.value_of(ReferrerDomainDim, self.referrer_domain_id) or ''
+        path = dimension_cache.value_of(ReferrerPathDim, self.referrer_path_id) or ''
+        return f"{domain}{path}"
+    
+    @property
+    def browser(self):
+        return dimension_cache.value_of(BrowserDim, self.browser_id) or self.browser_text
+    
+    @property
+    def os(self):
+        return dimension_cache.value_of(OsDim, self.os_id) or self.os_text
+    
     def parse_user_agent(self, user_agent_string):
         """تحليل معلومات المتصفح والجهاز من User Agent"""
         try:
             user_agent = parse(user_agent_string)
-            self.browser = f"{user_agent.browser.family} {user_agent.browser.version_string}"
-            self.os = f"{user_agent.os.family} {user_agent.os.version_string}"
+            self.browser_id = dimension_cache.intern(
+                BrowserDim, f"{user_agent.browser.family} {user_agent.browser.version_string}"
+            )
+            self.os_id = dimension_cache.intern(
+                OsDim, f"{user_agent.os.family} {user_agent.os.version_string}"
+            )
             
             if user_agent.is_mobile:
                 self.device_type = 'mobile'
@@ -45,8 +85,8 @@ class ClickLog(db.Model):
                 self.device_type = 'other'
         except:
             # في حالة فشل التحليل، استخدم قيم افتراضية
-            self.browser = 'Unknown'
-            self.os = 'Unknown'
+            self.browser_id = dimension_cache.intern(BrowserDim, 'Unknown')
+            self.os_id = dimension_cache.intern(OsDim, 'Unknown')
             self.device_type = 'unknown'
     
     def to_dict(self):
@@ -65,39 +105,105 @@ class ClickLog(db.Model):
         }
 
 
+class ClickPartition(db.Model):
+    """فهرس أقسام سجلات النقرات الشهرية"""
+    __tablename__ = 'click_partitions'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(40), unique=True, nullable=False)
+    month_start = db.Column(db.DateTime, nullable=False, index=True)
+    month_end = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20), default='live', nullable=False)  # live / archived / dropped
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    dropped_at = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self):
+        return {
+            'table_name': self.table_name,
+            'month_start': self.month_start.strftime('%Y-%m-%d'),
+            'month_end': self.month_end.strftime('%Y-%m-%d'),
+            'status': self.status,
+            'dropped_at': self.dropped_at.strftime('%Y-%m-%d %H:%M:%S') if self.dropped_at else None
+        }
+
+
+class ClickDailyAggregate(db.Model):
+    """ملخص يومي للنقرات لكل رابط بعد حذف القسم الشهري الخام"""
+    __tablename__ = 'click_daily_aggregates'
+    
+    day = db.Column(db.Date, primary_key=True)
+    url_id = db.Column(db.Integer, primary_key=True)
+    clicks = db.Column(db.Integer, default=0, nullable=False)
+    unique_visitors = db.Column(db.Integer, default=0, nullable=False)
+
+
+class ClickDailyBreakdown(db.Model):
+    """توزيع النقرات اليومي حسب بعد (الجهاز، المتصفح، النظام، المصدر)"""
+    __tablename__ = 'click_daily_breakdowns'
+    
+    day = db.Column(db.Date, primary_key=True)
+    url_id = db.Column(db.Integer, primary_key=True)
+    dimension = db.Column(db.String(30), primary_key=True)
+    value_key = db.Column(db.String(100), primary_key=True)
+    clicks = db.Column(db.Integer, default=0, nullable=False)
+
+
+class ClickSampleStratum(db.Model):
+    """طبقة العينة (رابط في شهر) مع العدد الفعلي لنقراتها"""
+    __tablename__ = 'click_sample_strata'
+
+    month = db.Column(db.Date, primary_key=True)  # أول يوم في الشهر
+    url_id = db.Column(db.Integer, primary_key=True)
+    seen = db.Column(db.Integer, default=0, nullable=False)  # عدد النقرات الكلي (دقيق)
+
+
+class ClickSample(db.Model):
+    """عينة خزان (Reservoir) ثابتة الحجم من نقرات كل طبقة"""
+    __tablename__ = 'click_samples'
+
+    month = db.Column(db.Date, primary_key=True)
+    url_id = db.Column(db.Integer, primary_key=True)
+    slot = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)  # يوم النقرة لتقييد التقدير بالفترة المطلوبة
+    ip_address = db.Column(db.String(45), nullable=True)
+    device_type = db.Column(db.String(50), nullable=True)
+    browser_id = db.Column(db.Integer, nullable=True)
+    os_id = db.Column(db.Integer, nullable=True)
+    referrer_domain_id = db.Column(db.Integer, nullable=True)
+
+
 class Analytics:
-    """فئة لتوليد التقارير والإحصائيات المتقدمة"""
+    """فئة لتوليد التقارير والإحصائيات المتقدمة
+
+    استعلامات النقرات تمر عبر موجّه الأقسام الشهرية (click_router)
+    حتى تُستبعد الأقسام خارج الفترة وتُدمج ملخصات الأقسام المحذوفة.
+    """
     
     @staticmethod
     def get_user_stats(user_id, days=30):
         """جلب إحصائيات مستخدم محدد"""
         from src.models.url import ShortenedUrl
+        from src.analytics.partitions import click_router
+        
+        start_date = datetime.utcnow() - timedelta(days=days)
         
         # الروابط الخاصة بالمستخدم
         user_urls = ShortenedUrl.query.filter_by(user_id=user_id, is_active=True, deleted_at=None).all()
+        url_ids = [url.id for url in user_urls]
         
         # إجمالي الروابط والنقرات
         total_urls = len(user_urls)
         total_clicks = sum(url.clicks for url in user_urls)
         
+        # النقرات حسب اليوم
+        daily_clicks = click_router.daily_totals(start_date, url_ids=url_ids) if url_ids else []
+        
         # النقرات خلال فترة محددة
-        recent_clicks = db.session.query(func.sum(ShortenedUrl.clicks)).join(ClickLog).filter(
-            ShortenedUrl.user_id == user_id,
-            ClickLog.timestamp >= datetime.utcnow() - datetime.timedelta(days=days)
-        ).scalar() or 0
+        recent_clicks = sum(clicks for _, clicks in daily_clicks)
         
         # أكثر الروابط نقراً
         top_urls = sorted(user_urls, key=lambda x: x.clicks, reverse=True)[:5]
         
-        # النقرات حسب اليوم
-        daily_clicks = db.session.query(
-            func.date(ClickLog.timestamp).label('date'),
-            func.count(ClickLog.id).label('clicks')
-        ).join(ShortenedUrl).filter(
-            ShortenedUrl.user_id == user_id,
-            ClickLog.timestamp >= datetime.utcnow() - datetime.timedelta(days=days)
-        ).group_by(func.date(ClickLog.timestamp)).all()
-        
         return {
             'user_id': user_id,
             'total_urls': total_urls,
@@ -105,14 +211,22 @@ class Analytics:
             'recent_clicks': recent_clicks,
             'average_clicks_per_url': round(total_clicks / total_urls, 2) if total_urls > 0 else 0,
             'top_urls': [url.to_dict() for url in top_urls],
-            'daily_clicks': [{'date': str(row.date), 'clicks': row.clicks} for row in daily_clicks]
+            'daily_clicks': [{'date': day, 'clicks': clicks} for day, clicks in daily_clicks]
         }
     
     @staticmethod
-    def get_system_stats(days=30):
-        """جلب إحصائيات النظام العامة"""
+    def get_system_stats(days=30, approximate=False):
+        """جلب إحصائيات النظام العامة
+
+        في الوضع التقريبي تُقدَّر توزيعات النقرات من العينات اليومية مع فترات ثقة.
+        """
         from src.models.url import ShortenedUrl
         from src.models.user import User
+        from src.analytics.partitions import click_router
+        from src.analytics.sampling import click_sampler
+        
+        start_date = datetime.utcnow() - timedelta(days=days)
+        source = click_sampler if approximate else click_router
         
         # إحصائيات عامة
         total_users = User.query.filter_by(is_active=True, deleted_at=None).count()
@@ -121,20 +235,20 @@ class Analytics:
         
         # إحصائيات الفترة الأخيرة
         recent_users = User.query.filter(
-            User.created_at >= datetime.utcnow() - datetime.timedelta(days=days),
+            User.created_at >= start_date,
             User.is_active == True,
             User.deleted_at.is_(None)
         ).count()
         
         recent_urls = ShortenedUrl.query.filter(
-            ShortenedUrl.created_at >= datetime.utcnow() - datetime.timedelta(days=days),
+            ShortenedUrl.created_at >= start_date,
             ShortenedUrl.is_active == True,
             ShortenedUrl.deleted_at.is_(None)
         ).count()
         
-        recent_clicks = ClickLog.query.filter(
-            ClickLog.timestamp >= datetime.utcnow() - datetime.timedelta(days=days)
-        ).count()
+        # النقرات حسب اليوم
+        daily_clicks = source.daily_totals(start_date)
+        recent_clicks = sum(clicks for _, clicks in daily_clicks)
         
         # أكثر المستخدمين نشاطاً
         top_users = db.session.query(
@@ -151,31 +265,13 @@ class Analytics:
         # أكثر الروابط نقراً
         top_urls = ShortenedUrl.query.filter_by(is_active=True, deleted_at=None).order_by(ShortenedUrl.clicks.desc()).limit(10).all()
         
-        # النقرات حسب اليوم
-        daily_clicks = db.session.query(
-            func.date(ClickLog.timestamp).label('date'),
-            func.count(ClickLog.id).label('clicks')
-        ).filter(
-            ClickLog.timestamp >= datetime.utcnow() - datetime.timedelta(days=days)
-        ).group_by(func.date(ClickLog.timestamp)).all()
-        
         # النقرات حسب نوع الجهاز
-        device_stats = db.session.query(
-            ClickLog.device_type,
-            func.count(ClickLog.id).label('clicks')
-        ).filter(
-            ClickLog.timestamp >= datetime.utcnow() - datetime.timedelta(days=days)
-        ).group_by(ClickLog.device_type).all()
+        device_stats = source.breakdown('device_type', start_date)
         
-        # النقرات حسب المتصفح
-        browser_stats = db.session.query(
-            ClickLog.browser,
-            func.count(ClickLog.id).label('clicks')
-        ).filter(
-            ClickLog.timestamp >= datetime.utcnow() - datetime.timedelta(days=days)
-        ).group_by(ClickLog.browser).order_by(func.count(ClickLog.id).desc()).limit(10).all()
+        # النقرات حسب المتصفح (تجميع على المفتاح الصحيح ثم ربط الاسم)
+        browser_stats = source.breakdown('browser_id', start_date, limit=10)
         
-        return {
+        stats = {
             'total_users': total_users,
             'total_urls': total_urls,
             'total_clicks': total_clicks,
@@ -193,79 +289,136 @@ class Analytics:
                 } for row in top_users
             ],
             'top_urls': [url.to_dict() for url in top_urls],
-            'daily_clicks': [{'date': str(row.date), 'clicks': row.clicks} for row in daily_clicks],
-            'device_stats': [{'device_type': row.device_type or 'unknown', 'clicks': row.clicks} for row in device_stats],
-            'browser_stats': [{'browser': row.browser or 'unknown', 'clicks': row.clicks} for row in browser_stats]
+            'daily_clicks': [{'date': day, 'clicks': clicks} for day, clicks in daily_clicks],
+            'device_stats': Analytics._breakdown_rows(
+                device_stats, 'device_type', lambda device: device or 'unknown'
+            ),
+            'browser_stats': Analytics._breakdown_rows(
+                browser_stats, 'browser', lambda browser_id: dimension_cache.value_of(BrowserDim, browser_id) or 'unknown'
+            ),
+            'approximate': approximate
         }
+        if approximate:
+            stats['approximation'] = click_sampler.metadata(start_date)
+        return stats
     
     @staticmethod
-    def get_url_detailed_stats(url_id, days=30):
-        """جلب إحصائيات مفصلة لرابط محدد"""
+    def users_stats_query():
+        """إحصائيات روابط كل مستخدم نشط باستعلام مجمع واحد
+
+        المستخدمون LEFT JOIN الروابط النشطة مع GROUP BY، فيظهر المستخدم
+        الذي لا يملك روابط بأصفار بدلاً من تحميل روابط كل مستخدم على حدة.
+        """
         from src.models.url import ShortenedUrl
+        from src.models.user import User
+        
+        return db.session.query(
+            User.id.label('user_id'),
+            User.username,
+            User.full_name,
+            User.email,
+            User.is_admin,
+            User.created_at,
+            func.count(ShortenedUrl.id).label('total_urls'),
+            func.coalesce(func.sum(ShortenedUrl.clicks), 0).label('total_clicks'),
+            func.avg(func.coalesce(ShortenedUrl.clicks, 0)).label('avg_clicks')
+        ).outerjoin(ShortenedUrl, and_(
+            ShortenedUrl.user_id == User.id,
+            ShortenedUrl.is_active == True,
+            ShortenedUrl.deleted_at.is_(None)
+        )).filter(
+            User.is_active == True
+        ).group_by(User.id).order_by(User.id)
+    
+    @staticmethod
+    def format_user_stats(row):
+        """تحويل صف من users_stats_query إلى قاموس الاستجابة"""
+        return {
+            'user_id': row.user_id,
+            'username': row.username,
+            'full_name': row.full_name,
+            'email': row.email,
+            'is_admin': row.is_admin,
+            'total_urls': row.total_urls,
+            'total_clicks': row.total_clicks,
+            'avg_clicks': round(row.avg_clicks or 0, 2),
+            'created_at': row.created_at.strftime('%Y-%m-%d %H:%M:%S')
+        }
+    
+    @staticmethod
+    def get_url_detailed_stats(url_id, days=30, approximate=False):
+        """جلب إحصائيات مفصلة لرابط محدد (الوضع التقريبي يقرأ من العينات اليومية)"""
+        from src.models.url import ShortenedUrl
+        from src.analytics.partitions import click_router
+        from src.analytics.sampling import click_sampler
         
         url = ShortenedUrl.query.get(url_id)
         if not url:
             return None
         
+        now = datetime.utcnow()
+        start_date = now - timedelta(days=days)
+        source = click_sampler if approximate else click_router
+        
         # النقرات حسب اليوم
-        daily_clicks = db.session.query(
-            func.date(ClickLog.timestamp).label('date'),
-            func.count(ClickLog.id).label('clicks')
-        ).filter(
-            ClickLog.url_id == url_id,
-            ClickLog.timestamp >= datetime.utcnow() - datetime.timedelta(days=days)
-        ).group_by(func.date(ClickLog.timestamp)).all()
+        daily_clicks = source.daily_totals(start_date, now, url_id=url_id)
         
         # النقرات حسب الساعة (آخر 24 ساعة)
+        recent = click_router.clicks_between(now - timedelta(hours=24), now)
         hourly_clicks = db.session.query(
-            extract('hour', ClickLog.timestamp).label('hour'),
-            func.count(ClickLog.id).label('clicks')
-        ).filter(
-            ClickLog.url_id == url_id,
-            ClickLog.timestamp >= datetime.utcnow() - datetime.timedelta(hours=24)
-        ).group_by(extract('hour', ClickLog.timestamp)).all()
+            extract('hour', recent.c.timestamp).label('hour'),
+            func.count().label('clicks')
+        ).select_from(recent).filter(
+            recent.c.url_id == url_id
+        ).group_by(extract('hour', recent.c.timestamp)).all()
         
         # النقرات حسب نوع الجهاز
-        device_clicks = db.session.query(
-            ClickLog.device_type,
-            func.count(ClickLog.id).label('clicks')
-        ).filter(
-            ClickLog.url_id == url_id,
-            ClickLog.timestamp >= datetime.utcnow() - datetime.timedelta(days=days)
-        ).group_by(ClickLog.device_type).all()
+        device_clicks = source.breakdown('device_type', start_date, now, url_id=url_id)
         
         # النقرات حسب المتصفح
-        browser_clicks = db.session.query(
-            ClickLog.browser,
-            func.count(ClickLog.id).label('clicks')
-        ).filter(
-            ClickLog.url_id == url_id,
-            ClickLog.timestamp >= datetime.utcnow() - datetime.timedelta(days=days)
-        ).group_by(ClickLog.browser).all()
+        browser_clicks = source.breakdown('browser_id', start_date, now, url_id=url_id)
         
-        # المواقع المرجعية
-        referer_clicks = db.session.query(
-            ClickLog.referer,
-            func.count(ClickLog.id).label('clicks')
-        ).filter(
-            ClickLog.url_id == url_id,
-            ClickLog.referer.isnot(None),
-            ClickLog.timestamp >= datetime.utcnow() - datetime.timedelta(days=days)
-        ).group_by(ClickLog.referer).order_by(func.count(ClickLog.id).desc()).limit(10).all()
+        # المواقع المرجعية: التجميع حسب النطاق لا الرابط الكامل (النطاق والمسار) كما كان قبل
+        # الترميز القاموسي، فالملخصات اليومية والعينات تحفظ النطاق فقط؛ قيمة referer نطاق
+        referer_clicks = [
+            row for row in source.breakdown('referrer_domain_id', start_date, now, url_id=url_id)
+            if row[0] is not None
+        ][:10]
         
-        # الزوار الفريدون
-        unique_visitors = db.session.query(func.count(func.distinct(ClickLog.ip_address))).filter(
-            ClickLog.url_id == url_id,
-            ClickLog.timestamp >= datetime.utcnow() - datetime.timedelta(days=days)
-        ).scalar()
+        # الزوار الفريدون (في الوضع التقريبي حدود دنيا وعليا فقط)
+        if approximate:
+            unique_visitors, unique_visitors_high = click_sampler.unique_visitors(start_date, now, url_id=url_id)
+        else:
+            unique_visitors = click_router.unique_visitors(start_date, now, url_id=url_id)
         
-        return {
+        stats = {
             'url': url.to_dict(),
             'unique_visitors': unique_visitors,
-            'daily_clicks': [{'date': str(row.date), 'clicks': row.clicks} for row in daily_clicks],
+            'daily_clicks': [{'date': day, 'clicks': clicks} for day, clicks in daily_clicks],
             'hourly_clicks': [{'hour': int(row.hour), 'clicks': row.clicks} for row in hourly_clicks],
-            'device_clicks': [{'device_type': row.device_type or 'unknown', 'clicks': row.clicks} for row in device_clicks],
-            'browser_clicks': [{'browser': row.browser or 'unknown', 'clicks': row.clicks} for row in browser_clicks],
-            'referer_clicks': [{'referer': row.referer, 'clicks': row.clicks} for row in referer_clicks]
+            'device_clicks': Analytics._breakdown_rows(
+                device_clicks, 'device_type', lambda device: device or 'unknown'
+            ),
+            'browser_clicks': Analytics._breakdown_rows(
+                browser_clicks, 'browser', lambda browser_id: dimension_cache.value_of(BrowserDim, browser_id) or 'unknown'
+            ),
+            'referer_clicks': Analytics._breakdown_rows(
+                referer_clicks, 'referer', lambda domain_id: dimension_cache.value_of(ReferrerDomainDim, domain_id)
+            ),
+            'approximate': approximate
         }
-
+        if approximate:
+            stats['approximation'] = click_sampler.metadata(start_date, now, url_id=url_id)
+            stats['approximation']['unique_visitors_range'] = [unique_visitors, unique_visitors_high]
+        return stats
+    
+    @staticmethod
+    def _breakdown_rows(rows, key, label):
+        """تحويل صفوف التوزيع إلى قواميس، مع حدود فترة الثقة للصفوف التقريبية"""
+        result = []
+        for row in rows:
+            item = {key: label(row[0]), 'clicks': row[1]}
+            if len(row) == 4:
+                item['clicks_low'], item['clicks_high'] = row[2], row[3]
+            result.append(item)
+        return result
@@ -0,0 +1,272 @@
+"""
+جداول الأبعاد المرمّزة قاموسياً لسجلات النقرات
+تُخزَّن النصوص المتكررة (User Agent، المصدر، المتصفح، نظام التشغيل) مرة واحدة
+وتشير إليها سجلات النقرات بمفاتيح صحيحة صغيرة
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from urllib.parse import urlsplit
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session
+from src.models.user import db
+
+# مفتاح القيم غير المثبتة في session.info
+PENDING_KEY = 'dimension_pending'
+
+
+class UserAgentDim(db.Model):
+    """قيم User Agent الفريدة"""
+    __tablename__ = 'dim_user_agents'
+
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.Text, unique=True, nullable=False)
+
+
+class ReferrerDomainDim(db.Model):
+    """نطاقات المواقع المرجعية"""
+    __tablename__ = 'dim_referrer_domains'
+
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.String(255), unique=True, nullable=False)
+
+
+class ReferrerPathDim(db.Model):
+    """مسارات المواقع المرجعية (المسار مع الاستعلام)"""
+    __tablename__ = 'dim_referrer_paths'
+
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.Text, unique=True, nullable=False)
+
+
+class BrowserDim(db.Model):
+    """أسماء المتصفحات مع الإصدار"""
+    __tablename__ = 'dim_browsers'
+
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.String(100), unique=True, nullable=False)
+
+
+class OsDim(db.Model):
+    """أسماء أنظمة التشغيل مع الإصدار"""
+    __tablename__ = 'dim_os'
+
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.String(100), unique=True, nullable=False)
+
+
+def split_referrer(referer):
+    """تقسيم الرابط المرجعي إلى (النطاق، المسار)"""
+    if not referer:
+        return None, None
+
+    parts = urlsplit(referer)
+    if not parts.netloc:
+        # قيمة غير قياسية، نحفظها كمسار بدون نطاق
+        return None, referer
+
+    path = parts.path or '/'
+    if parts.query:
+        path = f'{path}?{parts.query}'
+    return parts.netloc.lower(), path
+
+
+class DimensionCache:
+    """ذاكرة ترميز قاموسي داخل العملية (قيمة ⇄ معرف)
+
+    جداول الأبعاد تُضاف إليها القيم فقط ولا تتغير معرفاتها،
+    لذلك لا تحتاج الذاكرة إلى إبطال بين عمليات gunicorn. القيمة المُدرجة أو المقروءة
+    داخل معاملة لم تُثبَّت تبقى في session.info ولا تدخل الذاكرة المشتركة إلا بعد
+    COMMIT، فإن تراجعت المعاملة لا يبقى معرف قد يُعطى لاحقاً لقيمة أخرى.
+    """
+
+    def __init__(self, max_entries=50000):
+        self.max_entries = max_entries
+        self._ids = {}
+        self._values = {}
+        self._lock = Lock()
+
+    def intern(self, model, value):
+        """إرجاع معرف القيمة في جدول البعد مع إضافتها إن لم تكن موجودة"""
+        if not value:
+            return None
+
+        with self._lock:
+            ids = self._ids.setdefault(model, OrderedDict())
+            dim_id = ids.get(value)
+            if dim_id is not None:
+                ids.move_to_end(value)
+                return dim_id
+
+        pending = self._pending()
+        dim_id = pending['ids'].get((model, value))
+        if dim_id is None:
+            dim_id = self._lookup_or_insert(model, value)
+            self._stage(pending, model, value, dim_id)
+        return dim_id
+
+    def value_of(self, model, dim_id):
+        """إرجاع القيمة النصية لمعرف بعد"""
+        if dim_id is None:
+            return None
+
+        with self._lock:
+            value = self._values.get(model, {}).get(dim_id)
+        if value is not None:
+            return value
+
+        pending = self._pending()
+        value = pending['values'].get((model, dim_id))
+        if value is not None:
+            return value
+
+        row = db.session.get(model, dim_id)
+        if not row:
+            return None
+
+        self._stage(pending, model, row.value, dim_id)
+        return row.value
+
+    def publish(self, pending):
+        """نقل قيم معاملة مثبتة إلى الذاكرة المشتركة"""
+        with self._lock:
+            for (model, value), dim_id in pending['ids'].items():
+                self._remember(model, value, dim_id)
+
+    def clear(self):
+        """تفريغ الذاكرة (للاختبارات أو بعد استعادة نسخة احتياطية)"""
+        with self._lock:
+            self._ids.clear()
+            self._values.clear()
+
+    @staticmethod
+    def _pending():
+        return db.session.info.setdefault(PENDING_KEY, {'ids': {}, 'values': {}})
+
+    @staticmethod
+    def _stage(pending, model, value, dim_id):
+        pending['ids'][(model, value)] = dim_id
+        pending['values'][(model, dim_id)] = value
+
+    def _remember(self, model, value, dim_id):
+        ids = self._ids.setdefault(model, OrderedDict())
+        values = self._values.setdefault(model, {})
+        ids[value] = dim_id
+        values[dim_id] = value
+
+        # حد أقصى للذاكرة لكل بعد (الأقدم استخداماً يخرج أولاً)
+        while len(ids) > self.max_entries:
+            old_value, old_id = ids.popitem(last=False)
+            values.pop(old_id, None)
+
+    def _lookup_or_insert(self, model, value):
+        existing = db.session.query(model.id).filter(model.value == value).scalar()
+        if existing is not None:
+            return existing
+
+        # INSERT ... ON CONFLICT DO NOTHING يتجنب السباق بين العمليات
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+
+        db.session.execute(insert(model).values(value=value).on_conflict_do_nothing())
+        return db.session.query(model.id).filter(model.value == value).scalar()
+
+
+dimension_cache = DimensionCache()
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_dimensions(session):
+    pending = session.info.pop(PENDING_KEY, None)
+    if pending:
+        dimension_cache.publish(pending)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_dimensions(session, previous_transaction):
+    # التراجع (حتى عن نقطة حفظ) يُسقط القيم غير المثبتة، وإعادة قراءتها آمنة دائماً
+    session.info.pop(PENDING_KEY, None)
+
+
+def migrate_click_dimensions(chunk_size=1000, vacuum=False):
+    """تحويل سجلات النقرات القديمة إلى مفاتيح الأبعاد على دفعات
+
+    خطوة ترحيل لمرة واحدة تُشغَّل من سطر الأوامر لا عند بدء كل عامل:
+
+        python -m src.migrations --click-dimensions
+
+    تعالج الجدول الموحد click_logs والأقسام الشهرية الحية (قد تكون السجلات نُقلت
+    إليها بنصوصها)، وهي قابلة للإعادة: تعالج فقط السجلات التي ما زالت تحمل نصوصاً.
+    """
+    from src.models.analytics import ClickPartition
+
+    engine = db.engine
+    tables = ['click_logs'] + [
+        partition.table_name
+        for partition in ClickPartition.query.filter_by(status='live').order_by(ClickPartition.month_start)
+    ]
+
+    converted = 0
+    for table in tables:
+        converted += _migrate_table(engine, table, chunk_size)
+
+    if vacuum and converted and engine.dialect.name == 'sqlite':
+        # استرجاع المساحة المحررة فعلياً من ملف SQLite
+        with engine.connect() as conn:
+            conn.execution_options(isolation_level='AUTOCOMMIT').execute(text('VACUUM'))
+
+    return converted
+
+
+def _migrate_table(engine, table, chunk_size):
+    columns = {col['name'] for col in inspect(engine).get_columns(table)}
+
+    # إضافة أعمدة المفاتيح للجداول المنشأة قبل هذا التغيير
+    new_columns = ['user_agent_id', 'referrer_domain_id', 'referrer_path_id', 'browser_id', 'os_id']
+    with engine.begin() as conn:
+        for name in new_columns:
+            if name not in columns:
+                conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} INTEGER'))
+
+    converted = 0
+    last_id = 0
+
+    while True:
+        rows = db.session.execute(text(
+            f'SELECT id, user_agent, referer, browser, os FROM {table} '
+            'WHERE id > :last_id AND (user_agent IS NOT NULL OR referer IS NOT NULL '
+            'OR browser IS NOT NULL OR os IS NOT NULL) '
+            'ORDER BY id LIMIT :limit'
+        ), {'last_id': last_id, 'limit': chunk_size}).fetchall()
+
+        if not rows:
+            break
+
+        updates = []
+        for row in rows:
+            domain, path = split_referrer(row.referer)
+            updates.append({
+                'id': row.id,
+                'user_agent_id': dimension_cache.intern(UserAgentDim, row.user_agent),
+                'referrer_domain_id': dimension_cache.intern(ReferrerDomainDim, domain),
+                'referrer_path_id': dimension_cache.intern(ReferrerPathDim, path),
+                'browser_id': dimension_cache.intern(BrowserDim, row.browser),
+                'os_id': dimension_cache.intern(OsDim, row.os)
+            })
+
+        db.session.execute(text(
+            f'UPDATE {table} SET user_agent_id = :user_agent_id, '
+            'referrer_domain_id = :referrer_domain_id, referrer_path_id = :referrer_path_id, '
+            'browser_id = :browser_id, os_id = :os_id, '
+            'user_agent = NULL, referer = NULL, browser = NULL, os = NULL '
+            'WHERE id = :id'
+        ), updates)
+        db.session.commit()
+
+        converted += len(rows)
+        last_id = rows[-1].id
+
+    return converted
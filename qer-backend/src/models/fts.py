@@ -0,0 +1,58 @@
+"""
+صيغة استعلامات البحث النصي المشتركة (سجلات المراجعة والروابط)
+كلمات و"عبارات" و حقل:كلمة و بادئة* و OR، تُترجم إلى تعبير MATCH لـ SQLite FTS5
+مقتبس بالكامل فلا تصل صيغة FTS5 من المستخدم كما هي
+"""
+
+import re
+
+_TOKEN = re.compile(r'(?:(\w+):)?(?:"([^"]*)"|(\S+))')
+
+
+class SearchQueryError(ValueError):
+    """استعلام بحث غير صالح"""
+
+
+def parse_query(query, aliases, prefix_last=False):
+    """تحليل الاستعلام إلى شروط: [(العمود أو None، النص، بادئة؟)] أو 'OR'
+
+    aliases: اسم الحقل في الاستعلام ← العمود المفهرس. الشروط المتتالية بلا OR تُجمع بـ AND،
+    و prefix_last تجعل آخر كلمة بادئة (البحث أثناء الكتابة).
+    """
+    terms = []
+    for match in _TOKEN.finditer(query or ''):
+        field, phrase, word = match.groups()
+        column = aliases.get(field.lower()) if field else None
+        if field and column is None:
+            # ليس حقلاً معروفاً (مثل https:) فهو جزء من النص
+            phrase, word = None, match.group(0).replace('"', '')
+        if phrase is None and word == 'OR':
+            if terms and terms[-1] != 'OR':
+                terms.append('OR')
+            continue
+        value = phrase if phrase is not None else word
+        prefix = phrase is None and value.endswith('*')
+        value = value.rstrip('*') if prefix else value
+        if value.strip():
+            terms.append((column, value, prefix))
+    while terms and terms[-1] == 'OR':
+        terms.pop()
+    if not terms:
+        raise SearchQueryError('استعلام البحث فارغ')
+    if prefix_last and not (query or '').rstrip().endswith('"'):
+        column, value, _ = terms[-1]
+        terms[-1] = (column, value, True)
+    return terms
+
+
+def to_match(terms):
+    """ترجمة الشروط إلى تعبير MATCH (العمود قد يكون مجموعة أعمدة {a b})"""
+    parts = []
+    for term in terms:
+        if term == 'OR':
+            parts.append('OR')
+            continue
+        column, value, prefix = term
+        quoted = '"' + value.replace('"', '""') + '"' + ('*' if prefix else '')
+        parts.append(f'{column} : {quoted}' if column else quoted)
+    return ' '.join(parts)
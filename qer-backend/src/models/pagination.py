@@ -0,0 +1,163 @@
+"""
+التصفح بالمؤشر (Keyset) للقوائم الطويلة
+بدلاً من OFFSET الذي يمسح كل الصفوف السابقة، يبدأ كل طلب من آخر مفتاح (قيمة الفرز، المعرف)
+فتتساوى تكلفة الصفحة رقم 500 مع الصفحة الأولى.
+القيم الفارغة (NULL) في عمود الفرز أصغر من كل القيم: في آخر الترتيب التنازلي وأوله في التصاعدي
+"""
+
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, func, literal, or_, select, tuple_
+
+
+class PaginationError(ValueError):
+    """معاملات تصفح غير صالحة (مؤشر تالف أو فرز غير مسموح)"""
+
+
+def encode_cursor(sort, values, direction):
+    """ترميز مؤشر معتم (base64) من مفتاح الفرز وقيمه"""
+    encoded = [
+        {'dt': value.isoformat()} if isinstance(value, datetime) else value
+        for value in values
+    ]
+    payload = json.dumps({'s': sort, 'k': encoded, 'd': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort):
+    """فك المؤشر وإرجاع (القيم، الاتجاه)"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        values = [
+            datetime.fromisoformat(value['dt']) if isinstance(value, dict) else value
+            for value in payload['k']
+        ]
+        direction = payload['d']
+    except (ValueError, KeyError, TypeError):
+        raise PaginationError('مؤشر التصفح غير صالح')
+
+    if payload.get('s') != sort or direction not in ('next', 'prev'):
+        raise PaginationError('مؤشر التصفح لا يطابق الفرز المطلوب')
+    return values, direction
+
+
+def parse_sort(value, allowed, default):
+    """تفسير معامل الفرز (مثل -created_at) مقيداً بالأعمدة المفهرسة المسموحة"""
+    value = value or default
+    descending = value.startswith('-')
+    name = value.lstrip('-')
+    if name not in allowed:
+        raise PaginationError(f'لا يمكن الفرز حسب {name}')
+    return name, descending
+
+
+def _after(sort_column, id_column, values, ascending):
+    """شرط الصفوف التي تلي المفتاح في اتجاه السير، مع القيم الفارغة قبل كل القيم"""
+    value, last_id = values
+    id_bound = literal(last_id, id_column.type)
+    if not getattr(getattr(sort_column, 'expression', sort_column), 'nullable', True):
+        bound = tuple_(literal(value, sort_column.type), id_bound)
+        key = tuple_(sort_column, id_column)
+        return key > bound if ascending else key < bound
+
+    if value is None:
+        same = and_(sort_column.is_(None), id_column > id_bound if ascending else id_column < id_bound)
+        return or_(same, sort_column.isnot(None)) if ascending else same
+
+    value = literal(value, sort_column.type)
+    after = or_(
+        sort_column > value if ascending else sort_column < value,
+        and_(sort_column == value, id_column > id_bound if ascending else id_column < id_bound)
+    )
+    return after if ascending else or_(after, sort_column.is_(None))
+
+
+def keyset_paginate(query, sort_column, id_column, descending=True, cursor=None, per_page=50,
+                    total=None, total_cap=1000):
+    """تصفح استعلام بالمؤشر على المفتاح (sort_column, id_column)
+
+    total: None لا يُحسب العدد، 'exact' عدد دقيق، 'estimate' عدد محدود بـ total_cap
+    (يُرجع total_capped=True إن وُجد أكثر منه) وهو أرخص بكثير على الجداول الكبيرة.
+    """
+    sort = f"{'-' if descending else ''}{sort_column.key}"
+    direction = 'next'
+    page_query = query
+
+    if cursor:
+        values, direction = decode_cursor(cursor, sort)
+        if len(values) != 2:
+            raise PaginationError('مؤشر التصفح غير صالح')
+        # الاتجاه التالي يكمل بنفس الترتيب، والسابق يعكسه ثم تُقلب النتائج
+        forward = descending if direction == 'next' else not descending
+        page_query = page_query.filter(_after(sort_column, id_column, values, ascending=not forward))
+
+    reverse = direction == 'prev'
+    if descending != reverse:
+        page_query = page_query.order_by(sort_column.desc().nulls_last(), id_column.desc())
+    else:
+        page_query = page_query.order_by(sort_column.asc().nulls_first(), id_column.asc())
+
+    rows = page_query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if reverse:
+        rows.reverse()
+
+    def key_of(row):
+        return [getattr(row, sort_column.key), getattr(row, id_column.key)]
+
+    has_next = has_more if direction == 'next' else bool(cursor)
+    has_prev = bool(cursor) if direction == 'next' else has_more
+
+    page = {
+        'items': rows,
+        'per_page': per_page,
+        'sort': sort,
+        'has_next': has_next and bool(rows),
+        'has_prev': has_prev and bool(rows),
+        'next_cursor': encode_cursor(sort, key_of(rows[-1]), 'next') if has_next and rows else None,
+        'prev_cursor': encode_cursor(sort, key_of(rows[0]), 'prev') if has_prev and rows else None
+    }
+
+    if total == 'exact':
+        page['total'] = query.order_by(None).count()
+    elif total == 'estimate':
+        capped = query.order_by(None).limit(total_cap + 1).subquery()
+        count = query.session.execute(select(func.count()).select_from(capped)).scalar()
+        page['total'] = min(count, total_cap)
+        page['total_capped'] = count > total_cap
+
+    return page
+
+
+def int_arg(args, name, default, minimum=1, maximum=None):
+    """قراءة معامل عددي من الطلب مقيداً بالحدود، و PaginationError (400) إن لم يكن عدداً"""
+    value = args.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise PaginationError(f'قيمة {name} يجب أن تكون عدداً صحيحاً')
+    value = max(value, minimum)
+    return min(value, maximum) if maximum is not None else value
+
+
+def pagination_args(args, default_per_page=50, max_per_page=100):
+    """قراءة معاملات التصفح الموحدة من الطلب"""
+    per_page = int_arg(args, 'per_page', default_per_page, 1, max_per_page)
+    total = args.get('total')
+    if total not in (None, 'exact', 'estimate'):
+        total = None
+    return {
+        'cursor': args.get('cursor') or None,
+        'per_page': per_page,
+        'total': total
+    }
+
+
+def page_meta(page):
+    """بيانات التصفح المرفقة بالاستجابة (بدون العناصر)"""
+    return {key: value for key, value in page.items() if key != 'items'}
@@ -19,10 +19,12 @@ class Role(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     deleted_at = db.Column(db.DateTime, nullable=True)  # للحذف الناعم
+    permission_mask = db.Column(db.String(64), nullable=True)  # قناع الصلاحيات المُصرَّف (ست عشري)
     
     # العلاقات
     users = db.relationship('User', backref='role_obj', lazy=True)
-    permissions = db.relationship('Permission', secondary=role_permissions, lazy='subquery',
+    # لا تُحمَّل الصلاحيات مع الدور، فالفحص يعتمد على permission_mask
+    permissions = db.relationship('Permission', secondary=role_permissions, lazy='select',
                                 backref=db.backref('roles', lazy=True))
     
     def __init__(self, name, display_name, description=None, is_system=False):
@@ -33,7 +35,8 @@ class Role(db.Model):
     
     def has_permission(self, permission_name):
         """التحقق من وجود صلاحية معينة في هذا الدور"""
-        return any(perm.name == permission_name for perm in self.permissions if perm.is_active)
+        from src.security.permissions import permission_compiler
+        return permission_compiler.allows(self, permission_name)
     
     def add_permission(self, permission):
         """إضافة صلاحية إلى الدور"""
@@ -66,8 +69,7 @@ class Role(db.Model):
             'is_system': self.is_system,
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None,
             'updated_at': self.updated_at.strftime('%Y-%m-%d %H:%M:%S') if self.updated_at else None,
-            'deleted_at': self.deleted_at.strftime('%Y-%m-%d %H:%M:%S') if self.deleted_at else None,
-            'users_count': len([u for u in self.users if u.is_active and not u.deleted_at])
+            'deleted_at': self.deleted_at.strftime('%Y-%m-%d %H:%M:%S') if self.deleted_at else None
         }
         
         if include_permissions:
@@ -96,6 +98,7 @@ class Permission(db.Model):
     category = db.Column(db.String(50), nullable=False)  # تصنيف الصلاحية (مثل: users, urls, reports)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     is_system = db.Column(db.Boolean, default=False, nullable=False)  # للصلاحيات النظامية
+    bit = db.Column(db.Integer, unique=True, nullable=True)  # موضع ثابت في أقنعة الأدوار
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def __init__(self, name, display_name, category, description=None, is_system=False):
@@ -268,6 +271,11 @@ def create_default_roles_and_permissions():
             if permission:
                 viewer_role.add_permission(permission)
     
+    # إعادة تصريف أقنعة الأدوار بعد أي إضافة
+    from src.security.permissions import permission_compiler
+    db.session.flush()
+    permission_compiler.rebuild()
+    
     db.session.commit()
     return super_admin_role, admin_role, employee_role, viewer_role
 
@@ -0,0 +1,164 @@
+"""
+مُسلسِلات خفيفة لنقاط نهاية القوائم
+تحدد الأعمدة المطلوبة فقط (?fields=id,short_code,clicks) وتحمّل العلاقات مسبقاً
+وتحسب الأعداد بالاستعلامات المجمعة، فيبقى عدد الاستعلامات ثابتاً مهما طالت القائمة
+"""
+
+from datetime import datetime
+from sqlalchemy.orm import joinedload, load_only, selectinload
+from src.models.user import User
+from src.models.url import ShortenedUrl
+from src.models.role import Role
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class InvalidFields(ValueError):
+    """حقل غير معروف في معامل fields"""
+
+
+class ModelSerializer:
+    """أساس المسلسلات
+
+    fields: الحقل ← أعمدة النموذج التي يحتاجها (None = عمود بنفس الاسم)
+    eager: الحقل ← دالة تُرجع خيار التحميل المسبق للعلاقة التي يقرؤها
+    الحقول المحسوبة تُعرَّف بدالة get_<الحقل>(obj, context).
+    """
+
+    model = None
+    fields = {}
+    eager = {}
+    optional = ()  # حقول مكلفة لا تُضمَّن إلا عند طلبها صراحة
+
+    def __init__(self, fields=None, include=()):
+        if fields:
+            requested = [name.strip() for name in fields.split(',') if name.strip()]
+            unknown = [name for name in requested if name not in self.fields]
+            if unknown:
+                raise InvalidFields(f"حقول غير معروفة: {', '.join(unknown)}")
+            self.selected = requested
+        else:
+            self.selected = [
+                name for name in self.fields
+                if name not in self.optional or name in include
+            ]
+
+    def apply(self, query, *extra_columns):
+        """إضافة خيارات تحميل الأعمدة المطلوبة والعلاقات إلى الاستعلام"""
+        columns = {'id'}
+        for name in self.selected:
+            needed = self.fields[name]
+            columns.update([name] if needed is None else needed)
+        columns.update(column.key for column in extra_columns)
+
+        options = [load_only(*[getattr(self.model, name) for name in sorted(columns)])]
+        loaders = {self.eager[name] for name in self.selected if name in self.eager}
+        options.extend(loader() for loader in loaders)
+        return query.options(*options)
+
+    def prefetch(self, objects):
+        """بيانات مجمعة لكل العناصر دفعة واحدة (تُعاد تعريفها في المسلسلات الفرعية)"""
+        return {}
+
+    def dump_many(self, objects):
+        context = self.prefetch(objects)
+        return [self.dump(obj, context) for obj in objects]
+
+    def dump(self, obj, context=None):
+        context = context or {}
+        result = {}
+        for name in self.selected:
+            getter = getattr(self, f'get_{name}', None)
+            value = getter(obj, context) if getter else getattr(obj, name)
+            result[name] = value.strftime(DATETIME_FORMAT) if isinstance(value, datetime) else value
+        return result
+
+
+class UrlSerializer(ModelSerializer):
+    """مسلسل الروابط المختصرة (نفس مفاتيح ShortenedUrl.to_dict)"""
+
+    model = ShortenedUrl
+    fields = {
+        'id': None,
+        'original_url': None,
+        'short_code': None,
+        'shortened_url': ['short_code'],
+        'custom_alias': None,
+        'title': None,
+        'description': None,
+        'clicks': None,
+        'is_active': None,
+        'expires_at': None,
+        'is_expired': ['expires_at'],
+        'created_at': None,
+        'updated_at': None,
+        'deleted_at': None,
+        'user_id': None,
+        'user_name': ['user_id'],
+        'user_username': ['user_id'],
+        'stats': ['created_at']
+    }
+    eager = {
+        'user_name': lambda: joinedload(ShortenedUrl.user).load_only(User.full_name, User.username),
+        'user_username': lambda: joinedload(ShortenedUrl.user).load_only(User.full_name, User.username)
+    }
+    optional = ('stats',)
+
+    def prefetch(self, objects):
+        if 'stats' not in self.selected:
+            return {}
+        return {'stats': ShortenedUrl.bulk_click_stats(objects)}
+
+    def get_shortened_url(self, url, context):
+        return f'https://rfah.me/{url.short_code}'
+
+    def get_is_expired(self, url, context):
+        return url.is_expired()
+
+    def get_user_name(self, url, context):
+        return url.user.full_name if url.user else 'غير محدد'
+
+    def get_user_username(self, url, context):
+        return url.user.username if url.user else 'غير محدد'
+
+    def get_stats(self, url, context):
+        return context['stats'][url.id]
+
+
+class UserSerializer(ModelSerializer):
+    """مسلسل المستخدمين (أعمدة جدول users فقط، بلا علاقات)"""
+
+    model = User
+    fields = {
+        'id': None,
+        'username': None,
+        'email': None,
+        'full_name': None,
+        'is_active': None,
+        'is_admin': None,
+        'created_at': None
+    }
+
+
+class RoleSerializer(ModelSerializer):
+    """مسلسل الأدوار مع صلاحياتها"""
+
+    model = Role
+    fields = {
+        'id': None,
+        'name': None,
+        'display_name': None,
+        'description': None,
+        'is_active': None,
+        'is_system': None,
+        'created_at': None,
+        'updated_at': None,
+        'deleted_at': None,
+        'permissions': []
+    }
+    eager = {
+        'permissions': lambda: selectinload(Role.permissions)
+    }
+
+    def get_permissions(self, role, context):
+        return [perm.to_dict() for perm in role.permissions if perm.is_active]
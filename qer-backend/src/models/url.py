@@ -1,5 +1,5 @@
 from src.models.user import db
-from datetime import datetime
+from datetime import datetime, timedelta
 import string
 import random
 
@@ -23,6 +23,9 @@ class ShortenedUrl(db.Model):
     # العلاقة مع سجلات النقرات
     click_logs = db.relationship('ClickLog', backref='url', lazy=True, cascade='all, delete-orphan')
     
+    # صاحب الرابط (يُحمَّل مسبقاً في القوائم عبر joinedload)
+    user = db.relationship('User', lazy='select')
+    
     def __init__(self, original_url, custom_alias=None, user_id=None, title=None, 
                  description=None, expires_at=None):
         self.original_url = original_url
@@ -85,39 +88,59 @@ class ShortenedUrl(db.Model):
     
     def get_click_stats(self):
         """جلب إحصائيات النقرات المفصلة"""
-        from src.models.analytics import ClickLog
+        return ShortenedUrl.bulk_click_stats([self])[self.id]
+    
+    @staticmethod
+    def bulk_click_stats(urls):
+        """إحصائيات النقرات لعدة روابط بعدد ثابت من الاستعلامات المجمعة حسب الرابط"""
+        from src.analytics.partitions import click_router
         from sqlalchemy import func, extract
         
-        # إحصائيات عامة
-        total_clicks = len(self.click_logs)
-        unique_ips = db.session.query(func.count(func.distinct(ClickLog.ip_address))).filter_by(url_id=self.id).scalar()
+        if not urls:
+            return {}
+        
+        now = datetime.utcnow()
+        url_ids = [url.id for url in urls]
+        since = min(url.created_at or now - timedelta(days=30) for url in urls)
+        
+        # إحصائيات عامة (عبر أقسام النقرات وملخصات الأقسام المحذوفة منذ إنشاء أقدم رابط)
+        summaries = click_router.url_summaries(since, now, url_ids)
         
         # النقرات حسب اليوم (آخر 30 يوم)
-        daily_clicks = db.session.query(
-            func.date(ClickLog.timestamp).label('date'),
-            func.count(ClickLog.id).label('clicks')
-        ).filter(
-            ClickLog.url_id == self.id,
-            ClickLog.timestamp >= datetime.utcnow() - datetime.timedelta(days=30)
-        ).group_by(func.date(ClickLog.timestamp)).all()
+        daily = click_router.daily_totals_by_url(now - timedelta(days=30), now, url_ids)
         
         # النقرات حسب الساعة (آخر 24 ساعة)
-        hourly_clicks = db.session.query(
-            extract('hour', ClickLog.timestamp).label('hour'),
-            func.count(ClickLog.id).label('clicks')
-        ).filter(
-            ClickLog.url_id == self.id,
-            ClickLog.timestamp >= datetime.utcnow() - datetime.timedelta(hours=24)
-        ).group_by(extract('hour', ClickLog.timestamp)).all()
+        recent = click_router.clicks_between(now - timedelta(hours=24), now)
+        hour = extract('hour', recent.c.timestamp)
+        hourly = {url_id: [] for url_id in url_ids}
+        for row in db.session.query(
+            recent.c.url_id, hour.label('hour'), func.count().label('clicks')
+        ).select_from(recent).filter(
+            recent.c.url_id.in_(url_ids)
+        ).group_by(recent.c.url_id, hour).all():
+            hourly[row.url_id].append({'hour': int(row.hour), 'clicks': row.clicks})
         
-        return {
-            'total_clicks': total_clicks,
-            'unique_visitors': unique_ips,
-            'daily_clicks': [{'date': str(row.date), 'clicks': row.clicks} for row in daily_clicks],
-            'hourly_clicks': [{'hour': int(row.hour), 'clicks': row.clicks} for row in hourly_clicks],
-            'first_click': self.click_logs[0].timestamp.strftime('%Y-%m-%d %H:%M:%S') if self.click_logs else None,
-            'last_click': self.click_logs[-1].timestamp.strftime('%Y-%m-%d %H:%M:%S') if self.click_logs else None
-        }
+        stats = {}
+        for url_id in url_ids:
+            summary = summaries[url_id]
+            stats[url_id] = {
+                'total_clicks': summary['total'],
+                'unique_visitors': summary['unique_visitors'],
+                'daily_clicks': [{'date': day, 'clicks': clicks} for day, clicks in daily[url_id]],
+                'hourly_clicks': hourly[url_id],
+                'first_click': ShortenedUrl._format_timestamp(summary['first_click']),
+                'last_click': ShortenedUrl._format_timestamp(summary['last_click'])
+            }
+        return stats
+    
+    @staticmethod
+    def _format_timestamp(value):
+        if not value:
+            return None
+        if isinstance(value, str):
+            # الاستعلامات المجمعة عبر UNION تعيد النص كما خُزّن في SQLite
+            value = datetime.fromisoformat(value)
+        return value.strftime('%Y-%m-%d %H:%M:%S')
     
     @staticmethod
     def get_by_short_code(short_code):
@@ -126,7 +149,12 @@ class ShortenedUrl(db.Model):
     @staticmethod
     def get_active_urls():
         """جلب جميع الروابط النشطة (غير المحذوفة)"""
-        return ShortenedUrl.query.filter_by(is_active=True, deleted_at=None).all()
+        return ShortenedUrl.active_query().all()
+    
+    @staticmethod
+    def active_query():
+        """استعلام الروابط النشطة (غير المحذوفة) قبل التنفيذ، للتصفح"""
+        return ShortenedUrl.query.filter_by(is_active=True, deleted_at=None)
     
     @staticmethod
     def get_deleted_urls():
@@ -136,23 +164,31 @@ class ShortenedUrl(db.Model):
     @staticmethod
     def get_by_user(user_id, include_deleted=False):
         """جلب الروابط حسب المستخدم"""
+        return ShortenedUrl.user_query(user_id, include_deleted).all()
+    
+    @staticmethod
+    def user_query(user_id, include_deleted=False):
+        """استعلام روابط المستخدم قبل التنفيذ، للتصفح"""
         query = ShortenedUrl.query.filter_by(user_id=user_id)
         if not include_deleted:
             query = query.filter_by(is_active=True, deleted_at=None)
-        return query.all()
+        return query
     
     def increment_clicks(self, ip_address=None, user_agent=None, referer=None):
         """زيادة عدد النقرات مع تسجيل تفاصيل النقرة"""
         self.clicks += 1
         
-        # تسجيل تفاصيل النقرة
+        # تسجيل تفاصيل النقرة في القسم الشهري المناسب
         from src.models.analytics import ClickLog
+        from src.analytics.partitions import click_router
+        from src.analytics.sampling import click_sampler
         click_log = ClickLog(
             url_id=self.id,
             ip_address=ip_address,
             user_agent=user_agent,
             referer=referer
         )
-        db.session.add(click_log)
+        click_router.record(click_log)
+        click_sampler.observe(click_log)
         db.session.commit()
 
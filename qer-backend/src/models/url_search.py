@@ -0,0 +1,234 @@
+"""
+البحث في الروابط المختصرة
+جدول SQLite FTS5 (url_search_fts) على الرمز والاسم المخصص ونطاق الرابط والعنوان والوصف
+والرابط الأصلي، مفتاحه معرّف الرابط، تُحدّثه محفزات الإدراج والحذف وتعديل هذه الأعمدة فقط
+(زيادة عداد النقرات لا تلمس الفهرس). فهارس البادئات (prefix='2 3 4') تجعل الإكمال التلقائي
+على الرموز والنطاقات بحثاً في الفهرس لا مسحاً للجدول، والنتائج مرتبة بـ bm25 مع أوزان للحقول
+"""
+
+import logging
+from urllib.parse import urlsplit
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from src.models.fts import SearchQueryError, parse_query, to_match
+from src.models.user import db
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'url_search_fts'
+
+# الأعمدة المفهرسة بترتيبها، ووزن كل منها في bm25
+FTS_COLUMNS = ('short_code', 'custom_alias', 'domain', 'title', 'description', 'original_url')
+WEIGHTS = (10.0, 8.0, 5.0, 4.0, 1.0, 2.0)
+
+# أسماء الحقول المقبولة في الاستعلام (field:term)
+FIELD_ALIASES = {
+    'code': 'short_code',
+    'short_code': 'short_code',
+    'alias': 'custom_alias',
+    'custom_alias': 'custom_alias',
+    'domain': 'domain',
+    'title': 'title',
+    'description': 'description',
+    'url': 'original_url',
+    'original_url': 'original_url'
+}
+
+# أعمدة الإكمال التلقائي
+SUGGEST_COLUMNS = '{short_code custom_alias domain}'
+
+
+def _domain_sql(column):
+    """نطاق الرابط بتعبير SQL (ما بين :// وأول /) لاستخدامه داخل المحفزات"""
+    rest = f"(CASE WHEN instr({column}, '://') > 0 THEN substr({column}, instr({column}, '://') + 3) ELSE {column} END)"
+    return f"(CASE WHEN instr({rest}, '/') > 0 THEN substr({rest}, 1, instr({rest}, '/') - 1) ELSE {rest} END)"
+
+
+def _values_sql(prefix):
+    return ', '.join(
+        _domain_sql(f'{prefix}.original_url') if column == 'domain' else f'{prefix}.{column}'
+        for column in FTS_COLUMNS
+    )
+
+
+class UrlSearchIndex:
+    """فهرس FTS5 للروابط والبحث والإكمال فيه"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self.available = False
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """تهيئة فهرس الروابط مع التطبيق"""
+        self.app = app
+        app.extensions['url_search'] = self
+
+    # ==================== المخطط ====================
+
+    def ensure_schema(self):
+        """إنشاء الجدول الافتراضي والمحفزات، وفهرسة الروابط الموجودة عند إنشائه أول مرة"""
+        engine = db.engine
+        if engine.dialect.name != 'sqlite':
+            self.available = False
+            return False
+
+        columns = ', '.join(FTS_COLUMNS)
+        watched = ', '.join(column for column in FTS_COLUMNS if column != 'domain')
+        try:
+            with engine.begin() as conn:
+                exists = conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+                ), {'name': FTS_TABLE}).first()
+                conn.execute(text(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                    f"{columns}, prefix='2 3 4', tokenize='unicode61 remove_diacritics 2')"
+                ))
+                conn.execute(text(
+                    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON shortened_urls BEGIN '
+                    f'INSERT INTO {FTS_TABLE} (rowid, {columns}) VALUES (new.id, {_values_sql("new")}); END'
+                ))
+                conn.execute(text(
+                    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON shortened_urls BEGIN '
+                    f'DELETE FROM {FTS_TABLE} WHERE rowid = old.id; END'
+                ))
+                conn.execute(text(
+                    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {watched} ON shortened_urls BEGIN '
+                    f'DELETE FROM {FTS_TABLE} WHERE rowid = old.id; '
+                    f'INSERT INTO {FTS_TABLE} (rowid, {columns}) VALUES (new.id, {_values_sql("new")}); END'
+                ))
+                if not exists:
+                    self._fill(conn)
+        except OperationalError as e:
+            # SQLite مبني دون FTS5: البحث يعود إلى المسح بـ LIKE
+            logger.warning('link full-text index unavailable: %s', e)
+            self.available = False
+            return False
+
+        self.available = True
+        return True
+
+    @staticmethod
+    def _fill(conn):
+        conn.execute(text(
+            f'INSERT INTO {FTS_TABLE} (rowid, {", ".join(FTS_COLUMNS)}) '
+            f'SELECT u.id, {_values_sql("u")} FROM shortened_urls u'
+        ))
+
+    def rebuild(self):
+        """إعادة بناء الفهرس من shortened_urls"""
+        with db.engine.begin() as conn:
+            conn.execute(text(f'DELETE FROM {FTS_TABLE}'))
+            self._fill(conn)
+
+    # ==================== البحث ====================
+
+    @staticmethod
+    def _conditions(user_id, include_deleted):
+        conditions, params = [], {}
+        if user_id is not None:
+            conditions.append('u.user_id = :user_id')
+            params['user_id'] = user_id
+        if not include_deleted:
+            # نفس شروط ShortenedUrl.user_query
+            conditions.append('u.is_active = :is_active AND u.deleted_at IS NULL')
+            params['is_active'] = True
+        return conditions, params
+
+    def search(self, query, user_id=None, include_deleted=False, page=1, per_page=50, prefix_last=False):
+        """البحث مرتباً حسب الصلة
+
+        يعيد ([(المعرّف، الرتبة، المقتطف)], هل توجد صفحة تالية).
+        """
+        terms = parse_query(query, FIELD_ALIASES, prefix_last=prefix_last)
+        conditions, params = self._conditions(user_id, include_deleted)
+        params.update(limit=per_page + 1, offset=(page - 1) * per_page)
+
+        if self.available:
+            params['match'] = to_match(terms)
+            weights = ', '.join(str(weight) for weight in WEIGHTS)
+            sql = (
+                f'SELECT u.id, bm25({FTS_TABLE}, {weights}) AS rank, '
+                f"snippet({FTS_TABLE}, -1, '[', ']', '…', 10) AS snippet "
+                f'FROM {FTS_TABLE} JOIN shortened_urls u ON u.id = {FTS_TABLE}.rowid '
+                f'WHERE {FTS_TABLE} MATCH :match'
+                + ''.join(f' AND {condition}' for condition in conditions)
+                + ' ORDER BY rank, u.id DESC LIMIT :limit OFFSET :offset'
+            )
+            try:
+                rows = db.session.execute(text(sql), params).fetchall()
+            except OperationalError as e:
+                raise SearchQueryError(f'استعلام بحث غير صالح: {e.orig}')
+        else:
+            rows = self._like_search(terms, conditions, params)
+
+        has_next = len(rows) > per_page
+        return [(row.id, row.rank, row.snippet) for row in rows[:per_page]], has_next
+
+    def _like_search(self, terms, conditions, params):
+        """بلا FTS5: كل شرط LIKE على أعمدة الرابط (مسح كامل، بلا ترتيب صلة)"""
+        groups = [[]]
+        for index, term in enumerate(terms):
+            if term == 'OR':
+                groups.append([])
+                continue
+            column, value, _ = term
+            params[f'term_{index}'] = f'%{value}%'
+            columns = ('original_url',) if column == 'domain' else (column,) if column else [
+                name for name in FTS_COLUMNS if name != 'domain'
+            ]
+            groups[-1].append('(' + ' OR '.join(f'u.{name} LIKE :term_{index}' for name in columns) + ')')
+        clauses = ['(' + ' AND '.join(group) + ')' for group in groups if group]
+        sql = (
+            'SELECT u.id, 0 AS rank, NULL AS snippet FROM shortened_urls u WHERE (' + ' OR '.join(clauses) + ')'
+            + ''.join(f' AND {condition}' for condition in conditions)
+            + ' ORDER BY u.created_at DESC, u.id DESC LIMIT :limit OFFSET :offset'
+        )
+        return db.session.execute(text(sql), params).fetchall()
+
+    def suggest(self, prefix, user_id=None, include_deleted=False, limit=10):
+        """إكمال تلقائي على الرموز والأسماء المخصصة والنطاقات من فهارس البادئات"""
+        prefix = (prefix or '').strip()
+        if not prefix:
+            return []
+        conditions, params = self._conditions(user_id, include_deleted)
+        params['limit'] = limit
+
+        if self.available:
+            params['match'] = f'{SUGGEST_COLUMNS} : "' + prefix.replace('"', '""') + '"*'
+            sql = (
+                f'SELECT u.id, {FTS_TABLE}.short_code, {FTS_TABLE}.custom_alias, {FTS_TABLE}.domain, u.title '
+                f'FROM {FTS_TABLE} JOIN shortened_urls u ON u.id = {FTS_TABLE}.rowid '
+                f'WHERE {FTS_TABLE} MATCH :match'
+                + ''.join(f' AND {condition}' for condition in conditions)
+                + f' ORDER BY bm25({FTS_TABLE}, {", ".join(str(weight) for weight in WEIGHTS)}), u.id DESC LIMIT :limit'
+            )
+            try:
+                rows = db.session.execute(text(sql), params).fetchall()
+            except OperationalError as e:
+                raise SearchQueryError(f'استعلام بحث غير صالح: {e.orig}')
+        else:
+            params.update(starts=f'{prefix}%', host=f'%://{prefix}%')
+            sql = (
+                'SELECT u.id, u.short_code, u.custom_alias, u.original_url AS domain, u.title '
+                'FROM shortened_urls u WHERE (u.short_code LIKE :starts OR u.custom_alias LIKE :starts '
+                'OR u.original_url LIKE :host)'
+                + ''.join(f' AND {condition}' for condition in conditions)
+                + ' ORDER BY u.id DESC LIMIT :limit'
+            )
+            rows = db.session.execute(text(sql), params).fetchall()
+
+        return [{
+            'id': row.id,
+            'short_code': row.short_code,
+            'custom_alias': row.custom_alias,
+            'domain': row.domain if self.available else (urlsplit(row.domain).hostname or row.domain),
+            'title': row.title
+        } for row in rows]
+
+
+url_search = UrlSearchIndex()
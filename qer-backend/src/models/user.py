@@ -1,6 +1,5 @@
 # qer-backend/src/models/user.py
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 from src.extensions import db
 
 
@@ -14,10 +13,27 @@ class User(db.Model):
     full_name = db.Column(db.String(255))
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     is_admin = db.Column(db.Boolean, default=False, nullable=False)
+    role_id = db.Column(db.Integer, db.ForeignKey("roles.id"), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
     def set_password(self, raw: str) -> None:
-        self.password_hash = generate_password_hash(raw)
+        from src.security.password_hasher import password_hasher
+        self.password_hash = password_hasher.hash(raw)
 
     def check_password(self, raw: str) -> bool:
-        return check_password_hash(self.password_hash, raw)
+        """التحقق خارج العملية، وإعادة تشفير كلمة المرور إن كانت تجزئتها بمعاملات قديمة"""
+        from src.security.password_hasher import PasswordHasherBusy, password_hasher
+        if not password_hasher.verify(self.password_hash, raw):
+            return False
+        if password_hasher.needs_rehash(self.password_hash):
+            try:
+                self.password_hash = password_hasher.hash(raw)
+            except PasswordHasherBusy:
+                pass  # التحديث ينتظر الدخول التالي
+        return True
+
+    def has_permission(self, permission_name: str) -> bool:
+        """المدير يملك كل الصلاحيات، وغيره يُفحص بقناع دوره (role_obj من علاقة Role.users)"""
+        if self.is_admin:
+            return True
+        return self.role_obj is not None and self.role_obj.has_permission(permission_name)
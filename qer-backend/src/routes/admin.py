@@ -1,13 +1,24 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, current_app
 from src.models.user import db, User
 from src.models.role import Role, Permission, create_default_roles_and_permissions
 from src.models.url import ShortenedUrl
 from src.models.analytics import Analytics
+from src.analytics.sampling import click_sampler
+from src.models.pagination import PaginationError, keyset_paginate, pagination_args, page_meta, parse_sort
+from src.models.serializers import InvalidFields, RoleSerializer, UserSerializer, UrlSerializer
+from src.security.permissions import permission_compiler
+from src.security.identity import identity_manager
+from src.security.pipeline import mark_authenticated
+from src.security.password_hasher import PasswordHasherBusy, password_hasher
 from functools import wraps
 from datetime import datetime
 
 admin_bp = Blueprint('admin', __name__)
 
+# أعمدة الفرز المسموحة (مفهرسة) لقوائم الإدارة
+USER_SORT_COLUMNS = ('created_at', 'username', 'id')
+URL_SORT_COLUMNS = ('created_at', 'clicks', 'id')
+
 def require_permission(permission_name):
     """ديكوريتر للتحقق من الصلاحيات"""
     def decorator(f):
@@ -16,15 +27,15 @@ def require_permission(permission_name):
             if 'user_id' not in session:
                 return jsonify({'error': 'غير مصرح لك بالوصول'}), 401
             
-            user = User.query.get(session['user_id'])
-            if not user or not user.is_active or user.deleted_at:
+            user = identity_manager.current()
+            if not user:
                 return jsonify({'error': 'المستخدم غير موجود أو غير نشط'}), 401
             
             if not user.has_permission(permission_name):
                 return jsonify({'error': 'ليس لديك صلاحية للوصول إلى هذه الوظيفة'}), 403
             
             return f(*args, **kwargs)
-        return decorated_function
+        return mark_authenticated(decorated_function)
     return decorator
 
 def require_admin():
@@ -35,15 +46,15 @@ def require_admin():
             if 'user_id' not in session:
                 return jsonify({'error': 'غير مصرح لك بالوصول'}), 401
             
-            user = User.query.get(session['user_id'])
-            if not user or not user.is_active or user.deleted_at:
+            user = identity_manager.current()
+            if not user:
                 return jsonify({'error': 'المستخدم غير موجود أو غير نشط'}), 401
             
             if not user.is_admin and not user.has_permission('system.settings'):
                 return jsonify({'error': 'ليس لديك صلاحية مدير النظام'}), 403
             
             return f(*args, **kwargs)
-        return decorated_function
+        return mark_authenticated(decorated_function)
     return decorator
 
 # ==================== إدارة الأدوار ====================
@@ -55,15 +66,18 @@ def get_roles():
     try:
         include_deleted = request.args.get('include_deleted', 'false').lower() == 'true'
         
-        if include_deleted:
-            roles = Role.query.all()
-        else:
-            roles = Role.get_active_roles()
+        query = Role.query if include_deleted else Role.query.filter_by(is_active=True, deleted_at=None)
+        
+        # استعلام للأدوار + واحد للصلاحيات مهما كان عدد الأدوار
+        serializer = RoleSerializer(request.args.get('fields'))
+        roles = serializer.apply(query).all()
         
         return jsonify({
             'success': True,
-            'roles': [role.to_dict(include_permissions=True) for role in roles]
+            'roles': serializer.dump_many(roles)
         })
+    except InvalidFields as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'خطأ في جلب الأدوار: {str(e)}'}), 500
 
@@ -101,6 +115,8 @@ def create_role():
             if permission and permission.is_active:
                 role.add_permission(permission)
         
+        db.session.flush()
+        permission_compiler.rebuild([role.id])
         db.session.commit()
         
         return jsonify({
@@ -144,6 +160,9 @@ def update_role(role_id):
                 permission = Permission.query.get(perm_id)
                 if permission and permission.is_active:
                     role.add_permission(permission)
+            
+            db.session.flush()
+            permission_compiler.rebuild([role.id])
         
         role.updated_at = datetime.utcnow()
         db.session.commit()
@@ -171,7 +190,7 @@ def delete_role(role_id):
             return jsonify({'error': 'لا يمكن حذف الأدوار النظامية'}), 400
         
         # التحقق من عدم وجود مستخدمين مرتبطين بهذا الدور
-        users_count = User.query.filter_by(role_id=role_id, is_active=True, deleted_at=None).count()
+        users_count = User.query.filter_by(role_id=role_id, is_active=True).count()
         if users_count > 0:
             return jsonify({'error': f'لا يمكن حذف الدور لأنه مرتبط بـ {users_count} مستخدم'}), 400
         
@@ -235,19 +254,25 @@ def get_users():
     """جلب جميع المستخدمين"""
     try:
         include_deleted = request.args.get('include_deleted', 'false').lower() == 'true'
-        role_id = request.args.get('role_id')
         
-        if include_deleted:
-            users = User.query.all()
-        elif role_id:
-            users = User.get_by_role(int(role_id))
-        else:
-            users = User.get_active_users()
+        # المستخدم المعطَّل هو المحذوف (لا يوجد حذف ناعم ولا دور في جدول users)
+        query = User.query if include_deleted else User.query.filter_by(is_active=True)
+        
+        sort, descending = parse_sort(request.args.get('sort'), USER_SORT_COLUMNS, '-created_at')
+        serializer = UserSerializer(request.args.get('fields'))
+        sort_column = getattr(User, sort)
+        page = keyset_paginate(
+            serializer.apply(query, sort_column), sort_column, User.id, descending,
+            **pagination_args(request.args)
+        )
         
         return jsonify({
             'success': True,
-            'users': [user.to_dict(include_role=True) for user in users]
+            'users': serializer.dump_many(page['items']),
+            'pagination': page_meta(page)
         })
+    except (PaginationError, InvalidFields) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'خطأ في جلب المستخدمين: {str(e)}'}), 500
 
@@ -264,6 +289,13 @@ def create_user():
             if not data.get(field):
                 return jsonify({'error': f'الحقل {field} مطلوب'}), 400
         
+        # رفض كلمات المرور الضعيفة أو المسربة
+        security_manager = current_app.extensions.get('security_manager')
+        if security_manager:
+            valid, message = security_manager.validate_password_strength(data['password'])
+            if not valid:
+                return jsonify({'error': message}), 400
+        
         # التحقق من عدم وجود مستخدم بنفس اسم المستخدم أو البريد الإلكتروني
         existing_user = User.query.filter(
             (User.username == data['username']) | (User.email == data['email'])
@@ -300,6 +332,9 @@ def create_user():
             'user': user.to_dict(include_role=True)
         })
     
+    except PasswordHasherBusy as e:
+        db.session.rollback()
+        return password_hasher.busy_response(e)
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'خطأ في إنشاء المستخدم: {str(e)}'}), 500
@@ -334,6 +369,11 @@ def update_user(user_id):
         
         # تحديث كلمة المرور إذا تم تقديمها
         if 'password' in data and data['password']:
+            security_manager = current_app.extensions.get('security_manager')
+            if security_manager:
+                valid, message = security_manager.validate_password_strength(data['password'])
+                if not valid:
+                    return jsonify({'error': message}), 400
             user.set_password(data['password'])
         
         # تحديث الدور
@@ -346,7 +386,7 @@ def update_user(user_id):
             user.role_id = role_id
         
         # تحديث صلاحيات المدير (للمدراء فقط)
-        current_user = User.query.get(session['user_id'])
+        current_user = identity_manager.current()
         if current_user.is_admin and 'is_admin' in data:
             user.is_admin = data['is_admin']
         
@@ -355,6 +395,7 @@ def update_user(user_id):
             user.is_active = data['is_active']
         
         user.updated_at = datetime.utcnow()
+        identity_manager.bump_user(user.id)
         db.session.commit()
         
         return jsonify({
@@ -363,6 +404,9 @@ def update_user(user_id):
             'user': user.to_dict(include_role=True)
         })
     
+    except PasswordHasherBusy as e:
+        db.session.rollback()
+        return password_hasher.busy_response(e)
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'خطأ في تحديث المستخدم: {str(e)}'}), 500
@@ -381,6 +425,7 @@ def delete_user(user_id):
             return jsonify({'error': 'لا يمكنك حذف حسابك الخاص'}), 400
         
         user.soft_delete()
+        identity_manager.bump_user(user.id)
         db.session.commit()
         
         return jsonify({
@@ -405,6 +450,7 @@ def restore_user(user_id):
             return jsonify({'error': 'المستخدم غير محذوف'}), 400
         
         user.restore()
+        identity_manager.bump_user(user.id)
         db.session.commit()
         
         return jsonify({
@@ -428,16 +474,27 @@ def get_all_urls():
         user_id = request.args.get('user_id')
         
         if include_deleted:
-            urls = ShortenedUrl.query.all()
+            query = ShortenedUrl.query
         elif user_id:
-            urls = ShortenedUrl.get_by_user(int(user_id), include_deleted=False)
+            query = ShortenedUrl.user_query(int(user_id), include_deleted=False)
         else:
-            urls = ShortenedUrl.get_active_urls()
+            query = ShortenedUrl.active_query()
+        
+        sort, descending = parse_sort(request.args.get('sort'), URL_SORT_COLUMNS, '-created_at')
+        serializer = UrlSerializer(request.args.get('fields'), include=('stats',))
+        sort_column = getattr(ShortenedUrl, sort)
+        page = keyset_paginate(
+            serializer.apply(query, sort_column), sort_column, ShortenedUrl.id, descending,
+            **pagination_args(request.args)
+        )
         
         return jsonify({
             'success': True,
-            'urls': [url.to_dict(include_stats=True) for url in urls]
+            'urls': serializer.dump_many(page['items']),
+            'pagination': page_meta(page)
         })
+    except (PaginationError, InvalidFields) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'خطأ في جلب الروابط: {str(e)}'}), 500
 
@@ -474,7 +531,8 @@ def get_system_stats():
     """جلب إحصائيات النظام العامة"""
     try:
         days = int(request.args.get('days', 30))
-        stats = Analytics.get_system_stats(days)
+        approximate = click_sampler.wants_approximate(request.args.get('approximate'), days)
+        stats = Analytics.get_system_stats(days, approximate=approximate)
         
         return jsonify({
             'success': True,
@@ -504,7 +562,8 @@ def get_url_stats(url_id):
     """جلب إحصائيات رابط محدد"""
     try:
         days = int(request.args.get('days', 30))
-        stats = Analytics.get_url_detailed_stats(url_id, days)
+        approximate = click_sampler.wants_approximate(request.args.get('approximate'), days)
+        stats = Analytics.get_url_detailed_stats(url_id, days, approximate=approximate)
         
         if not stats:
             return jsonify({'error': 'الرابط غير موجود'}), 404
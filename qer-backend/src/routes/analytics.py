@@ -4,7 +4,7 @@
 
 from flask import Blueprint, request, jsonify, session, send_file
 from src.analytics import AnalyticsEngine
-from src.security import require_auth, require_permission
+from src.security import require_auth, require_permission, rate_policy
 from src.models.user import User
 from datetime import datetime, timedelta
 import json
@@ -130,6 +130,7 @@ def get_url_stats(url_id):
         return jsonify({'error': f'خطأ في جلب إحصائيات الرابط: {str(e)}'}), 500
 
 @analytics_bp.route('/comparative-analysis', methods=['POST'])
+@rate_policy(cost=20, budget='analytics')
 @require_auth
 @require_permission('analytics.compare_users')
 def get_comparative_analysis():
@@ -193,6 +194,7 @@ def get_trending_analysis():
         return jsonify({'error': f'خطأ في تحليل الاتجاهات: {str(e)}'}), 500
 
 @analytics_bp.route('/performance-report', methods=['POST'])
+@rate_policy(cost=20, budget='analytics')
 @require_auth
 def generate_performance_report():
     """إنتاج تقرير أداء شامل"""
@@ -236,6 +238,7 @@ def generate_performance_report():
         return jsonify({'error': f'خطأ في إنتاج التقرير: {str(e)}'}), 500
 
 @analytics_bp.route('/export-report', methods=['POST'])
+@rate_policy(cost=30, budget='analytics')
 @require_auth
 def export_performance_report():
     """تصدير تقرير الأداء كملف CSV"""
@@ -336,6 +339,7 @@ def export_performance_report():
         return jsonify({'error': f'خطأ في تصدير التقرير: {str(e)}'}), 500
 
 @analytics_bp.route('/team-leaderboard', methods=['GET'])
+@rate_policy(cost=10, budget='analytics')
 @require_auth
 @require_permission('analytics.view_leaderboard')
 def get_team_leaderboard():
@@ -1,8 +1,7 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, current_app
 from sqlalchemy import or_
 
 from ..models import db, User
-from werkzeug.security import check_password_hash
 
 auth_bp = Blueprint("auth", __name__)
 
@@ -25,13 +24,29 @@ def login():
     if not identifier or not password:
         return jsonify(error="missing_credentials"), 400
 
+    security = current_app.extensions.get("security_manager")
+    client_ip = security.get_client_ip() if security else None
+    lockout = security.username_lockout(identifier) if security else 0
+    if lockout:
+        return jsonify(error="too_many_attempts", retry_after=lockout), 429, {"Retry-After": str(lockout)}
+
     user = User.query.filter(or_(User.username == identifier, User.email == identifier)).first()
-    if not user or not check_password_hash(user.password_hash, password):
+    # التحقق في مجمع التشفير؛ المجمع الممتلئ يرد بـ 503 مع Retry-After
+    if not user or not user.check_password(password):
+        if security:
+            security.record_failed_login(client_ip, identifier)
         return jsonify(error="invalid_credentials"), 401
 
     if not user.is_active:
         return jsonify(error="inactive_user"), 403
 
+    if db.session.is_modified(user):
+        db.session.commit()  # حفظ كلمة المرور المعاد تشفيرها
+
+    if security:
+        # نجاح الدخول يمسح عداد الحساب فقط، فلا يمحو مهاجمٌ عداد عنوانه بحسابه الخاص
+        security.clear_failed_attempts(username=identifier)
+
     session["uid"] = user.id
     return jsonify(user=_serialize_user(user))
 
@@ -1,6 +1,9 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, current_app
 from src.models.user import db, User
 from src.models.role import create_default_roles_and_permissions
+from src.security.identity import identity_manager
+from src.security.revocation import token_revocations
+from src.security.password_hasher import PasswordHasherBusy, password_hasher
 
 auth_enhanced_bp = Blueprint('auth_enhanced', __name__)
 
@@ -15,6 +18,13 @@ def register():
             if not data.get(field):
                 return jsonify({'error': f'الحقل {field} مطلوب'}), 400
         
+        # رفض كلمات المرور الضعيفة أو المسربة
+        security_manager = current_app.extensions.get('security_manager')
+        if security_manager:
+            valid, message = security_manager.validate_password_strength(data['password'])
+            if not valid:
+                return jsonify({'error': message}), 400
+        
         # التحقق من عدم وجود مستخدم بنفس اسم المستخدم أو البريد الإلكتروني
         existing_user = User.query.filter(
             (User.username == data['username']) | (User.email == data['email'])
@@ -57,6 +67,9 @@ def register():
             'user': user.to_dict(include_role=True, include_permissions=True)
         })
     
+    except PasswordHasherBusy as e:
+        db.session.rollback()
+        return password_hasher.busy_response(e)
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'خطأ في إنشاء الحساب: {str(e)}'}), 500
@@ -69,23 +82,39 @@ def login():
         if not data.get('username') or not data.get('password'):
             return jsonify({'error': 'اسم المستخدم وكلمة المرور مطلوبان'}), 400
         
+        # قفل اسم المستخدم بعد محاولات فاشلة متكررة (قفل IP يتولاه خط فحوص الأمان)
+        security_manager = current_app.extensions.get('security_manager')
+        client_ip = security_manager.get_client_ip() if security_manager else None
+        lockout = security_manager.username_lockout(data['username']) if security_manager else 0
+        if lockout:
+            return jsonify({
+                'error': 'تم إيقاف تسجيل الدخول لهذا الحساب مؤقتاً بسبب محاولات فاشلة متكررة',
+                'retry_after': lockout
+            }), 429, {'Retry-After': str(lockout)}
+        
         # البحث عن المستخدم بالبريد الإلكتروني أو اسم المستخدم
         user = User.query.filter(
             (User.username == data['username']) | (User.email == data['username'])
         ).first()
         
         if not user or not user.check_password(data['password']):
+            if security_manager:
+                security_manager.record_failed_login(client_ip, data['username'])
             return jsonify({'error': 'اسم المستخدم أو كلمة المرور غير صحيحة'}), 401
         
         # التحقق من حالة المستخدم
         if not user.is_active or user.deleted_at:
             return jsonify({'error': 'الحساب غير نشط أو محذوف'}), 401
         
-        # تحديث وقت آخر تسجيل دخول
+        # تحديث وقت آخر تسجيل دخول (مع حفظ التجزئة المحدّثة إن أُعيد التشفير)
         user.update_last_login()
+        db.session.commit()
+        if security_manager:
+            # عداد الحساب فقط، ويبقى عداد العنوان حتى يتناقص أو يُلغى الحظر يدوياً
+            security_manager.clear_failed_attempts(username=data['username'])
         
-        # حفظ معلومات المستخدم في الجلسة
-        session['user_id'] = user.id
+        # حفظ معلومات المستخدم ومطالبات الصلاحيات في الجلسة
+        identity_manager.issue(user)
         session['username'] = user.username
         session['is_admin'] = user.is_admin
         
@@ -95,12 +124,22 @@ def login():
             'user': user.to_dict(include_role=True, include_permissions=True)
         })
     
+    except PasswordHasherBusy as e:
+        db.session.rollback()
+        return password_hasher.busy_response(e)
     except Exception as e:
         return jsonify({'error': f'خطأ في تسجيل الدخول: {str(e)}'}), 500
 
 @auth_enhanced_bp.route('/logout', methods=['POST'])
 def logout():
     try:
+        # إلغاء رمز JWT المرسل (إن وُجد) حتى انتهاء صلاحيته
+        token = request.headers.get('Authorization', '')
+        security_manager = current_app.extensions.get('security_manager')
+        if token.startswith('Bearer ') and security_manager:
+            security_manager.revoke_jwt_token(token[7:])
+            db.session.commit()
+        
         session.clear()
         return jsonify({
             'success': True,
@@ -115,10 +154,12 @@ def get_profile():
         if 'user_id' not in session:
             return jsonify({'error': 'غير مصرح لك بالوصول'}), 401
         
-        user = User.query.get(session['user_id'])
-        if not user or not user.is_active or user.deleted_at:
+        identity = identity_manager.current()
+        if not identity:
             return jsonify({'error': 'المستخدم غير موجود أو غير نشط'}), 401
         
+        user = User.query.get(identity.id)
+        
         return jsonify({
             'success': True,
             'user': user.to_dict(include_role=True, include_permissions=True)
@@ -133,10 +174,12 @@ def update_profile():
         if 'user_id' not in session:
             return jsonify({'error': 'غير مصرح لك بالوصول'}), 401
         
-        user = User.query.get(session['user_id'])
-        if not user or not user.is_active or user.deleted_at:
+        identity = identity_manager.current()
+        if not identity:
             return jsonify({'error': 'المستخدم غير موجود أو غير نشط'}), 401
         
+        user = User.query.get(identity.id)
+        
         data = request.get_json()
         
         # تحديث البيانات الأساسية
@@ -160,7 +203,16 @@ def update_profile():
         if 'current_password' in data and 'new_password' in data:
             if not user.check_password(data['current_password']):
                 return jsonify({'error': 'كلمة المرور الحالية غير صحيحة'}), 400
+            # رفض كلمات المرور الضعيفة أو المسربة
+            security_manager = current_app.extensions.get('security_manager')
+            if security_manager:
+                valid, message = security_manager.validate_password_strength(data['new_password'])
+                if not valid:
+                    return jsonify({'error': message}), 400
+            
             user.set_password(data['new_password'])
+            # إلغاء كل رموز JWT الصادرة قبل تغيير كلمة المرور
+            token_revocations.revoke_user(user.id)
         
         from datetime import datetime
         user.updated_at = datetime.utcnow()
@@ -172,6 +224,9 @@ def update_profile():
             'user': user.to_dict(include_role=True, include_permissions=True)
         })
     
+    except PasswordHasherBusy as e:
+        db.session.rollback()
+        return password_hasher.busy_response(e)
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'خطأ في تحديث الملف الشخصي: {str(e)}'}), 500
@@ -183,11 +238,13 @@ def check_session():
         if 'user_id' not in session:
             return jsonify({'authenticated': False}), 200
         
-        user = User.query.get(session['user_id'])
-        if not user or not user.is_active or user.deleted_at:
+        identity = identity_manager.current()
+        if not identity:
             session.clear()
             return jsonify({'authenticated': False}), 200
         
+        user = User.query.get(identity.id)
+        
         return jsonify({
             'authenticated': True,
             'user': user.to_dict(include_role=True, include_permissions=True)
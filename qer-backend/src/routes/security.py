@@ -2,13 +2,44 @@
 نقاط النهاية للأمان والمراجعة
 """
 
-from flask import Blueprint, request, jsonify, session
-from src.security import SecurityManager, AuditLogger, AuditEventType, AuditSeverity, require_auth, require_permission
+from flask import Blueprint, request, jsonify, session, current_app, url_for
+from src.security import SecurityManager, AuditLogger, AuditEventType, AuditSeverity, SearchQueryError, require_auth, require_permission
 from src.models.user import User, db
+from src.models.pagination import PaginationError, int_arg, pagination_args
 from datetime import datetime, timedelta
 
 security_bp = Blueprint('security', __name__)
 
+def _audit_filters(args):
+    """معاملات تصفية سجلات المراجعة من الطلب"""
+    filters = {}
+    
+    if args.get('event_type'):
+        filters['event_type'] = args.get('event_type')
+    
+    if args.get('user_id'):
+        filters['user_id'] = int(args.get('user_id'))
+    
+    if args.get('severity'):
+        filters['severity'] = args.get('severity')
+    
+    if args.get('start_date'):
+        filters['start_date'] = datetime.fromisoformat(args.get('start_date'))
+    
+    if args.get('end_date'):
+        filters['end_date'] = datetime.fromisoformat(args.get('end_date'))
+    
+    if args.get('ip_address'):
+        filters['ip_address'] = args.get('ip_address')
+    
+    if args.get('resource_type'):
+        filters['resource_type'] = args.get('resource_type')
+    
+    if args.get('success') is not None:
+        filters['success'] = args.get('success').lower() == 'true'
+    
+    return filters
+
 @security_bp.route('/audit-logs', methods=['GET'])
 @require_auth
 @require_permission('audit.view')
@@ -19,47 +50,88 @@ def get_audit_logs():
         if not audit_logger:
             return jsonify({'error': 'نظام المراجعة غير متاح'}), 500
         
-        # معاملات التصفية
-        filters = {}
-        
-        if request.args.get('event_type'):
-            filters['event_type'] = request.args.get('event_type')
+        filters = _audit_filters(request.args)
         
-        if request.args.get('user_id'):
-            filters['user_id'] = int(request.args.get('user_id'))
+        # معاملات التصفح (مؤشر، حد أقصى 100، العدد الكلي اختياري)
+        result = audit_logger.get_audit_logs(filters, **pagination_args(request.args))
         
-        if request.args.get('severity'):
-            filters['severity'] = request.args.get('severity')
+        return jsonify({
+            'success': True,
+            'data': result
+        })
+    
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'خطأ في جلب سجلات المراجعة: {str(e)}'}), 500
+
+@security_bp.route('/audit-logs/search', methods=['GET'])
+@require_auth
+@require_permission('audit.view')
+def search_audit_logs():
+    """البحث النصي في سجلات المراجعة مرتباً حسب الصلة
+
+    q: كلمات و"عبارات" و حقل:كلمة (user, error, old, new, data) و بادئة* و OR،
+    مع مرشحات /audit-logs نفسها.
+    """
+    try:
+        audit_search = current_app.extensions.get('audit_search')
+        if not audit_search:
+            return jsonify({'error': 'نظام المراجعة غير متاح'}), 500
         
-        if request.args.get('start_date'):
-            filters['start_date'] = datetime.fromisoformat(request.args.get('start_date'))
+        page = int_arg(request.args, 'page', 1)
+        per_page = int_arg(request.args, 'per_page', 50, 1, 100)
         
-        if request.args.get('end_date'):
-            filters['end_date'] = datetime.fromisoformat(request.args.get('end_date'))
+        result = audit_search.search(request.args.get('q', ''), _audit_filters(request.args), page, per_page)
         
-        if request.args.get('ip_address'):
-            filters['ip_address'] = request.args.get('ip_address')
+        return jsonify({
+            'success': True,
+            'data': result
+        })
+    
+    except (SearchQueryError, PaginationError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'خطأ في البحث في سجلات المراجعة: {str(e)}'}), 500
+
+@security_bp.route('/audit-aggregates', methods=['GET'])
+@require_auth
+@require_permission('audit.view')
+def get_audit_aggregates():
+    """الحصول على الأحداث المجمّعة (صف لكل نوع ومورد ودقيقة)"""
+    try:
+        audit_logger = current_app.extensions.get('audit_logger')
+        if not audit_logger:
+            return jsonify({'error': 'نظام المراجعة غير متاح'}), 500
         
-        if request.args.get('resource_type'):
-            filters['resource_type'] = request.args.get('resource_type')
+        filters = {}
+        for name in ('event_type', 'resource_type', 'resource_id', 'group_by'):
+            if request.args.get(name):
+                filters[name] = request.args.get(name)
         
-        if request.args.get('success') is not None:
-            filters['success'] = request.args.get('success').lower() == 'true'
+        if filters.get('group_by') not in (None, 'resource'):
+            return jsonify({'error': 'قيمة group_by غير مدعومة (المدعوم: resource)'}), 400
         
-        # معاملات التصفح
-        page = int(request.args.get('page', 1))
-        per_page = min(int(request.args.get('per_page', 50)), 100)  # حد أقصى 100
+        try:
+            if request.args.get('start_date'):
+                filters['start_date'] = datetime.fromisoformat(request.args.get('start_date'))
+            
+            if request.args.get('end_date'):
+                filters['end_date'] = datetime.fromisoformat(request.args.get('end_date'))
+        except ValueError:
+            return jsonify({'error': 'صيغة التاريخ غير صحيحة (ISO 8601)'}), 400
         
-        # الحصول على السجلات
-        result = audit_logger.get_audit_logs(filters, page, per_page)
+        limit = int_arg(request.args, 'limit', 100, 1, 1000)
         
         return jsonify({
             'success': True,
-            'data': result
+            'data': audit_logger.get_aggregated_events(filters, limit)
         })
     
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        return jsonify({'error': f'خطأ في جلب سجلات المراجعة: {str(e)}'}), 500
+        return jsonify({'error': f'خطأ في جلب الأحداث المجمّعة: {str(e)}'}), 500
 
 @security_bp.route('/audit-statistics', methods=['GET'])
 @require_auth
@@ -96,55 +168,39 @@ def get_security_status():
         if not security_manager or not audit_logger:
             return jsonify({'error': 'أنظمة الأمان غير متاحة'}), 500
         
-        # إحصائيات الأمان للأسبوع الماضي
+        # إحصائيات الأمان للأسبوع الماضي (من العدادات اليومية)
         week_ago = datetime.utcnow() - timedelta(days=7)
         
         # عدد محاولات تسجيل الدخول الفاشلة
-        failed_logins = audit_logger.get_audit_logs({
-            'event_type': AuditEventType.LOGIN_FAILED.value,
-            'start_date': week_ago,
-            'success': False
-        }, per_page=1000)
+        failed_logins = audit_logger.count_events(AuditEventType.LOGIN_FAILED, week_ago, success=False)
         
         # عدد الانتهاكات الأمنية
-        security_violations = audit_logger.get_audit_logs({
-            'event_type': AuditEventType.SECURITY_VIOLATION.value,
-            'start_date': week_ago
-        }, per_page=1000)
+        security_violations = audit_logger.count_events(AuditEventType.SECURITY_VIOLATION, week_ago)
         
         # عدد الأنشطة المشبوهة
-        suspicious_activities = audit_logger.get_audit_logs({
-            'event_type': AuditEventType.SUSPICIOUS_ACTIVITY.value,
-            'start_date': week_ago
-        }, per_page=1000)
+        suspicious_activities = audit_logger.count_events(AuditEventType.SUSPICIOUS_ACTIVITY, week_ago)
         
         # عدد عناوين IP المحظورة
-        blocked_ips_count = len(security_manager.blocked_ips)
-        
-        # أكثر عناوين IP نشاطاً
-        top_ips = {}
-        for ip, attempts in security_manager.failed_attempts.items():
-            recent_attempts = [
-                attempt for attempt in attempts
-                if time.time() - attempt < 604800  # أسبوع واحد
-            ]
-            if recent_attempts:
-                top_ips[ip] = len(recent_attempts)
+        blocked_ips_count = security_manager.blocklist.count()
         
-        top_ips = sorted(top_ips.items(), key=lambda x: x[1], reverse=True)[:10]
+        # أكثر عناوين IP نشاطاً (فهرس ثابت الحجم في متتبع المحاولات الفاشلة)
+        top_ips = [
+            (ip, round(state['score'], 1))
+            for ip, state in security_manager.login_failures.ips.top(10)
+        ]
         
         # تقييم مستوى الأمان
         security_score = 100
         
-        if failed_logins['total'] > 50:
+        if failed_logins > 50:
             security_score -= 20
-        elif failed_logins['total'] > 20:
+        elif failed_logins > 20:
             security_score -= 10
         
-        if security_violations['total'] > 0:
+        if security_violations > 0:
             security_score -= 30
         
-        if suspicious_activities['total'] > 10:
+        if suspicious_activities > 10:
             security_score -= 15
         
         if blocked_ips_count > 10:
@@ -161,9 +217,9 @@ def get_security_status():
             'data': {
                 'security_score': max(security_score, 0),
                 'security_level': security_level,
-                'failed_logins_count': failed_logins['total'],
-                'security_violations_count': security_violations['total'],
-                'suspicious_activities_count': suspicious_activities['total'],
+                'failed_logins_count': failed_logins,
+                'security_violations_count': security_violations,
+                'suspicious_activities_count': suspicious_activities,
                 'blocked_ips_count': blocked_ips_count,
                 'top_suspicious_ips': [{'ip': ip, 'attempts': count} for ip, count in top_ips],
                 'last_updated': datetime.utcnow().isoformat()
@@ -177,11 +233,12 @@ def get_security_status():
 @require_auth
 @require_permission('security.manage')
 def block_ip():
-    """حظر عنوان IP"""
+    """حظر عنوان IP أو نطاق CIDR (مثل 203.0.113.0/24)، أو استثناؤه بـ action=allow"""
     try:
         data = request.get_json()
         ip_address = data.get('ip_address')
         reason = data.get('reason', 'حظر يدوي من المدير')
+        action = data.get('action', 'block')
         
         if not ip_address:
             return jsonify({'error': 'عنوان IP مطلوب'}), 400
@@ -192,8 +249,12 @@ def block_ip():
         if not security_manager:
             return jsonify({'error': 'نظام الأمان غير متاح'}), 500
         
-        # إضافة IP إلى قائمة المحظورين
-        security_manager.blocked_ips.add(ip_address)
+        # إضافة النطاق إلى قائمة الحظر المشتركة بين العمليات
+        try:
+            network = security_manager.blocklist.add(ip_address, action, reason)
+        except ValueError as e:
+            return jsonify({'error': f'عنوان IP أو نطاق غير صالح: {str(e)}'}), 400
+        ip_address = str(network)
         
         # تسجيل الحدث
         if audit_logger:
@@ -203,6 +264,7 @@ def block_ip():
                 user_id=session.get('user_id'),
                 additional_data={
                     'blocked_ip': ip_address,
+                    'action': action,
                     'reason': reason,
                     'blocked_by': 'admin'
                 }
@@ -234,12 +296,14 @@ def unblock_ip():
         if not security_manager:
             return jsonify({'error': 'نظام الأمان غير متاح'}), 500
         
-        # إزالة IP من قائمة المحظورين
-        security_manager.blocked_ips.discard(ip_address)
+        # إزالة النطاق من قائمة الحظر
+        try:
+            security_manager.blocklist.remove(ip_address)
+        except ValueError as e:
+            return jsonify({'error': f'عنوان IP أو نطاق غير صالح: {str(e)}'}), 400
         
         # مسح محاولات تسجيل الدخول الفاشلة
-        if ip_address in security_manager.failed_attempts:
-            del security_manager.failed_attempts[ip_address]
+        security_manager.clear_failed_attempts(ip_address)
         
         # تسجيل الحدث
         if audit_logger:
@@ -266,60 +330,132 @@ def unblock_ip():
 @require_auth
 @require_permission('security.view')
 def get_blocked_ips():
-    """الحصول على قائمة عناوين IP المحظورة"""
+    """الحصول على قائمة النطاقات المحظورة (مع البحث عن عنوان بعينه عبر ?ip=)"""
     try:
         security_manager = current_app.extensions.get('security_manager')
         
         if not security_manager:
             return jsonify({'error': 'نظام الأمان غير متاح'}), 500
         
-        blocked_ips = list(security_manager.blocked_ips)
+        blocklist = security_manager.blocklist
+        
+        # أطول نطاق يطابق عنواناً محدداً
+        if request.args.get('ip'):
+            found = blocklist.match(request.args.get('ip'))
+            return jsonify({
+                'success': True,
+                'data': {
+                    'ip_address': request.args.get('ip'),
+                    'matched_network': str(found[0]) if found else None,
+                    'action': found[1] if found else None,
+                    'blocked': bool(found) and found[1] == 'block'
+                }
+            })
+        
+        entries = blocklist.entries()
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
         
-        # إضافة معلومات إضافية لكل IP
+        # إضافة معلومات إضافية لكل نطاق
         ip_details = []
-        for ip in blocked_ips:
-            failed_attempts = security_manager.failed_attempts.get(ip, [])
-            recent_attempts = [
-                attempt for attempt in failed_attempts
-                if time.time() - attempt < 86400  # آخر 24 ساعة
-            ]
+        for network, action, reason in entries[offset:offset + limit]:
+            ip = str(network.network_address) if network.num_addresses == 1 else str(network)
+            failures = security_manager.login_failures.ips.get(ip)
             
             ip_details.append({
                 'ip_address': ip,
-                'failed_attempts_24h': len(recent_attempts),
-                'total_failed_attempts': len(failed_attempts),
-                'last_attempt': datetime.fromtimestamp(max(failed_attempts)).isoformat() if failed_attempts else None
+                'network': str(network),
+                'action': action,
+                'reason': reason,
+                'failed_attempts_24h': round(failures['last_24h']) if failures else 0,
+                'recent_failed_attempts': round(failures['score'], 1) if failures else 0,
+                'total_failed_attempts': failures['total'] if failures else 0,
+                'last_attempt': datetime.fromtimestamp(failures['last_attempt']).isoformat() if failures else None
             })
         
         return jsonify({
             'success': True,
             'data': {
                 'blocked_ips': ip_details,
-                'total_count': len(blocked_ips)
+                'total_count': len(entries),
+                'offset': offset,
+                'limit': limit
             }
         })
     
+    except ValueError as e:
+        return jsonify({'error': f'معاملات غير صالحة: {str(e)}'}), 400
     except Exception as e:
         return jsonify({'error': f'خطأ في جلب عناوين IP المحظورة: {str(e)}'}), 500
 
+@security_bp.route('/import-blocklist', methods=['POST'])
+@require_auth
+@require_permission('security.manage')
+def import_blocklist():
+    """استيراد قائمة حظر كاملة (ملف نصي، سطر لكل نطاق) استبدالاً أو دمجاً مع ?merge=true"""
+    try:
+        security_manager = current_app.extensions.get('security_manager')
+        audit_logger = current_app.extensions.get('audit_logger')
+        
+        if not security_manager:
+            return jsonify({'error': 'نظام الأمان غير متاح'}), 500
+        
+        upload = request.files.get('file')
+        if upload:
+            text = upload.read().decode('utf-8', errors='replace')
+        else:
+            text = request.get_data(as_text=True)
+        lines = text.splitlines()
+        if not any(line.strip() for line in lines):
+            return jsonify({'error': 'قائمة الحظر فارغة'}), 400
+        
+        merge = request.args.get('merge', 'false').lower() == 'true'
+        imported = security_manager.blocklist.replace(lines, merge=merge)
+        
+        if audit_logger:
+            audit_logger.log_event(
+                AuditEventType.IP_BLOCKED,
+                severity=AuditSeverity.HIGH.value,
+                user_id=session.get('user_id'),
+                additional_data={
+                    'action': 'import',
+                    'merge': merge,
+                    'entries': imported,
+                    'blocked_by': 'admin'
+                }
+            )
+        
+        return jsonify({
+            'success': True,
+            'message': f'تم استيراد {imported} نطاق',
+            'data': {'total_count': imported, 'merged': merge}
+        })
+    
+    except Exception as e:
+        return jsonify({'error': f'خطأ في استيراد قائمة الحظر: {str(e)}'}), 500
+
 @security_bp.route('/cleanup-audit-logs', methods=['POST'])
 @require_auth
 @require_permission('audit.manage')
 def cleanup_audit_logs():
-    """تنظيف سجلات المراجعة القديمة"""
+    """تنظيف سجلات المراجعة القديمة (في الخلفية على دفعات، مع مقاطع الأرشيف البارد المنتهية)"""
     try:
         data = request.get_json()
         days_to_keep = data.get('days_to_keep', 365)
+        archive = data.get('archive')
         
         # التحقق من صحة القيمة
         if not isinstance(days_to_keep, int) or days_to_keep < 30:
             return jsonify({'error': 'يجب الاحتفاظ بالسجلات لمدة 30 يوم على الأقل'}), 400
         
         audit_logger = current_app.extensions.get('audit_logger')
-        if not audit_logger:
+        audit_retention = current_app.extensions.get('audit_retention')
+        if not audit_logger or not audit_retention:
             return jsonify({'error': 'نظام المراجعة غير متاح'}), 500
         
-        deleted_count = audit_logger.cleanup_old_logs(days_to_keep)
+        status = audit_retention.status()
+        if (status and status.get('status') == 'running') or not audit_retention.start(days_to_keep, archive):
+            return jsonify({'error': 'عملية تنظيف أخرى جارية', 'data': status}), 409
         
         # تسجيل عملية التنظيف
         audit_logger.log_event(
@@ -329,19 +465,37 @@ def cleanup_audit_logs():
             additional_data={
                 'action': 'cleanup_audit_logs',
                 'days_to_keep': days_to_keep,
-                'deleted_count': deleted_count
+                'archive': archive
             }
         )
         
         return jsonify({
             'success': True,
-            'message': f'تم حذف {deleted_count} سجل قديم بنجاح',
-            'deleted_count': deleted_count
-        })
+            'message': 'بدأ تنظيف السجلات القديمة في الخلفية',
+            'status_url': url_for('security.get_audit_retention_status')
+        }), 202
     
     except Exception as e:
         return jsonify({'error': f'خطأ في تنظيف سجلات المراجعة: {str(e)}'}), 500
 
+@security_bp.route('/audit-retention', methods=['GET'])
+@require_auth
+@require_permission('audit.view')
+def get_audit_retention_status():
+    """تقدم آخر عملية تنظيف لسجلات المراجعة"""
+    try:
+        audit_retention = current_app.extensions.get('audit_retention')
+        if not audit_retention:
+            return jsonify({'error': 'نظام المراجعة غير متاح'}), 500
+        
+        return jsonify({
+            'success': True,
+            'data': audit_retention.status()
+        })
+    
+    except Exception as e:
+        return jsonify({'error': f'خطأ في جلب حالة التنظيف: {str(e)}'}), 500
+
 @security_bp.route('/security-settings', methods=['GET'])
 @require_auth
 @require_permission('security.view')
@@ -350,11 +504,14 @@ def get_security_settings():
     try:
         from flask import current_app
         
+        rate_policies = current_app.extensions['security_manager'].pipeline.policies
         settings = {
             'max_login_attempts': current_app.config.get('MAX_LOGIN_ATTEMPTS', 5),
             'lockout_duration': current_app.config.get('LOCKOUT_DURATION', 900),
             'rate_limit_requests': current_app.config.get('RATE_LIMIT_REQUESTS', 100),
             'rate_limit_window': current_app.config.get('RATE_LIMIT_WINDOW', 3600),
+            'rate_limit_budgets': rate_policies.budgets(),
+            'rate_limit_costs': rate_policies.costs(),
             'password_min_length': current_app.config.get('PASSWORD_MIN_LENGTH', 8),
             'require_strong_password': current_app.config.get('REQUIRE_STRONG_PASSWORD', True),
             'jwt_access_token_expires': str(current_app.config.get('JWT_ACCESS_TOKEN_EXPIRES', timedelta(hours=1))),
@@ -1,13 +1,24 @@
-from flask import Blueprint, request, jsonify, session, redirect
-from src.models.user import db, User
+from flask import Blueprint, Response, current_app, request, jsonify, session, redirect, stream_with_context
+from src.models.user import db
 from src.models.url import ShortenedUrl
 from src.models.analytics import Analytics
+from src.analytics.sampling import click_sampler
+from src.models.pagination import PaginationError, int_arg, keyset_paginate, pagination_args, page_meta, parse_sort
+from src.models.serializers import InvalidFields, UrlSerializer
+from src.models.fts import SearchQueryError
+from src.models.url_search import url_search
+from src.security.identity import identity_manager
+from src.security.pipeline import REDIRECT, mark_authenticated, route_class
 from functools import wraps
 from datetime import datetime
+import json
 import validators
 
 url_enhanced_bp = Blueprint('url_enhanced', __name__)
 
+# أعمدة الفرز المسموحة (مفهرسة) لقوائم الروابط
+URL_SORT_COLUMNS = ('created_at', 'clicks', 'id')
+
 def require_login():
     """ديكوريتر للتحقق من تسجيل الدخول"""
     def decorator(f):
@@ -16,12 +27,12 @@ def require_login():
             if 'user_id' not in session:
                 return jsonify({'error': 'يجب تسجيل الدخول أولاً'}), 401
             
-            user = User.query.get(session['user_id'])
-            if not user or not user.is_active or user.deleted_at:
+            user = identity_manager.current()
+            if not user:
                 return jsonify({'error': 'المستخدم غير موجود أو غير نشط'}), 401
             
             return f(*args, **kwargs)
-        return decorated_function
+        return mark_authenticated(decorated_function)
     return decorator
 
 def require_permission(permission_name):
@@ -32,15 +43,15 @@ def require_permission(permission_name):
             if 'user_id' not in session:
                 return jsonify({'error': 'غير مصرح لك بالوصول'}), 401
             
-            user = User.query.get(session['user_id'])
-            if not user or not user.is_active or user.deleted_at:
+            user = identity_manager.current()
+            if not user:
                 return jsonify({'error': 'المستخدم غير موجود أو غير نشط'}), 401
             
             if not user.has_permission(permission_name):
                 return jsonify({'error': 'ليس لديك صلاحية للوصول إلى هذه الوظيفة'}), 403
             
             return f(*args, **kwargs)
-        return decorated_function
+        return mark_authenticated(decorated_function)
     return decorator
 
 @url_enhanced_bp.route('/shorten', methods=['POST'])
@@ -111,16 +122,84 @@ def get_my_urls():
         user_id = session['user_id']
         include_deleted = request.args.get('include_deleted', 'false').lower() == 'true'
         
-        urls = ShortenedUrl.get_by_user(user_id, include_deleted=include_deleted)
+        sort, descending = parse_sort(request.args.get('sort'), URL_SORT_COLUMNS, '-created_at')
+        serializer = UrlSerializer(request.args.get('fields'), include=('stats',))
+        sort_column = getattr(ShortenedUrl, sort)
+        page = keyset_paginate(
+            serializer.apply(ShortenedUrl.user_query(user_id, include_deleted=include_deleted), sort_column),
+            sort_column, ShortenedUrl.id, descending,
+            **pagination_args(request.args)
+        )
         
         return jsonify({
             'success': True,
-            'data': [url.to_dict(include_stats=True) for url in urls]
+            'data': serializer.dump_many(page['items']),
+            'pagination': page_meta(page)
         })
     
+    except (PaginationError, InvalidFields) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'خطأ في جلب الروابط: {str(e)}'}), 500
 
+@url_enhanced_bp.route('/my-urls/search', methods=['GET'])
+@require_permission('urls.view_own')
+def search_my_urls():
+    """البحث في روابط المستخدم مرتباً حسب الصلة ومصفحاً
+
+    q: كلمات و"عبارات" و حقل:كلمة (code, alias, domain, title, description, url) و بادئة* و OR،
+    و prefix=true تجعل آخر كلمة بادئة للبحث أثناء الكتابة.
+    """
+    try:
+        user_id = session['user_id']
+        include_deleted = request.args.get('include_deleted', 'false').lower() == 'true'
+        prefix_last = request.args.get('prefix', 'false').lower() == 'true'
+        page = int_arg(request.args, 'page', 1)
+        per_page = int_arg(request.args, 'per_page', 50, 1, 100)
+        
+        hits, has_next = url_search.search(
+            request.args.get('q', ''), user_id, include_deleted, page, per_page, prefix_last
+        )
+        
+        serializer = UrlSerializer(request.args.get('fields'), include=('stats',))
+        ids = [url_id for url_id, _, _ in hits]
+        urls = {url.id: url for url in serializer.apply(ShortenedUrl.query.filter(ShortenedUrl.id.in_(ids)))}
+        ranked = [urls[url_id] for url_id in ids if url_id in urls]
+        
+        data = serializer.dump_many(ranked)
+        matches = {url_id: (rank, snippet) for url_id, rank, snippet in hits}
+        for item, url in zip(data, ranked):
+            item['rank'], item['snippet'] = matches[url.id]
+        
+        return jsonify({
+            'success': True,
+            'data': data,
+            'pagination': {'page': page, 'per_page': per_page, 'has_next': has_next, 'has_prev': page > 1}
+        })
+    
+    except (SearchQueryError, PaginationError, InvalidFields) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'خطأ في البحث في الروابط: {str(e)}'}), 500
+
+@url_enhanced_bp.route('/my-urls/suggest', methods=['GET'])
+@require_permission('urls.view_own')
+def suggest_my_urls():
+    """إكمال تلقائي على رموز روابط المستخدم وأسمائها المخصصة ونطاقاتها"""
+    try:
+        limit = int_arg(request.args, 'limit', 10, 1, 25)
+        suggestions = url_search.suggest(request.args.get('q', ''), session['user_id'], limit=limit)
+        
+        return jsonify({
+            'success': True,
+            'data': suggestions
+        })
+    
+    except (SearchQueryError, PaginationError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'خطأ في الإكمال التلقائي: {str(e)}'}), 500
+
 @url_enhanced_bp.route('/urls', methods=['GET'])
 @require_permission('urls.view_all')
 def get_all_urls():
@@ -129,16 +208,27 @@ def get_all_urls():
         user_id = request.args.get('user_id')
         
         if include_deleted:
-            urls = ShortenedUrl.query.all()
+            query = ShortenedUrl.query
         elif user_id:
-            urls = ShortenedUrl.get_by_user(int(user_id), include_deleted=False)
+            query = ShortenedUrl.user_query(int(user_id), include_deleted=False)
         else:
-            urls = ShortenedUrl.get_active_urls()
+            query = ShortenedUrl.active_query()
+        
+        sort, descending = parse_sort(request.args.get('sort'), URL_SORT_COLUMNS, '-created_at')
+        serializer = UrlSerializer(request.args.get('fields'), include=('stats',))
+        sort_column = getattr(ShortenedUrl, sort)
+        page = keyset_paginate(
+            serializer.apply(query, sort_column), sort_column, ShortenedUrl.id, descending,
+            **pagination_args(request.args)
+        )
         
         return jsonify({
             'success': True,
-            'data': [url.to_dict(include_stats=True) for url in urls]
+            'data': serializer.dump_many(page['items']),
+            'pagination': page_meta(page)
         })
+    except (PaginationError, InvalidFields) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'خطأ في جلب الروابط: {str(e)}'}), 500
 
@@ -150,7 +240,7 @@ def get_url_details(url_id):
         if not url:
             return jsonify({'error': 'الرابط غير موجود'}), 404
         
-        user = User.query.get(session['user_id'])
+        user = identity_manager.current()
         
         # التحقق من الصلاحيات
         if not user.has_permission('urls.view_all') and url.user_id != user.id:
@@ -172,7 +262,7 @@ def update_url(url_id):
         if not url:
             return jsonify({'error': 'الرابط غير موجود'}), 404
         
-        user = User.query.get(session['user_id'])
+        user = identity_manager.current()
         
         # التحقق من الصلاحيات
         can_edit = (user.has_permission('urls.edit_all') or 
@@ -234,7 +324,7 @@ def delete_url(url_id):
         if not url:
             return jsonify({'error': 'الرابط غير موجود'}), 404
         
-        user = User.query.get(session['user_id'])
+        user = identity_manager.current()
         
         # التحقق من الصلاحيات
         can_delete = (user.has_permission('urls.delete_all') or 
@@ -287,7 +377,7 @@ def get_url_stats(url_id):
         if not url:
             return jsonify({'error': 'الرابط غير موجود'}), 404
         
-        user = User.query.get(session['user_id'])
+        user = identity_manager.current()
         
         # التحقق من الصلاحيات
         can_view_stats = (user.has_permission('reports.view_all') or 
@@ -297,7 +387,8 @@ def get_url_stats(url_id):
             return jsonify({'error': 'ليس لديك صلاحية لعرض إحصائيات هذا الرابط'}), 403
         
         days = int(request.args.get('days', 30))
-        stats = Analytics.get_url_detailed_stats(url_id, days)
+        approximate = click_sampler.wants_approximate(request.args.get('approximate'), days)
+        stats = Analytics.get_url_detailed_stats(url_id, days, approximate=approximate)
         
         return jsonify({
             'success': True,
@@ -329,7 +420,8 @@ def get_my_stats():
 def get_system_stats():
     try:
         days = int(request.args.get('days', 30))
-        stats = Analytics.get_system_stats(days)
+        approximate = click_sampler.wants_approximate(request.args.get('approximate'), days)
+        stats = Analytics.get_system_stats(days, approximate=approximate)
         
         return jsonify({
             'success': True,
@@ -342,34 +434,19 @@ def get_system_stats():
 @require_permission('reports.view_all')
 def get_users_stats():
     try:
-        users = User.get_active_users()
-        users_stats = []
-        
-        for user in users:
-            user_urls = ShortenedUrl.get_by_user(user.id, include_deleted=False)
-            total_urls = len(user_urls)
-            total_clicks = sum(url.clicks for url in user_urls)
-            avg_clicks = round(total_clicks / total_urls, 2) if total_urls > 0 else 0
+        query = Analytics.users_stats_query()
+        
+        # للمؤسسات الكبيرة: بث سطر JSON لكل مستخدم دون تجميع الاستجابة في الذاكرة
+        if request.args.get('format') == 'ndjson':
+            def generate():
+                for row in query.yield_per(1000):
+                    yield json.dumps(Analytics.format_user_stats(row), ensure_ascii=False) + '\n'
             
-            users_stats.append({
-                'user_id': user.id,
-                'username': user.username,
-                'full_name': user.full_name,
-                'email': user.email,
-                'department': user.department,
-                'position': user.position,
-                'is_admin': user.is_admin,
-                'role_name': user.role_obj.display_name if user.role_obj else 'غير محدد',
-                'total_urls': total_urls,
-                'total_clicks': total_clicks,
-                'avg_clicks': avg_clicks,
-                'last_login': user.last_login.strftime('%Y-%m-%d %H:%M:%S') if user.last_login else 'لم يسجل دخول',
-                'created_at': user.created_at.strftime('%Y-%m-%d %H:%M:%S')
-            })
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
         
         return jsonify({
             'success': True,
-            'data': users_stats
+            'data': [Analytics.format_user_stats(row) for row in query.all()]
         })
         
     except Exception as e:
@@ -377,6 +454,7 @@ def get_users_stats():
 
 # نقطة النهاية للتوجيه (الرابط المختصر)
 @url_enhanced_bp.route('/<short_code>')
+@route_class(REDIRECT)
 def redirect_url(short_code):
     try:
         url = ShortenedUrl.get_by_short_code(short_code)
@@ -395,6 +473,11 @@ def redirect_url(short_code):
         
         url.increment_clicks(ip_address=ip_address, user_agent=user_agent, referer=referer)
         
+        # مراجعة الوصول: تُجمَّع صفاً لكل رابط ودقيقة حسب سياسة url_accessed
+        audit_logger = current_app.extensions.get('audit_logger')
+        if audit_logger:
+            audit_logger.log_url_accessed(url.id, {'short_code': short_code}, {'referer': referer})
+        
         return redirect(url.original_url)
     
     except Exception as e:
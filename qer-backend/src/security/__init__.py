@@ -4,13 +4,56 @@
 """
 
 from .security_manager import SecurityManager, require_auth, require_permission, rate_limit
-from .audit_logger import AuditLogger, AuditEventType, AuditSeverity
+from .audit_logger import AuditLogger, AuditEventType, AuditSeverity, AuditPolicy
+from .audit_writer import AuditWriter, audit_writer
+from .audit_retention import AuditRetention, audit_retention
+from .audit_search import AuditSearchIndex, SearchQueryError, audit_search
+from .permissions import PermissionCompiler, permission_compiler
+from .identity import Identity, IdentityManager, identity_manager
+from .revocation import BloomFilter, TokenRevocationStore, token_revocations
+from .rate_limiter import GcraRateLimiter, rate_limiter
+from .rate_policies import RatePolicy, RatePolicyRegistry, rate_policy
+from .ip_blocklist import IpBlocklist, PatriciaTrie, ip_blocklist
+from .login_failures import DecayingCounters, LoginFailureTracker, login_failures
+from .breached_passwords import BreachedPasswordScreen, breached_passwords
+from .sanitizer import InputSanitizer, input_sanitizer
 
 __all__ = [
     'SecurityManager',
     'AuditLogger', 
     'AuditEventType',
     'AuditSeverity',
+    'AuditPolicy',
+    'AuditWriter',
+    'audit_writer',
+    'AuditRetention',
+    'audit_retention',
+    'AuditSearchIndex',
+    'SearchQueryError',
+    'audit_search',
+    'PermissionCompiler',
+    'permission_compiler',
+    'Identity',
+    'IdentityManager',
+    'identity_manager',
+    'BloomFilter',
+    'TokenRevocationStore',
+    'token_revocations',
+    'GcraRateLimiter',
+    'rate_limiter',
+    'RatePolicy',
+    'RatePolicyRegistry',
+    'rate_policy',
+    'IpBlocklist',
+    'PatriciaTrie',
+    'ip_blocklist',
+    'DecayingCounters',
+    'LoginFailureTracker',
+    'login_failures',
+    'BreachedPasswordScreen',
+    'breached_passwords',
+    'InputSanitizer',
+    'input_sanitizer',
     'require_auth',
     'require_permission',
     'rate_limit'
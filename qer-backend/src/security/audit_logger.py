@@ -4,10 +4,16 @@
 """
 
 import json
-from datetime import datetime
+import random
+from datetime import date, datetime
 from enum import Enum
 from flask import request, session, current_app
+from sqlalchemy import select, union_all
+from sqlalchemy.orm import aliased
 from src.models.user import db
+from src.security.audit_writer import COLUMNS, COUNTER_DIMENSIONS, add_count, audit_writer
+from src.security.audit_retention import audit_retention
+from src.security.audit_search import audit_search
 
 class AuditEventType(Enum):
     """أنواع أحداث المراجعة"""
@@ -58,6 +64,17 @@ class AuditSeverity(Enum):
     HIGH = "high"
     CRITICAL = "critical"
 
+class AuditPolicy(Enum):
+    """سياسات تسجيل أنواع الأحداث"""
+    FULL = "full"            # صف لكل حدث
+    AGGREGATE = "aggregate"  # صف لكل (نوع، مورد، دقيقة) بعدد وعينات
+    OFF = "off"
+
+# الأحداث كثيرة التكرار تُجمَّع، وما عداها (المصادقة والإدارة والأمان) بدقة كاملة
+DEFAULT_AUDIT_POLICIES = {
+    AuditEventType.URL_ACCESSED.value: AuditPolicy.AGGREGATE.value
+}
+
 class AuditLog(db.Model):
     """نموذج سجل المراجعة"""
     __tablename__ = 'audit_logs'
@@ -115,22 +132,122 @@ class AuditLog(db.Model):
             'session_id': self.session_id
         }
 
+class AuditAggregate(db.Model):
+    """نموذج الأحداث المجمّعة: صف لكل (نوع الحدث، المورد، الدقيقة)"""
+    __tablename__ = 'audit_aggregates'
+    __table_args__ = (
+        db.UniqueConstraint('event_type', 'resource_id', 'bucket', name='uq_audit_aggregate_bucket'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(50), nullable=False)
+    resource_type = db.Column(db.String(50), nullable=True)
+    resource_id = db.Column(db.String(100), nullable=False, default='')  # '' بدل NULL ليعمل القيد الفريد
+    severity = db.Column(db.String(20), nullable=True)  # الخطورة الغالبة في الدقيقة
+    bucket = db.Column(db.DateTime, nullable=False, index=True)  # بداية الدقيقة
+    
+    count = db.Column(db.Integer, nullable=False, default=0)
+    failures = db.Column(db.Integer, nullable=False, default=0)
+    first_seen = db.Column(db.DateTime, nullable=True)
+    last_seen = db.Column(db.DateTime, nullable=True)
+    samples = db.Column(db.Text, nullable=True)  # JSON: عينات من أحداث الدقيقة
+    
+    def __repr__(self):
+        return f'<AuditAggregate {self.event_type} {self.resource_id} @ {self.bucket}: {self.count}>'
+    
+    def to_dict(self):
+        """تحويل الصف إلى قاموس"""
+        return {
+            'id': self.id,
+            'event_type': self.event_type,
+            'resource_type': self.resource_type,
+            'resource_id': self.resource_id or None,
+            'severity': self.severity,
+            'bucket': self.bucket.isoformat() if self.bucket else None,
+            'count': self.count,
+            'failures': self.failures,
+            'first_seen': self.first_seen.isoformat() if self.first_seen else None,
+            'last_seen': self.last_seen.isoformat() if self.last_seen else None,
+            'samples': json.loads(self.samples) if self.samples else []
+        }
+
+class AuditDailyCounter(db.Model):
+    """عدادات المراجعة اليومية: عدد الأحداث لكل (يوم، بُعد، قيمة)
+
+    تُحدَّث مع كتابة كل دفعة أحداث، والأبعاد: event_type و severity و username و ip_address.
+    """
+    __tablename__ = 'audit_daily_counters'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'dimension', 'value', name='uq_audit_daily_counter'),
+        db.Index('ix_audit_daily_counters_dimension_day', 'dimension', 'day'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    dimension = db.Column(db.String(20), nullable=False)
+    value = db.Column(db.String(100), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    failures = db.Column(db.Integer, nullable=False, default=0)  # أحداث success=False
+    
+    def __repr__(self):
+        return f'<AuditDailyCounter {self.day} {self.dimension}={self.value}: {self.count}>'
+
+def _as_date(value):
+    """func.date تعيد نصاً في SQLite وتاريخاً في PostgreSQL"""
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
 class AuditLogger:
     """مسجل أحداث المراجعة"""
     
     def __init__(self, app=None):
         self.app = app
+        self.policies = {}
         if app:
             self.init_app(app)
     
     def init_app(self, app):
         """تهيئة مسجل المراجعة مع التطبيق"""
         self.app = app
+        # نوع الحدث ← 'full' أو 'aggregate' أو 'off'، أو {'mode': ..., 'sample_rate': ...}
+        app.config.setdefault('AUDIT_POLICIES', {})
         app.extensions['audit_logger'] = self
+        audit_writer.init_app(app)
+        audit_retention.init_app(app)
+        audit_search.init_app(app)
+        
+        self.policies = {}
+        for event_type, policy in {**DEFAULT_AUDIT_POLICIES, **app.config['AUDIT_POLICIES']}.items():
+            if not isinstance(policy, dict):
+                policy = {'mode': policy}
+            mode = AuditPolicy(policy.get('mode', AuditPolicy.FULL.value))
+            sample_rate = float(policy.get('sample_rate', 1.0))
+            if not 0 < sample_rate <= 1:
+                raise ValueError(f'نسبة العينة لـ {event_type} يجب أن تكون بين 0 و 1')
+            self.policies[event_type.value if isinstance(event_type, AuditEventType) else event_type] = (mode, sample_rate)
+    
+    def policy(self, event_type):
+        """سياسة نوع الحدث: (AuditPolicy، نسبة العينة)"""
+        return self.policies.get(event_type, (AuditPolicy.FULL, 1.0))
     
-    def log_event(self, event_type, **kwargs):
-        """تسجيل حدث مراجعة"""
+    def log_event(self, event_type, sync=False, **kwargs):
+        """تسجيل حدث مراجعة
+
+        يُلتقط الحدث صفاً بسيطاً ويُكتب دفعات من خيط خلفي بمعاملة مستقلة عن الطلب،
+        والأحداث الحرجة (أو sync=True) تُكتب فوراً قبل العودة.
+        سياسة نوع الحدث تحدد كتابته: صف كامل (مع sample_rate تُكتب تلك النسبة فقط)،
+        أو احتسابه في صف الدقيقة المجمّع، أو تجاهله. الأحداث عالية الخطورة تُكتب كاملة دائماً.
+        """
         try:
+            event_type = event_type.value if isinstance(event_type, AuditEventType) else event_type
+            severity = kwargs.get('severity', AuditSeverity.LOW.value)
+            mode, sample_rate = self.policy(event_type)
+            if severity in (AuditSeverity.HIGH.value, AuditSeverity.CRITICAL.value) or sync:
+                mode, sample_rate = AuditPolicy.FULL, 1.0
+            if mode is AuditPolicy.OFF:
+                return None
+            if mode is AuditPolicy.FULL and sample_rate < 1 and random.random() >= sample_rate:
+                return None
+            
             # الحصول على معلومات الطلب الحالي
             ip_address = self._get_client_ip()
             user_agent = request.headers.get('User-Agent') if request else None
@@ -142,34 +259,38 @@ class AuditLogger:
             user_id = kwargs.get('user_id') or session.get('user_id') if session else None
             username = kwargs.get('username')
             
-            # إنشاء سجل المراجعة
-            audit_log = AuditLog(
-                event_type=event_type.value if isinstance(event_type, AuditEventType) else event_type,
-                severity=kwargs.get('severity', AuditSeverity.LOW.value),
-                user_id=user_id,
-                username=username,
-                ip_address=ip_address,
-                user_agent=user_agent,
-                endpoint=endpoint,
-                method=method,
-                resource_type=kwargs.get('resource_type'),
-                resource_id=str(kwargs.get('resource_id')) if kwargs.get('resource_id') else None,
-                old_values=json.dumps(kwargs.get('old_values'), ensure_ascii=False) if kwargs.get('old_values') else None,
-                new_values=json.dumps(kwargs.get('new_values'), ensure_ascii=False) if kwargs.get('new_values') else None,
-                additional_data=json.dumps(kwargs.get('additional_data'), ensure_ascii=False) if kwargs.get('additional_data') else None,
-                success=kwargs.get('success', True),
-                error_message=kwargs.get('error_message'),
-                session_id=session_id
+            # التقاط الحدث بترتيب أعمدة audit_logs
+            event = (
+                datetime.utcnow(),
+                event_type,
+                severity,
+                user_id,
+                username,
+                ip_address,
+                user_agent,
+                endpoint,
+                method,
+                kwargs.get('resource_type'),
+                str(kwargs.get('resource_id')) if kwargs.get('resource_id') else None,
+                json.dumps(kwargs.get('old_values'), ensure_ascii=False) if kwargs.get('old_values') else None,
+                json.dumps(kwargs.get('new_values'), ensure_ascii=False) if kwargs.get('new_values') else None,
+                json.dumps(kwargs.get('additional_data'), ensure_ascii=False) if kwargs.get('additional_data') else None,
+                kwargs.get('success', True),
+                kwargs.get('error_message'),
+                session_id
             )
             
-            db.session.add(audit_log)
-            db.session.commit()
+            if mode is AuditPolicy.AGGREGATE:
+                audit_writer.aggregate(event)
+                return event
+            
+            audit_writer.submit(event, sync=sync)
             
             # تسجيل في ملف النظام أيضاً للأحداث المهمة
-            if kwargs.get('severity') in [AuditSeverity.HIGH.value, AuditSeverity.CRITICAL.value]:
-                current_app.logger.warning(f"High severity audit event: {audit_log.to_dict()}")
+            if severity in [AuditSeverity.HIGH.value, AuditSeverity.CRITICAL.value]:
+                current_app.logger.warning(f"High severity audit event: {dict(zip(COLUMNS, event))}")
             
-            return audit_log
+            return event
             
         except Exception as e:
             # في حالة فشل تسجيل المراجعة، نسجل الخطأ ولا نوقف العملية
@@ -325,125 +446,222 @@ class AuditLogger:
             }
         )
     
-    def get_audit_logs(self, filters=None, page=1, per_page=50):
-        """الحصول على سجلات المراجعة مع التصفية"""
-        query = AuditLog.query
+    def _audit_source(self, start_date=None, end_date=None, include_archived=False):
+        """مصدر الاستعلام: الجدول الحي، أو دمجه مع الأرشيف البارد إن امتدت الفترة إليه"""
+        archive = current_app.extensions.get('cold_archive')
+        if not archive:
+            return AuditLog
+        
+        if not include_archived:
+            archived_until = archive.archived_until('audit_logs')
+            if not archived_until or not start_date or start_date > archived_until:
+                return AuditLog
+        
+        scan = archive.scan_table('audit_logs', AuditLog.__table__, start_date, end_date)
+        combined = union_all(select(AuditLog.__table__), select(scan)).subquery('audit_logs_all')
+        return aliased(AuditLog, combined)
+    
+    def get_audit_logs(self, filters=None, per_page=50, cursor=None, total=None):
+        """الحصول على سجلات المراجعة مع التصفية
+
+        التصفح بالمؤشر على (timestamp, id) بدل OFFSET، والعدد الكلي اختياري
+        (total='exact' أو 'estimate') لأنه يتطلب مسح كل السجلات المطابقة.
+        """
+        from src.models.pagination import keyset_paginate, page_meta
+        
+        filters = filters or {}
+        source = self._audit_source(
+            filters.get('start_date'),
+            filters.get('end_date'),
+            filters.get('include_archived', False)
+        )
+        query = db.session.query(source)
         
         if filters:
             if filters.get('event_type'):
-                query = query.filter(AuditLog.event_type == filters['event_type'])
+                query = query.filter(source.event_type == filters['event_type'])
             
             if filters.get('user_id'):
-                query = query.filter(AuditLog.user_id == filters['user_id'])
+                query = query.filter(source.user_id == filters['user_id'])
             
             if filters.get('severity'):
-                query = query.filter(AuditLog.severity == filters['severity'])
+                query = query.filter(source.severity == filters['severity'])
             
             if filters.get('start_date'):
-                query = query.filter(AuditLog.timestamp >= filters['start_date'])
+                query = query.filter(source.timestamp >= filters['start_date'])
             
             if filters.get('end_date'):
-                query = query.filter(AuditLog.timestamp <= filters['end_date'])
+                query = query.filter(source.timestamp <= filters['end_date'])
             
             if filters.get('ip_address'):
-                query = query.filter(AuditLog.ip_address == filters['ip_address'])
+                query = query.filter(source.ip_address == filters['ip_address'])
             
             if filters.get('resource_type'):
-                query = query.filter(AuditLog.resource_type == filters['resource_type'])
+                query = query.filter(source.resource_type == filters['resource_type'])
             
             if filters.get('success') is not None:
-                query = query.filter(AuditLog.success == filters['success'])
+                query = query.filter(source.success == filters['success'])
         
-        # ترتيب حسب التاريخ (الأحدث أولاً)
-        query = query.order_by(AuditLog.timestamp.desc())
-        
-        # تطبيق التصفح
-        pagination = query.paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
+        # الأحدث أولاً مع التصفح بالمؤشر
+        page = keyset_paginate(
+            query, source.timestamp, source.id, descending=True,
+            cursor=cursor, per_page=per_page, total=total
         )
         
-        return {
-            'logs': [log.to_dict() for log in pagination.items],
-            'total': pagination.total,
-            'pages': pagination.pages,
-            'current_page': page,
-            'per_page': per_page,
-            'has_next': pagination.has_next,
-            'has_prev': pagination.has_prev
-        }
+        result = {'logs': [log.to_dict() for log in page['items']]}
+        result.update(page_meta(page))
+        return result
     
-    def get_audit_statistics(self, days=30):
-        """الحصول على إحصائيات المراجعة"""
-        from datetime import timedelta
+    def get_aggregated_events(self, filters=None, limit=100):
+        """الأحداث المجمّعة: صفوف الدقائق الأحدث أولاً، أو مجاميعها لكل مورد (group_by='resource')"""
         from sqlalchemy import func
         
-        start_date = datetime.utcnow() - timedelta(days=days)
+        filters = filters or {}
+        conditions = []
+        if filters.get('event_type'):
+            conditions.append(AuditAggregate.event_type == filters['event_type'])
+        if filters.get('resource_type'):
+            conditions.append(AuditAggregate.resource_type == filters['resource_type'])
+        if filters.get('resource_id'):
+            conditions.append(AuditAggregate.resource_id == str(filters['resource_id']))
+        if filters.get('start_date'):
+            conditions.append(AuditAggregate.bucket >= filters['start_date'].replace(second=0, microsecond=0))
+        if filters.get('end_date'):
+            conditions.append(AuditAggregate.bucket <= filters['end_date'])
         
-        # إحصائيات عامة
-        total_events = AuditLog.query.filter(AuditLog.timestamp >= start_date).count()
+        if filters.get('group_by') == 'resource':
+            rows = db.session.query(
+                AuditAggregate.event_type,
+                AuditAggregate.resource_type,
+                AuditAggregate.resource_id,
+                func.sum(AuditAggregate.count).label('count'),
+                func.sum(AuditAggregate.failures).label('failures'),
+                func.min(AuditAggregate.first_seen).label('first_seen'),
+                func.max(AuditAggregate.last_seen).label('last_seen')
+            ).filter(*conditions).group_by(
+                AuditAggregate.event_type, AuditAggregate.resource_type, AuditAggregate.resource_id
+            ).order_by(func.sum(AuditAggregate.count).desc()).limit(limit).all()
+            return [{
+                'event_type': row.event_type,
+                'resource_type': row.resource_type,
+                'resource_id': row.resource_id or None,
+                'count': row.count,
+                'failures': row.failures,
+                'first_seen': row.first_seen.isoformat() if row.first_seen else None,
+                'last_seen': row.last_seen.isoformat() if row.last_seen else None
+            } for row in rows]
         
-        # إحصائيات حسب نوع الحدث
-        event_stats = db.session.query(
-            AuditLog.event_type,
-            func.count(AuditLog.id).label('count')
-        ).filter(
-            AuditLog.timestamp >= start_date
-        ).group_by(AuditLog.event_type).all()
+        rows = AuditAggregate.query.filter(*conditions).order_by(
+            AuditAggregate.bucket.desc(), AuditAggregate.id.desc()
+        ).limit(limit).all()
+        return [row.to_dict() for row in rows]
+    
+    def _counter_totals(self, dimension, start_day, limit=None, value=None):
+        """مجاميع العدادات اليومية لبعد واحد منذ يوم معين: [(القيمة، العدد، الفاشلة)]"""
+        from sqlalchemy import func
         
-        # إحصائيات حسب مستوى الخطورة
-        severity_stats = db.session.query(
-            AuditLog.severity,
-            func.count(AuditLog.id).label('count')
+        total = func.sum(AuditDailyCounter.count)
+        query = db.session.query(
+            AuditDailyCounter.value,
+            total.label('count'),
+            func.sum(AuditDailyCounter.failures).label('failures')
         ).filter(
-            AuditLog.timestamp >= start_date
-        ).group_by(AuditLog.severity).all()
+            AuditDailyCounter.dimension == dimension,
+            AuditDailyCounter.day >= start_day
+        )
+        if value is not None:
+            query = query.filter(AuditDailyCounter.value == value)
+        query = query.group_by(AuditDailyCounter.value).order_by(total.desc())
+        if limit:
+            query = query.limit(limit)
+        return [(row.value, row.count, row.failures) for row in query.all()]
+    
+    def count_events(self, event_type, since, success=None):
+        """عدد أحداث نوع معين منذ تاريخ (بدقة اليوم) من العدادات اليومية"""
+        event_type = event_type.value if isinstance(event_type, AuditEventType) else event_type
+        rows = self._counter_totals('event_type', since.date(), value=event_type)
+        if not rows:
+            return 0
+        _, count, failures = rows[0]
+        if success is None:
+            return count
+        return count - failures if success else failures
+    
+    def get_audit_statistics(self, days=30):
+        """الحصول على إحصائيات المراجعة
+
+        تُقرأ من العدادات اليومية (صفوف بعدد الأيام والقيم لا بعدد الأحداث)،
+        فتشمل الفترة اليوم الأول كاملاً، ومعها الأحداث المجمّعة في كل الأبعاد.
+        """
+        from datetime import timedelta
         
-        # أكثر المستخدمين نشاطاً
-        user_stats = db.session.query(
-            AuditLog.username,
-            func.count(AuditLog.id).label('count')
-        ).filter(
-            AuditLog.timestamp >= start_date,
-            AuditLog.username.isnot(None)
-        ).group_by(AuditLog.username).order_by(
-            func.count(AuditLog.id).desc()
-        ).limit(10).all()
+        start_day = (datetime.utcnow() - timedelta(days=days)).date()
         
-        # أكثر عناوين IP نشاطاً
-        ip_stats = db.session.query(
-            AuditLog.ip_address,
-            func.count(AuditLog.id).label('count')
-        ).filter(
-            AuditLog.timestamp >= start_date,
-            AuditLog.ip_address.isnot(None)
-        ).group_by(AuditLog.ip_address).order_by(
-            func.count(AuditLog.id).desc()
-        ).limit(10).all()
+        event_stats = self._counter_totals('event_type', start_day)
+        severity_stats = self._counter_totals('severity', start_day)
+        user_stats = self._counter_totals('username', start_day, limit=10)
+        ip_stats = self._counter_totals('ip_address', start_day, limit=10)
         
         return {
-            'total_events': total_events,
+            'total_events': sum(stat[1] for stat in event_stats),
             'period_days': days,
+            'period_start': start_day.isoformat(),
             'event_types': [{'type': stat[0], 'count': stat[1]} for stat in event_stats],
             'severity_levels': [{'severity': stat[0], 'count': stat[1]} for stat in severity_stats],
             'top_users': [{'username': stat[0], 'count': stat[1]} for stat in user_stats],
             'top_ips': [{'ip_address': stat[0], 'count': stat[1]} for stat in ip_stats]
         }
     
-    def cleanup_old_logs(self, days_to_keep=365):
-        """تنظيف السجلات القديمة"""
-        from datetime import timedelta
+    def rebuild_counters(self):
+        """إعادة بناء العدادات اليومية من audit_logs و audit_aggregates (عند الترقية أو بعد خلل)
+
+        الصفوف المجمّعة لا تحفظ المستخدم و IP، فلا تُستعاد حصتها في هذين البعدين.
+        """
+        from sqlalchemy import case, func
         
-        cutoff_date = datetime.utcnow() - timedelta(days=days_to_keep)
+        counts = {}
+        failed = func.sum(case((AuditLog.success.is_(False), 1), else_=0))
+        day = func.date(AuditLog.timestamp)
+        for dimension in COUNTER_DIMENSIONS:
+            column = getattr(AuditLog, dimension)
+            rows = db.session.query(day, column, func.count(AuditLog.id), failed).filter(
+                column.isnot(None)
+            ).group_by(day, column).all()
+            for row_day, value, count, failures in rows:
+                add_count(counts, (_as_date(row_day), dimension, value), count, failures or 0)
         
-        deleted_count = AuditLog.query.filter(
-            AuditLog.timestamp < cutoff_date
-        ).delete()
+        bucket_day = func.date(AuditAggregate.bucket)
+        rows = db.session.query(
+            bucket_day, AuditAggregate.event_type, AuditAggregate.severity,
+            func.sum(AuditAggregate.count), func.sum(AuditAggregate.failures)
+        ).group_by(bucket_day, AuditAggregate.event_type, AuditAggregate.severity).all()
+        for row_day, event_type, severity, count, failures in rows:
+            add_count(counts, (_as_date(row_day), 'event_type', event_type), count, failures or 0)
+            if severity:
+                add_count(counts, (_as_date(row_day), 'severity', severity), count)
         
+        AuditDailyCounter.query.delete()
+        audit_writer.write_counts(db.session.connection(), counts)
         db.session.commit()
+        return len(counts)
+    
+    def rebuild_counters_if_empty(self):
+        """بناء العدادات مرة واحدة إذا وُجدت سجلات قبل إضافتها (عند بدء التشغيل)"""
+        if db.session.query(AuditDailyCounter.id).first() is not None:
+            return None
+        if db.session.query(AuditLog.id).first() is None and db.session.query(AuditAggregate.id).first() is None:
+            return None
+        return self.rebuild_counters()
+    
+    def cleanup_old_logs(self, days_to_keep=365, archive=None):
+        """تنظيف السجلات القديمة على دفعات ومقاطع الأرشيف البارد المنتهية (مع أرشفة الأحدث حسب الإعدادات)
+
+        يعيد عدد الصفوف المحذوفة، أو None إن كان تنظيف آخر جارياً.
+        """
+        state = audit_retention.run(days_to_keep, archive)
+        if state is None:
+            return None
         
-        current_app.logger.info(f"Cleaned up {deleted_count} old audit logs")
+        current_app.logger.info(f"Cleaned up {state['deleted']} old audit logs")
         
-        return deleted_count
-
+        return state['deleted']
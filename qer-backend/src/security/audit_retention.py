@@ -0,0 +1,263 @@
+"""
+محرك الاحتفاظ بسجلات المراجعة
+يطبق مدة الاحتفاظ فوق الأرشيف البارد (cold_archive): يحذف من الجداول الحية السجلات الأقدم
+من المدة على دفعات قصيرة (delete_in_chunks) تليها استراحة، فلا يطول قفل الكتابة في SQLite
+ولا تتعطل التوجيهات وتسجيلات الدخول، ثم ينقل اختيارياً ما تجاوز عمر الأرشفة إلى مقاطع
+الأرشيف، ويحذف المقاطع التي انتهت مدتها كلها. لا صيغة أرشيف ثانية: ما بين عمر الأرشفة
+والمدة يبقى مقروءاً من المقاطع. يُكتب التقدم في ملف حالة مشترك بين العمليات، ويمكن جدولته
+داخل العملية أو من cron:
+
+    python -m src.security.audit_retention --days 365
+"""
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from src.security.epoch import try_lock
+
+logger = logging.getLogger(__name__)
+
+
+class AuditRetention:
+    """حذف سجلات المراجعة القديمة على دفعات ومقاطع الأرشيف المنتهية"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self._thread = None
+        self._lock = threading.Lock()
+        self._scheduler_pid = None
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """تهيئة محرك الاحتفاظ مع التطبيق"""
+        self.app = app
+        app.config.setdefault('AUDIT_RETENTION_DAYS', 365)
+        app.config.setdefault('AUDIT_RETENTION_CHUNK_SIZE', 500)
+        app.config.setdefault('AUDIT_RETENTION_PAUSE', 0.1)  # ثوانٍ بين الدفعات
+        app.config.setdefault('AUDIT_RETENTION_ARCHIVE', True)  # نقل ما تجاوز عمر الأرشفة إلى الأرشيف البارد
+        app.config.setdefault('AUDIT_RETENTION_STATE_FILE', os.path.join(app.instance_path, 'audit_retention.json'))
+        app.config.setdefault('AUDIT_RETENTION_INTERVAL', 0)  # ثوانٍ بين التشغيلات المجدولة، 0 = بلا جدولة
+        app.extensions['audit_retention'] = self
+
+        # المقاطع المؤرشفة جزء من السجل الذي تسري عليه المدة
+        from src.analytics.cold_archive import cold_archive
+        if 'cold_archive' not in app.extensions:
+            cold_archive.init_app(app)
+
+    def _tables(self):
+        """الجداول المشمولة: (الجدول، عمود الوقت)"""
+        from src.security.audit_logger import AuditAggregate, AuditLog
+        return (
+            (AuditLog.__table__, AuditLog.__table__.c.timestamp),
+            (AuditAggregate.__table__, AuditAggregate.__table__.c.bucket)
+        )
+
+    # ==================== التشغيل ====================
+
+    def run(self, days_to_keep=None, archive=None, progress=None):
+        """تشغيل واحد: حذف ما قبل مدة الاحتفاظ دفعةً دفعة ثم المقاطع المنتهية
+
+        يعيد تقرير التشغيل، أو None إن كان تشغيل آخر جارياً (في أي عملية).
+        archive: أرشفة ما تجاوز AUDIT_ARCHIVE_AFTER_DAYS في مقاطع الأرشيف البارد بعد الحذف.
+        progress: دالة اختيارية تُستدعى بحالة التقدم بعد كل دفعة.
+        """
+        from src.analytics.cold_archive import cold_archive
+
+        config = self.app.config
+        days_to_keep = days_to_keep or config['AUDIT_RETENTION_DAYS']
+        archive = config['AUDIT_RETENTION_ARCHIVE'] if archive is None else archive
+        cutoff = datetime.utcnow() - timedelta(days=days_to_keep)
+
+        lock = try_lock(f"{self.app.config['AUDIT_RETENTION_STATE_FILE']}.lock")
+        if lock is None:
+            return None
+        try:
+            state = {
+                'status': 'running',
+                'days_to_keep': days_to_keep,
+                'cutoff': cutoff.isoformat(),
+                'started_at': datetime.utcnow().isoformat(),
+                'finished_at': None,
+                'deleted': 0,
+                'chunks': 0,
+                'archived_segments': [],
+                'purged_segments': [],
+                'tables': {}
+            }
+            self._save_state(state)
+            try:
+                # الحذف قبل الأرشفة حتى لا يُكتب في المقاطع ما سيُحذف منها فوراً
+                for table, column in self._tables():
+                    self._purge(cold_archive, table, column, cutoff, state, progress)
+                self._purge_counters(cutoff)
+                if archive:
+                    state['archived_segments'] = self._archive(cold_archive)
+                state['purged_segments'] = [
+                    segment['path'] for segment in cold_archive.purge('audit_logs', cutoff)
+                ]
+            except Exception as e:
+                state.update(status='failed', error=str(e), finished_at=datetime.utcnow().isoformat())
+                self._save_state(state)
+                raise
+
+            state.update(status='finished', finished_at=datetime.utcnow().isoformat())
+            self._save_state(state)
+            logger.info('audit retention: %d rows deleted in %d chunks, %d segments purged',
+                        state['deleted'], state['chunks'], len(state['purged_segments']))
+            return state
+        finally:
+            lock.close()
+
+    def _purge(self, cold_archive, table, column, cutoff, state, progress):
+        """حذف صفوف جدول واحد: معرّفات دفعة بعد آخر معرّف ثم حذفها بدفعات الأرشيف القصيرة"""
+        from src.models.user import db
+
+        config = self.app.config
+        deleted = 0
+        last_id = 0
+        while True:
+            ids = db.session.execute(
+                select(table.c.id).where(table.c.id > last_id, column < cutoff)
+                .order_by(table.c.id).limit(config['AUDIT_RETENTION_CHUNK_SIZE'])
+            ).scalars().all()
+            db.session.commit()  # إنهاء معاملة القراءة قبل الاستراحة
+            if not ids:
+                break
+            cold_archive.delete_in_chunks(table, ids)
+            last_id = ids[-1]
+
+            deleted += len(ids)
+            state['deleted'] += len(ids)
+            state['chunks'] += 1
+            state['tables'][table.name] = deleted
+            self._save_state(state)
+            if progress:
+                progress(state)
+            time.sleep(config['AUDIT_RETENTION_PAUSE'])
+
+    def _purge_counters(self, cutoff):
+        """العدادات اليومية صغيرة (صف لكل يوم وقيمة)، فتُحذف بعبارة واحدة"""
+        from src.models.user import db
+        from src.security.audit_logger import AuditDailyCounter
+        table = AuditDailyCounter.__table__
+        db.session.execute(table.delete().where(table.c.day < cutoff.date()))
+        db.session.commit()
+
+    @staticmethod
+    def _archive(cold_archive):
+        """أرشفة سجلات المراجعة تحت قفل الأرشيف (يتخطاها إن كان عامل آخر يؤرشف الآن)"""
+        lock = cold_archive.acquire()
+        if lock is None:
+            return []
+        try:
+            return cold_archive.archive_audit_logs()
+        finally:
+            lock.close()
+
+    # ==================== الحالة ====================
+
+    def _save_state(self, state):
+        path = self.app.config['AUDIT_RETENTION_STATE_FILE']
+        directory = os.path.dirname(path) or '.'
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.audit_retention.')
+        with os.fdopen(fd, 'w', encoding='utf-8') as handle:
+            json.dump(state, handle, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def status(self):
+        """آخر حالة مسجلة (التشغيل الجاري أو الأخير) من أي عملية"""
+        try:
+            with open(self.app.config['AUDIT_RETENTION_STATE_FILE'], encoding='utf-8') as handle:
+                return json.load(handle)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    # ==================== الجدولة ====================
+
+    def start(self, days_to_keep=None, archive=None):
+        """تشغيل في خيط خلفي (لنقاط النهاية)، وإرجاع False إن كان تشغيل آخر جارياً"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._thread = threading.Thread(
+                target=self._run_in_context, args=(days_to_keep, archive),
+                name='audit-retention', daemon=True
+            )
+            self._thread.start()
+        return True
+
+    def _run_in_context(self, days_to_keep=None, archive=None):
+        with self.app.app_context():
+            try:
+                self.run(days_to_keep, archive)
+            except Exception:
+                logger.exception('audit retention run failed')
+
+    def start_scheduler(self):
+        """تشغيل دوري كل AUDIT_RETENTION_INTERVAL ثانية في كل عملية تخدم الطلبات، والقفل يمنع التكرار بينها
+
+        يبدأ الخيط عند أول طلب في العملية (عامل gunicorn بعد التفرع)، فلا يبدأ في العملية الأم
+        مع --preload ولا في العمليات الفرعية الأخرى مثل مجمع التشفير.
+        """
+        if not self.app.config['AUDIT_RETENTION_INTERVAL']:
+            return
+        self.app.before_request(self._ensure_scheduler)
+
+    def _ensure_scheduler(self):
+        if self._scheduler_pid == os.getpid():
+            return
+        with self._lock:
+            if self._scheduler_pid == os.getpid():
+                return
+            self._scheduler_pid = os.getpid()
+            interval = self.app.config['AUDIT_RETENTION_INTERVAL']
+            threading.Thread(
+                target=self._schedule, args=(interval,), name='audit-retention-scheduler', daemon=True
+            ).start()
+
+    def _schedule(self, interval):
+        while True:
+            time.sleep(interval)
+            state = self.status()
+            if state and state.get('finished_at'):
+                # عامل آخر أنهى تشغيلاً خلال الفترة
+                if datetime.utcnow() - datetime.fromisoformat(state['finished_at']) < timedelta(seconds=interval):
+                    continue
+            self._run_in_context()
+
+
+audit_retention = AuditRetention()
+
+
+def main():
+    from src.main_enhanced import create_app
+
+    parser = argparse.ArgumentParser(description='حذف سجلات المراجعة القديمة على دفعات ومقاطع الأرشيف المنتهية')
+    parser.add_argument('--days', type=int, default=None, help='مدة الاحتفاظ بالأيام')
+    parser.add_argument('--no-archive', action='store_true', help='الحذف دون نقل السجلات إلى الأرشيف البارد')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        state = audit_retention.run(
+            args.days, archive=False if args.no_archive else None,
+            progress=lambda state: print(f"{state['deleted']} سجل محذوف ({state['chunks']} دفعة)")
+        )
+    if state is None:
+        print('تشغيل آخر جارٍ')
+    else:
+        print(f"انتهى: {state['deleted']} سجل محذوف")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""
+البحث النصي في سجلات المراجعة
+فهرس SQLite FTS5 بمحتوى خارجي (content='audit_logs') على اسم المستخدم ورسالة الخطأ
+والقيم القديمة والجديدة والبيانات الإضافية، تُحدّثه محفزات الإدراج والحذف داخل نفس
+معاملة الكاتب الخلفي ومحرك الاحتفاظ والأرشيف البارد، فلا يُخزَّن النص مرتين ولا يتأخر
+عن السجل. البحث يطابق في الفهرس ويرتب بـ bm25 ثم يطبق مرشحات السجل المعتادة،
+والسجلات المنقولة إلى الأرشيف البارد خارج الفهرس
+"""
+
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from src.models.fts import SearchQueryError, parse_query, to_match
+from src.models.user import db
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'audit_logs_fts'
+
+# الأعمدة المفهرسة بترتيبها في الجدول الافتراضي
+FTS_COLUMNS = ('username', 'error_message', 'old_values', 'new_values', 'additional_data')
+
+# أسماء الحقول المقبولة في الاستعلام (field:term)
+FIELD_ALIASES = {
+    'user': 'username',
+    'username': 'username',
+    'error': 'error_message',
+    'error_message': 'error_message',
+    'old': 'old_values',
+    'old_values': 'old_values',
+    'new': 'new_values',
+    'new_values': 'new_values',
+    'data': 'additional_data',
+    'additional_data': 'additional_data'
+}
+
+# مرشحات السجل: اسم المرشح ← (العمود، المقارنة)
+FILTERS = {
+    'event_type': ('event_type', '='),
+    'user_id': ('user_id', '='),
+    'severity': ('severity', '='),
+    'ip_address': ('ip_address', '='),
+    'resource_type': ('resource_type', '='),
+    'success': ('success', '='),
+    'start_date': ('timestamp', '>='),
+    'end_date': ('timestamp', '<=')
+}
+
+class AuditSearchIndex:
+    """فهرس FTS5 لسجلات المراجعة والبحث فيه"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self.available = False
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """تهيئة فهرس البحث مع التطبيق"""
+        self.app = app
+        app.extensions['audit_search'] = self
+
+    # ==================== المخطط ====================
+
+    def ensure_schema(self):
+        """إنشاء الجدول الافتراضي والمحفزات، وبناء الفهرس للسجلات الموجودة عند إنشائه أول مرة"""
+        engine = db.engine
+        if engine.dialect.name != 'sqlite':
+            self.available = False
+            return False
+
+        columns = ', '.join(FTS_COLUMNS)
+        new_values = ', '.join(f'new.{column}' for column in FTS_COLUMNS)
+        old_values = ', '.join(f'old.{column}' for column in FTS_COLUMNS)
+        try:
+            with engine.begin() as conn:
+                exists = conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+                ), {'name': FTS_TABLE}).first()
+                conn.execute(text(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                    f"{columns}, content='audit_logs', content_rowid='id', "
+                    f"tokenize='unicode61 remove_diacritics 2')"
+                ))
+                conn.execute(text(
+                    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON audit_logs BEGIN '
+                    f'INSERT INTO {FTS_TABLE} (rowid, {columns}) VALUES (new.id, {new_values}); END'
+                ))
+                conn.execute(text(
+                    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON audit_logs BEGIN '
+                    f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END"
+                ))
+                conn.execute(text(
+                    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE ON audit_logs BEGIN '
+                    f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+                    f'INSERT INTO {FTS_TABLE} (rowid, {columns}) VALUES (new.id, {new_values}); END'
+                ))
+                if not exists:
+                    conn.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')"))
+        except OperationalError as e:
+            # SQLite مبني دون FTS5: البحث يعود إلى المسح بـ LIKE
+            logger.warning('audit full-text index unavailable: %s', e)
+            self.available = False
+            return False
+
+        self.available = True
+        return True
+
+    def rebuild(self):
+        """إعادة بناء الفهرس من audit_logs"""
+        with db.engine.begin() as conn:
+            conn.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')"))
+
+    # ==================== البحث ====================
+
+    def search(self, query, filters=None, page=1, per_page=50):
+        """البحث مرتباً حسب الصلة مع مرشحات السجل
+
+        يعيد {'logs': [...], 'page', 'per_page', 'has_next'}، ولكل سجل rank و snippet.
+        """
+        from src.security.audit_logger import AuditLog
+
+        terms = parse_query(query, FIELD_ALIASES)
+        conditions, params = self._conditions(filters or {})
+        params.update(limit=per_page + 1, offset=(page - 1) * per_page)
+
+        if self.available:
+            params['match'] = to_match(terms)
+            sql = (
+                f'SELECT a.id, bm25({FTS_TABLE}) AS rank, '
+                f"snippet({FTS_TABLE}, -1, '[', ']', '…', 12) AS snippet "
+                f'FROM {FTS_TABLE} JOIN audit_logs a ON a.id = {FTS_TABLE}.rowid '
+                f'WHERE {FTS_TABLE} MATCH :match'
+                + ''.join(f' AND {condition}' for condition in conditions)
+                + ' ORDER BY rank, a.id DESC LIMIT :limit OFFSET :offset'
+            )
+            try:
+                rows = db.session.execute(text(sql), params).fetchall()
+            except OperationalError as e:
+                raise SearchQueryError(f'استعلام بحث غير صالح: {e.orig}')
+        else:
+            rows = self._like_search(terms, conditions, params)
+
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+        logs = {log.id: log for log in AuditLog.query.filter(AuditLog.id.in_([row.id for row in rows]))}
+
+        results = []
+        for row in rows:
+            log = logs.get(row.id)
+            if log is None:
+                continue
+            item = log.to_dict()
+            item['rank'] = row.rank
+            item['snippet'] = row.snippet
+            results.append(item)
+
+        return {'logs': results, 'page': page, 'per_page': per_page, 'has_next': has_next}
+
+    @staticmethod
+    def _conditions(filters):
+        conditions, params = [], {}
+        for name, (column, operator) in FILTERS.items():
+            value = filters.get(name)
+            if value is None or value == '':
+                continue
+            conditions.append(f'a.{column} {operator} :{name}')
+            params[name] = value
+        return conditions, params
+
+    def _like_search(self, terms, conditions, params):
+        """بلا FTS5: كل شرط LIKE على الأعمدة المفهرسة (مسح كامل، بلا ترتيب صلة)"""
+        groups = [[]]
+        for index, term in enumerate(terms):
+            if term == 'OR':
+                groups.append([])
+                continue
+            column, value, _ = term
+            params[f'term_{index}'] = f'%{value}%'
+            columns = (column,) if column else FTS_COLUMNS
+            groups[-1].append('(' + ' OR '.join(f'a.{name} LIKE :term_{index}' for name in columns) + ')')
+        clauses = ['(' + ' AND '.join(group) + ')' for group in groups if group]
+        sql = (
+            "SELECT a.id, 0 AS rank, NULL AS snippet FROM audit_logs a WHERE (" + ' OR '.join(clauses) + ')'
+            + ''.join(f' AND {condition}' for condition in conditions)
+            + ' ORDER BY a.timestamp DESC, a.id DESC LIMIT :limit OFFSET :offset'
+        )
+        return db.session.execute(text(sql), params).fetchall()
+
+
+audit_search = AuditSearchIndex()
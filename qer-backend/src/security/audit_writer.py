@@ -0,0 +1,436 @@
+"""
+كاتب سجلات المراجعة المؤجل
+تُلتقط الأحداث كصفوف بسيطة (tuple) في طابور، ويكتبها خيط خلفي دفعات بإدراج مجمّع
+عبر اتصال ومعاملة خاصين به، فلا يُنفذ الطلب commit ولا يُحفظ معه أي تعديل معلّق لا يخصه.
+الأحداث الحرجة تُكتب فوراً قبل عودة الطلب، ويُفرغ الطابور عند إيقاف العملية، وإذا تعذرت
+الكتابة في القاعدة تُلحق الأحداث بملف محلي (NDJSON) يُعاد إدراجه لاحقاً.
+الأحداث كثيرة التكرار تُجمَّع في الذاكرة صفاً لكل (نوع، مورد، دقيقة) بعدد وعينات محدودة،
+وتُدمج في audit_aggregates بـ upsert مع كل نافذة كتابة.
+مع كل دفعة تُحدَّث عدادات يومية (نوع الحدث، الخطورة، المستخدم، IP) في نفس المعاملة،
+فتُقرأ الإحصائيات منها بزمن لا يتعلق بحجم السجل
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# ترتيب حقول الحدث (أعمدة audit_logs عدا id)
+COLUMNS = (
+    'timestamp', 'event_type', 'severity', 'user_id', 'username', 'ip_address', 'user_agent',
+    'endpoint', 'method', 'resource_type', 'resource_id', 'old_values', 'new_values',
+    'additional_data', 'success', 'error_message', 'session_id'
+)
+_INDEX = {column: index for index, column in enumerate(COLUMNS)}
+
+# حقول الحدث المحفوظة في عينات الصف المجمّع
+SAMPLE_FIELDS = ('timestamp', 'user_id', 'username', 'ip_address', 'user_agent', 'endpoint', 'success', 'additional_data')
+
+# أبعاد العدادات اليومية (أعمدة الحدث)، وتُحتسب فيها الأحداث المجمّعة أيضاً حدثاً حدثاً
+COUNTER_DIMENSIONS = ('event_type', 'severity', 'username', 'ip_address')
+
+# إشارة للخيط: بدأت نافذة تجميع جديدة
+_AGGREGATES = object()
+
+# مواضع الحقول في حالة الصف المجمّع
+_RESOURCE_TYPE, _COUNT, _FAILURES, _FIRST_SEEN, _LAST_SEEN, _SAMPLES, _SEVERITIES = range(7)
+
+
+def count_events(events, counts=None):
+    """عدادات الأحداث: (اليوم، البعد، القيمة) ← [العدد، الفاشلة]"""
+    counts = {} if counts is None else counts
+    timestamp_index, success_index = _INDEX['timestamp'], _INDEX['success']
+    indexes = [(dimension, _INDEX[dimension]) for dimension in COUNTER_DIMENSIONS]
+    for event in events:
+        day = event[timestamp_index].date()
+        failed = 0 if event[success_index] else 1
+        for dimension, index in indexes:
+            value = event[index]
+            if value is None:
+                continue
+            slot = counts.get((day, dimension, value))
+            if slot is None:
+                counts[(day, dimension, value)] = [1, failed]
+            else:
+                slot[0] += 1
+                slot[1] += failed
+    return counts
+
+
+def add_count(counts, key, count, failures=0):
+    slot = counts.get(key)
+    if slot is None:
+        counts[key] = [count, failures]
+    else:
+        slot[0] += count
+        slot[1] += failures
+
+
+class AuditWriter:
+    """طابور أحداث المراجعة وخيط كتابتها"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self._engine = None
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._last_replay = 0.0
+        self._aggregates = {}  # (النوع، المورد، الدقيقة) ← [نوع المورد، العدد، الفاشلة، الأول، الأخير، العينات، الخطورة]
+        self._aggregate_counts = {}  # عدادات الأحداث المجمّعة اليومية بكل الأبعاد حتى دمجها
+        self._aggregates_pid = None
+        self._aggregate_lock = threading.Lock()
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """تهيئة الكاتب مع التطبيق"""
+        self.app = app
+        app.config.setdefault('AUDIT_ASYNC', True)  # False = كتابة كل حدث فوراً (الاختبارات)
+        app.config.setdefault('AUDIT_BATCH_SIZE', 200)
+        app.config.setdefault('AUDIT_FLUSH_INTERVAL', 1.0)  # ثوانٍ بين دفعات الكتابة
+        app.config.setdefault('AUDIT_QUEUE_SIZE', 10000)
+        app.config.setdefault('AUDIT_SYNC_SEVERITIES', ('critical',))
+        app.config.setdefault('AUDIT_FALLBACK_FILE', os.path.join(app.instance_path, 'audit_fallback.ndjson'))
+        app.config.setdefault('AUDIT_REPLAY_INTERVAL', 60)  # ثوانٍ بين محاولات إعادة إدراج الملف الاحتياطي
+        app.config.setdefault('AUDIT_AGGREGATE_SAMPLES', 5)  # عينات محفوظة لكل صف مجمّع
+        app.extensions['audit_writer'] = self
+        atexit.register(self.shutdown)
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            from src.models.user import db
+            with self.app.app_context():
+                self._engine = db.engine
+        return self._engine
+
+    @property
+    def table(self):
+        from src.security.audit_logger import AuditLog
+        return AuditLog.__table__
+
+    @property
+    def aggregate_table(self):
+        from src.security.audit_logger import AuditAggregate
+        return AuditAggregate.__table__
+
+    @property
+    def counter_table(self):
+        from src.security.audit_logger import AuditDailyCounter
+        return AuditDailyCounter.__table__
+
+    def _insert(self, table):
+        if self.engine.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        return insert(table)
+
+    def write_counts(self, connection, counts):
+        """إضافة العدادات إلى audit_daily_counters (upsert يجمع مع القيم الموجودة)"""
+        if not counts:
+            return
+        table = self.counter_table
+        stmt = self._insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['day', 'dimension', 'value'],
+            set_={
+                'count': table.c.count + stmt.excluded.count,
+                'failures': table.c.failures + stmt.excluded.failures
+            }
+        )
+        connection.execute(stmt, [
+            {'day': day, 'dimension': dimension, 'value': value, 'count': count, 'failures': failures}
+            for (day, dimension, value), (count, failures) in counts.items()
+        ])
+
+    # ==================== الإضافة ====================
+
+    def submit(self, event, sync=False):
+        """إضافة حدث (tuple بترتيب COLUMNS)، وكتابته فوراً إن كان sync"""
+        config = self.app.config
+        if sync or not config['AUDIT_ASYNC'] or event[2] in config['AUDIT_SYNC_SEVERITIES']:
+            self._write([event])
+            return
+
+        try:
+            self._ensure_thread().put_nowait(event)
+        except queue.Full:
+            # لا نعطل الطلبات إذا تأخر الكاتب: الملف الاحتياطي يُدرج لاحقاً
+            self._append_fallback([event])
+
+    def aggregate(self, event):
+        """احتساب حدث في صف (النوع، المورد، الدقيقة) مع عينة عشوائية محدودة (reservoir)"""
+        timestamp = event[_INDEX['timestamp']]
+        key = (
+            event[_INDEX['event_type']],
+            event[_INDEX['resource_id']] or '',
+            timestamp.replace(second=0, microsecond=0)
+        )
+        limit = self.app.config['AUDIT_AGGREGATE_SAMPLES']
+        with self._aggregate_lock:
+            if self._aggregates_pid != os.getpid():
+                # لا يكتب العامل ما جمعته العملية الأم قبل التفرع
+                self._aggregates, self._aggregate_counts, self._aggregates_pid = {}, {}, os.getpid()
+            started = not self._aggregates
+            # المستخدم و IP لا يُحفظان في الصف المجمّع، فيُحتسبان هنا لأكثر المستخدمين والعناوين
+            count_events((event,), self._aggregate_counts)
+            slot = self._aggregates.get(key)
+            if slot is None:
+                slot = [event[_INDEX['resource_type']], 0, 0, timestamp, timestamp, [], {}]
+                self._aggregates[key] = slot
+            slot[_COUNT] += 1
+            severity = event[_INDEX['severity']]
+            slot[_SEVERITIES][severity] = slot[_SEVERITIES].get(severity, 0) + 1
+            if not event[_INDEX['success']]:
+                slot[_FAILURES] += 1
+            slot[_LAST_SEEN] = timestamp
+            samples = slot[_SAMPLES]
+            if len(samples) < limit:
+                samples.append(event)
+            else:
+                position = random.randrange(slot[_COUNT])
+                if position < limit:
+                    samples[position] = event
+
+        if not self.app.config['AUDIT_ASYNC']:
+            self._write_aggregates()
+        elif started:
+            try:
+                self._ensure_thread().put_nowait(_AGGREGATES)
+            except queue.Full:
+                self._write_aggregates()
+
+    def _ensure_thread(self):
+        """الطابور والخيط الخاصان بالعملية الحالية (يُنشآن بعد تفرع gunicorn)"""
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            with self._lock:
+                if self._pid != os.getpid() or not self._thread.is_alive():
+                    if self._pid != os.getpid():
+                        self._queue = queue.Queue(self.app.config['AUDIT_QUEUE_SIZE'])
+                        self._engine = None  # لا يُشارك مجمع الاتصالات بين العمليات
+                    self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                    self._pid = os.getpid()
+                    self._thread.start()
+        return self._queue
+
+    # ==================== الكتابة ====================
+
+    def _run(self):
+        config = self.app.config
+        batch = []
+        markers = []
+        deadline = None
+        aggregate_deadline = None
+        while True:
+            # بلا دفعة أو تجميع معلّق ينتظر الخيط بلا مهلة، ومعهما حتى أقرب موعد كتابة
+            deadlines = [value for value in (batch and deadline, aggregate_deadline) if value]
+            timeout = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, threading.Event):
+                markers.append(item)
+            elif item is _AGGREGATES:
+                if aggregate_deadline is None:
+                    aggregate_deadline = time.monotonic() + config['AUDIT_FLUSH_INTERVAL']
+            elif item is not None:
+                if not batch:
+                    deadline = time.monotonic() + config['AUDIT_FLUSH_INTERVAL']
+                batch.append(item)
+
+            if batch and (markers or len(batch) >= config['AUDIT_BATCH_SIZE'] or time.monotonic() >= deadline):
+                self._write(batch)
+                batch = []
+            if markers or (aggregate_deadline and time.monotonic() >= aggregate_deadline):
+                # عند الفشل تعود الصفوف إلى الذاكرة وتُعاد المحاولة في النافذة التالية
+                written = self._write_aggregates()
+                aggregate_deadline = None if written else time.monotonic() + config['AUDIT_FLUSH_INTERVAL']
+            if markers and not batch:
+                for marker in markers:
+                    marker.set()
+                markers = []
+
+    def _write(self, events):
+        """إدراج مجمّع في معاملة مستقلة، أو الملف الاحتياطي عند الفشل"""
+        rows = [dict(zip(COLUMNS, event)) for event in events]
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(self.table.insert(), rows)
+                self.write_counts(connection, count_events(events))
+        except Exception as e:
+            logger.error('audit write failed, %d events kept in fallback file: %s', len(events), e)
+            self._append_fallback(events)
+            return
+
+        if time.monotonic() - self._last_replay >= self.app.config['AUDIT_REPLAY_INTERVAL']:
+            self._last_replay = time.monotonic()
+            if os.path.exists(self.app.config['AUDIT_FALLBACK_FILE']):
+                self.replay_fallback()
+
+    def _aggregate_rows(self, pending):
+        rows = []
+        for (event_type, resource_id, bucket), slot in pending.items():
+            samples = [
+                {field: event[_INDEX[field]] for field in SAMPLE_FIELDS}
+                for event in sorted(slot[_SAMPLES], key=lambda event: event[_INDEX['timestamp']])
+            ]
+            for sample in samples:
+                if sample['additional_data']:
+                    sample['additional_data'] = json.loads(sample['additional_data'])
+            rows.append({
+                'event_type': event_type,
+                'resource_type': slot[_RESOURCE_TYPE],
+                'resource_id': resource_id,
+                'severity': max(slot[_SEVERITIES], key=slot[_SEVERITIES].get),
+                'bucket': bucket,
+                'count': slot[_COUNT],
+                'failures': slot[_FAILURES],
+                'first_seen': slot[_FIRST_SEEN],
+                'last_seen': slot[_LAST_SEEN],
+                'samples': json.dumps(samples, ensure_ascii=False, default=str)
+            })
+        return rows
+
+    def _write_aggregates(self):
+        """دمج الصفوف المجمّعة في audit_aggregates: جمع الأعداد، والعينات من أول نافذة للدقيقة"""
+        with self._aggregate_lock:
+            if self._aggregates_pid != os.getpid() or not self._aggregates:
+                return True
+            pending, self._aggregates = self._aggregates, {}
+            counts, self._aggregate_counts = self._aggregate_counts, {}
+
+        table = self.aggregate_table
+        try:
+            stmt = self._insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['event_type', 'resource_id', 'bucket'],
+                set_={
+                    'count': table.c.count + stmt.excluded.count,
+                    'failures': table.c.failures + stmt.excluded.failures,
+                    'last_seen': stmt.excluded.last_seen
+                }
+            )
+            with self.engine.begin() as connection:
+                connection.execute(stmt, self._aggregate_rows(pending))
+                self.write_counts(connection, counts)
+        except Exception as e:
+            logger.error('audit aggregate write failed, %d rows kept in memory: %s', len(pending), e)
+            self._restore_aggregates(pending, counts)
+            return False
+        return True
+
+    def _restore_aggregates(self, pending, counts):
+        with self._aggregate_lock:
+            for key, (count, failures) in counts.items():
+                add_count(self._aggregate_counts, key, count, failures)
+            for key, slot in pending.items():
+                current = self._aggregates.get(key)
+                if current is None:
+                    self._aggregates[key] = slot
+                    continue
+                current[_COUNT] += slot[_COUNT]
+                current[_FAILURES] += slot[_FAILURES]
+                for severity, count in slot[_SEVERITIES].items():
+                    current[_SEVERITIES][severity] = current[_SEVERITIES].get(severity, 0) + count
+                current[_FIRST_SEEN] = slot[_FIRST_SEEN]
+                current[_SAMPLES] = slot[_SAMPLES]
+
+    def _append_fallback(self, events):
+        path = self.app.config['AUDIT_FALLBACK_FILE']
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        lines = ''.join(
+            json.dumps(dict(zip(COLUMNS, event)), ensure_ascii=False, default=str) + '\n'
+            for event in events
+        )
+        with self._file_lock:
+            with open(path, 'a', encoding='utf-8') as handle:
+                handle.write(lines)
+                handle.flush()
+                os.fsync(handle.fileno())
+
+    def replay_fallback(self):
+        """إدراج أحداث الملف الاحتياطي في القاعدة وحذفه (عند بدء التشغيل وبعد عودة القاعدة)"""
+        path = self.app.config['AUDIT_FALLBACK_FILE']
+        replaying = f'{path}.{os.getpid()}.replay'
+        with self._file_lock:
+            try:
+                os.replace(path, replaying)
+            except FileNotFoundError:
+                return 0
+
+        with open(replaying, encoding='utf-8') as handle:
+            rows = [json.loads(line) for line in handle if line.strip()]
+        for row in rows:
+            row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+        try:
+            with self.engine.begin() as connection:
+                for start in range(0, len(rows), self.app.config['AUDIT_BATCH_SIZE']):
+                    connection.execute(self.table.insert(), rows[start:start + self.app.config['AUDIT_BATCH_SIZE']])
+                self.write_counts(connection, count_events(tuple(row[column] for column in COLUMNS) for row in rows))
+        except Exception as e:
+            # إعادة الأحداث إلى الملف الاحتياطي كما هي
+            logger.error('audit fallback replay failed: %s', e)
+            self._append_fallback([tuple(row[column] for column in COLUMNS) for row in rows])
+            os.remove(replaying)
+            return 0
+
+        os.remove(replaying)
+        logger.info('audit fallback replayed: %d events', len(rows))
+        return len(rows)
+
+    # ==================== التفريغ ====================
+
+    def flush(self, timeout=5.0):
+        """انتظار كتابة كل ما في الطابور حتى الآن"""
+        if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+            return self._drain()
+        marker = threading.Event()
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.wait(timeout)
+
+    def _drain(self):
+        """كتابة ما تبقى في الطابور والتجميع من خيط المستدعي (لا يوجد كاتب حي)"""
+        if self._queue is None or self._pid != os.getpid():
+            return self._write_aggregates()
+        events = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is not _AGGREGATES:
+                events.append(item)
+        if events:
+            self._write(events)
+        return self._write_aggregates()
+
+    def shutdown(self):
+        """تفريغ مضمون عند إيقاف العملية (atexit)"""
+        if self.app is None or (self._queue is None and not self._aggregates):
+            return
+        if not self.flush(timeout=10.0):
+            self._drain()
+
+
+audit_writer = AuditWriter()
@@ -0,0 +1,244 @@
+"""
+فحص كلمات المرور المسربة دون اتصال بالشبكة
+تُحوَّل قائمة كلمات المرور المسربة (نص عادي أو صيغة SHA1:العدد) مرة واحدة إلى ملف ثنائي
+مرتب من بصمات SHA-1 مقتطعة إلى 8 بايت، يفتحه كل عمال gunicorn بـ mmap للقراءة فقط
+فيتشاركون نسخة واحدة في ذاكرة النظام، ويكون الفحص بحثاً ثنائياً (~24 خطوة لعشرة ملايين
+بصمة) بأقل من ملي ثانية. احتمال التطابق الكاذب مع 64 بت لا يُذكر.
+الترجمة عند التشغيل يتولاها عامل واحد تحت قفل ملف، والملف الفارغ أو المقطوع يُتجاهل
+(لا شيء معروف) بدل أن يُسقط التسجيل وتغيير كلمة المرور
+
+    python -m src.security.breached_passwords pwned-passwords-sha1.txt -o instance/breached_passwords.bin
+"""
+
+import argparse
+import hashlib
+import heapq
+import logging
+import mmap
+import os
+import re
+import struct
+import tempfile
+import time
+from threading import Lock
+
+from src.security.epoch import try_lock
+
+logger = logging.getLogger(__name__)
+
+HASH_BYTES = 8
+
+# رأس الملف: التوقيع، الإصدار، طول البصمة، عدد البصمات
+_HEADER = struct.Struct('<4sHHQ')
+_MAGIC = b'RFBP'
+_VERSION = 1
+
+_SHA1_LINE = re.compile(rb'^([0-9A-Fa-f]{40})(?::\d+)?$')
+
+
+def fingerprint(password):
+    """بصمة كلمة المرور كما تُخزن في الملف"""
+    return hashlib.sha1(password.encode('utf-8')).digest()[:HASH_BYTES]
+
+
+def _corpus_fingerprints(path, fmt='auto'):
+    """بصمات أسطر القائمة: sha1 = بصمات سداسية (مع :العدد اختيارياً)، plain = كلمات مرور"""
+    with open(path, 'rb') as handle:
+        for line in handle:
+            line = line.rstrip(b'\r\n')
+            if not line:
+                continue
+            if fmt != 'plain':
+                match = _SHA1_LINE.match(line)
+                if match:
+                    yield bytes.fromhex(match.group(1)[:HASH_BYTES * 2].decode('ascii'))
+                    continue
+                if fmt == 'sha1':
+                    continue
+            yield hashlib.sha1(line).digest()[:HASH_BYTES]
+
+
+def _write_run(values, directory, number):
+    values.sort()
+    path = os.path.join(directory, f'run-{number}.bin')
+    with open(path, 'wb') as handle:
+        handle.write(b''.join(values))
+    return path
+
+
+def _read_run(path, block=HASH_BYTES * 8192):
+    with open(path, 'rb') as handle:
+        while True:
+            data = handle.read(block)
+            if not data:
+                return
+            for offset in range(0, len(data), HASH_BYTES):
+                yield data[offset:offset + HASH_BYTES]
+
+
+def compile_corpus(source, target, fmt='auto', chunk_size=1000000):
+    """ترجمة القائمة إلى ملف البصمات المرتب (فرز خارجي على دفعات فالذاكرة محدودة)"""
+    started = time.perf_counter()
+    directory = os.path.dirname(os.path.abspath(target))
+    os.makedirs(directory, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(dir=directory) as work:
+        runs = []
+        chunk = []
+        for value in _corpus_fingerprints(source, fmt):
+            chunk.append(value)
+            if len(chunk) >= chunk_size:
+                runs.append(_write_run(chunk, work, len(runs)))
+                chunk = []
+        if chunk:
+            runs.append(_write_run(chunk, work, len(runs)))
+
+        temp_path = f'{target}.{os.getpid()}.tmp'
+        count = 0
+        with open(temp_path, 'wb') as out:
+            out.write(_HEADER.pack(_MAGIC, _VERSION, HASH_BYTES, 0))
+            previous = None
+            for value in heapq.merge(*(_read_run(path) for path in runs)):
+                if value != previous:
+                    out.write(value)
+                    count += 1
+                    previous = value
+            out.seek(0)
+            out.write(_HEADER.pack(_MAGIC, _VERSION, HASH_BYTES, count))
+        os.replace(temp_path, target)
+
+    logger.info('breached password corpus compiled: %d hashes in %.1f s', count, time.perf_counter() - started)
+    return count
+
+
+class BreachedPasswordScreen:
+    """البحث في ملف البصمات المرتب عبر mmap"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self._mmap = None
+        self._count = 0
+        self._stamp = None
+        self._lock = Lock()
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """تهيئة الفاحص مع التطبيق"""
+        self.app = app
+        app.config.setdefault('BREACHED_PASSWORDS_FILE', os.path.join(app.instance_path, 'breached_passwords.bin'))
+        app.config.setdefault('BREACHED_PASSWORDS_SOURCE', None)  # القائمة الأصلية، تُترجم عند التشغيل إن تغيرت
+        app.extensions['breached_passwords'] = self
+
+    @property
+    def path(self):
+        return self.app.config['BREACHED_PASSWORDS_FILE']
+
+    def _stale(self, source):
+        """الملف المترجم أقدم من القائمة أو مفقود أو مقطوع"""
+        try:
+            with open(self.path, 'rb') as handle:
+                header = handle.read(_HEADER.size)
+                size = os.fstat(handle.fileno()).st_size
+                mtime = os.fstat(handle.fileno()).st_mtime_ns
+        except FileNotFoundError:
+            return True
+        if len(header) < _HEADER.size or size < _HEADER.size + _HEADER.unpack(header)[3] * HASH_BYTES:
+            return True
+        return mtime < os.stat(source).st_mtime_ns
+
+    def compile_if_stale(self):
+        """ترجمة القائمة الأصلية إذا كانت أحدث من الملف المترجم (عند بدء التشغيل)
+
+        يترجم العامل الذي يحصل على القفل فقط، والبقية تلتقط الملف الجديد عند استبداله.
+        """
+        source = self.app.config['BREACHED_PASSWORDS_SOURCE']
+        if not source or not os.path.exists(source) or not self._stale(source):
+            return None
+        lock = try_lock(f'{self.path}.lock')
+        if lock is None:
+            return None
+        try:
+            # ربما أنهى عامل آخر الترجمة قبل أن نحصل على القفل
+            if not self._stale(source):
+                return None
+            return compile_corpus(source, self.path)
+        finally:
+            lock.close()
+
+    def _sync(self):
+        """فتح الملف من جديد إذا استُبدل"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self._mmap, self._count, self._stamp = None, 0, None
+            return
+        stamp = (stat.st_ino, stat.st_mtime_ns)
+        if stamp == self._stamp:
+            return
+
+        with self._lock:
+            if stamp == self._stamp:
+                return
+            if stat.st_size < _HEADER.size:
+                # ملف فارغ أو مقطوع (mmap يرفض الملف الفارغ): يبقى الملف السابق إن وُجد
+                logger.warning('breached password file ignored: %d bytes', stat.st_size)
+                self._stamp = stamp
+                return
+            with open(self.path, 'rb') as handle:
+                mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, hash_bytes, count = _HEADER.unpack_from(mapped, 0)
+            if magic != _MAGIC or version != _VERSION or hash_bytes != HASH_BYTES \
+                    or len(mapped) < _HEADER.size + count * HASH_BYTES:
+                logger.warning('breached password file ignored: unknown format or truncated')
+                mapped.close()
+                self._stamp = stamp
+                return
+            old = self._mmap
+            self._mmap, self._count, self._stamp = mapped, count, stamp
+            if old is not None:
+                old.close()
+
+    def __len__(self):
+        self._sync()
+        return self._count
+
+    def is_breached(self, password):
+        """هل ظهرت كلمة المرور في القائمة المسربة (بحث ثنائي في الملف)"""
+        self._sync()
+        mapped = self._mmap
+        if mapped is None or not password:
+            return False
+
+        needle = fingerprint(password)
+        base = _HEADER.size
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            offset = base + middle * HASH_BYTES
+            if mapped[offset:offset + HASH_BYTES] < needle:
+                low = middle + 1
+            else:
+                high = middle
+        offset = base + low * HASH_BYTES
+        return low < self._count and mapped[offset:offset + HASH_BYTES] == needle
+
+
+breached_passwords = BreachedPasswordScreen()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ترجمة قائمة كلمات المرور المسربة إلى ملف البصمات المرتب')
+    parser.add_argument('source', help='ملف القائمة: سطر لكل كلمة مرور أو SHA1[:العدد]')
+    parser.add_argument('-o', '--output', default=os.path.join('instance', 'breached_passwords.bin'))
+    parser.add_argument('--format', choices=('auto', 'plain', 'sha1'), default='auto')
+    parser.add_argument('--chunk-size', type=int, default=1000000)
+    args = parser.parse_args()
+
+    count = compile_corpus(args.source, args.output, args.format, args.chunk_size)
+    print(f'{count} بصمة في {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+ملفات التنسيق المشتركة بين عمليات gunicorn
+ملف الحقبة: تحتفظ كل عملية بنسخة في الذاكرة من جدول صغير، وتستبدل العملية التي تعدّله
+هذا الملف ذرياً بعد commit، فيكفي stat واحد لكل طلب لمعرفة هل تغير الجدول.
+ملف القفل: يضمن أن مهمة خلفية (ترجمة أو أرشفة أو تعبئة) تعمل في عملية واحدة فقط
+"""
+
+import fcntl
+import os
+from datetime import datetime
+
+
+class EpochFile:
+    """ملف تُقارن بصمته (inode، وقت التعديل) لاكتشاف التغييرات"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def stamp(self):
+        """بصمة الملف الحالية، أو None إن لم يُنشأ بعد"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def touch(self):
+        """استبدال الملف ذرياً فيتغير inode وتلاحظه كل العمليات"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as handle:
+            handle.write(datetime.utcnow().isoformat())
+        os.replace(temp_path, self.path)
+
+
+def try_lock(path):
+    """قفل ملف غير حاجز: مقبض الملف المقفل، أو None إن كانت عملية أخرى تحمله
+
+    يُحرَّر القفل بإغلاق المقبض أو بانتهاء العملية.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    handle = open(path, 'a')
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
@@ -0,0 +1,168 @@
+"""
+طبقة الهوية المعتمدة على مطالبات الجلسة
+تحفظ الجلسة (الموقعة بمفتاح التطبيق) مطالبات مختصرة: المعرف والدور وحالة النشاط
+وقناع الصلاحيات ورقمَي إصدار الصلاحيات للمستخدم ولدوره.
+يحتفظ الخادم بعدادات الإصدارات في جدول صغير ويقرؤها إلى الذاكرة، ولا يعيد قراءتها
+إلا عند تغير ملف الحقبة المشترك بين العمليات، فلا تلمس معظم الطلبات قاعدة البيانات
+"""
+
+import os
+from datetime import datetime
+from threading import Lock
+from flask import g, session
+from sqlalchemy import event
+from src.models.user import db, User
+import src.models.role  # noqa: F401  (علاقة role_obj تُعرَّف في Role.users)
+from src.security.permissions import permission_compiler
+from src.security.epoch import EpochFile
+
+CLAIMS_KEY = 'identity'
+
+
+class AuthzVersion(db.Model):
+    """عدادات إصدار الصلاحيات (user:<id> أو role:<id>)"""
+    __tablename__ = 'authz_versions'
+
+    subject = db.Column(db.String(40), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class Identity:
+    """هوية المستخدم الحالي كما تصفها مطالبات الجلسة"""
+
+    __slots__ = ('id', 'role_id', 'is_active', 'is_admin', 'mask')
+
+    def __init__(self, claims):
+        self.id = claims['uid']
+        self.role_id = claims['rid']
+        self.is_active = claims['act']
+        self.is_admin = claims['adm']
+        self.mask = int(claims['msk'], 16)
+
+    def has_permission(self, permission_name):
+        # المدير لا يُقيَّد بقناع دوره، كما في User.has_permission
+        return self.is_admin or permission_compiler.mask_allows(self.mask, permission_name)
+
+
+class IdentityManager:
+    """إصدار مطالبات الجلسة والتحقق من حداثتها"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self._versions = {}
+        self._stamp = None  # (inode, mtime_ns) لملف الحقبة عند آخر تحميل
+        self._loaded = False
+        self._lock = Lock()
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """تهيئة مدير الهوية مع التطبيق"""
+        self.app = app
+        app.config.setdefault('IDENTITY_EPOCH_FILE', os.path.join(app.instance_path, 'authz.epoch'))
+        app.extensions['identity_manager'] = self
+
+    @property
+    def epoch(self):
+        return EpochFile(self.app.config['IDENTITY_EPOCH_FILE'])
+
+    # ==================== الإصدارات ====================
+
+    def _sync(self):
+        """إعادة تحميل العدادات فقط إذا تغير ملف الحقبة منذ آخر تحميل"""
+        stamp = self.epoch.stamp()
+        if self._loaded and stamp == self._stamp:
+            return
+
+        rows = db.session.query(AuthzVersion.subject, AuthzVersion.version).all()
+        with self._lock:
+            self._versions = dict(rows)
+            self._stamp = stamp
+            self._loaded = True
+
+    def version(self, subject):
+        return self._versions.get(subject, 0)
+
+    def _bump(self, subject):
+        row = db.session.get(AuthzVersion, subject)
+        if row is None:
+            db.session.add(AuthzVersion(subject=subject, version=1))
+        else:
+            row.version = AuthzVersion.version + 1
+        # يُلمس ملف الحقبة بعد commit حتى لا تقرأ العمليات الأخرى الإصدار القديم
+        db.session.info['authz_changed'] = True
+
+    def bump_user(self, user_id):
+        """إبطال مطالبات مستخدم (تغيير الدور أو الحالة أو الحذف)"""
+        self._bump(f'user:{user_id}')
+
+    def bump_role(self, role_id):
+        """إبطال مطالبات كل مستخدمي دور تغيرت صلاحياته"""
+        self._bump(f'role:{role_id}')
+
+    def touch_epoch(self):
+        """إعلام كل العمليات بتغير الإصدارات"""
+        self.epoch.touch()
+        self._loaded = False
+
+    # ==================== المطالبات ====================
+
+    def issue(self, user):
+        """بناء مطالبات المستخدم وحفظها في الجلسة (عند الدخول أو بعد تغير الإصدار)"""
+        self._sync()
+        role = user.role_obj
+        claims = {
+            'uid': user.id,
+            'rid': user.role_id,
+            'act': bool(user.is_active),
+            'adm': bool(user.is_admin),
+            'msk': (role.permission_mask if role else None) or '0',
+            'uv': self.version(f'user:{user.id}'),
+            'rv': self.version(f'role:{user.role_id}')
+        }
+        session['user_id'] = user.id
+        session[CLAIMS_KEY] = claims
+        g.identity = Identity(claims)
+        return g.identity
+
+    def current(self):
+        """هوية الطلب الحالي، أو None لزائر غير مسجل أو حساب غير نشط"""
+        if 'identity' in g:
+            return g.identity
+
+        identity = None
+        user_id = session.get('user_id')
+        if user_id is not None:
+            claims = session.get(CLAIMS_KEY)
+            self._sync()
+            if not claims or claims['uid'] != user_id or not self._is_fresh(claims):
+                # جلسة قديمة بلا مطالبات أو تغيرت صلاحياتها: قراءة واحدة من قاعدة البيانات
+                user = db.session.get(User, user_id)
+                identity = self.issue(user) if user else None
+            else:
+                identity = Identity(claims)
+
+        if identity is not None and not identity.is_active:
+            identity = None
+        g.identity = identity
+        return identity
+
+    def _is_fresh(self, claims):
+        return (claims['uv'] == self.version(f"user:{claims['uid']}")
+                and claims['rv'] == self.version(f"role:{claims['rid']}"))
+
+
+identity_manager = IdentityManager()
+
+
+@event.listens_for(db.session, 'after_commit')
+def _touch_epoch_after_commit(db_session):
+    if db_session.info.pop('authz_changed', False):
+        identity_manager.touch_epoch()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_authz_change(db_session):
+    db_session.info.pop('authz_changed', None)
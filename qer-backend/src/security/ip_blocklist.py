@@ -0,0 +1,537 @@
+"""
+قائمة حظر عناوين IP بالنطاقات (CIDR) على شجرة Patricia
+المصدر ملف نصي (سطر لكل نطاق) يمكن تعديله أو استبداله في أي وقت، ويُترجم إلى ملف ثنائي
+للشجرة تفتحه كل عمليات gunicorn بـ mmap للقراءة فقط، فتتشارك نسخة واحدة في ذاكرة النظام.
+الفحص أطول بادئة مطابقة بعدد خطوات لا يتجاوز بتات العنوان (32 أو 128) مهما كبرت القائمة،
+ويُعاد التحميل تلقائياً عند تغير الملف.
+الإضافة والحذف يعدّلان ملف الشجرة في مكانه: العقد الجديدة تُلحق بنهايته ثم يُبدَّل مؤشر
+واحد في أبيها (أو بايت الإجراء في عقدتها)، فترى العمليات الأخرى التغيير عبر mmap المشترك
+دون إعادة ترجمة. الترجمة الكاملة عند استيراد قائمة أو تعديل المصدر يدوياً أو تراكم العقد الفارغة
+
+صيغة الملف النصي:
+    203.0.113.0/24          # سبب الحظر
+    2001:db8::/32
+    203.0.113.7 allow       # استثناء داخل نطاق محظور
+"""
+
+import fcntl
+import ipaddress
+import logging
+import mmap
+import os
+import struct
+import time
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+BLOCK = 'block'
+ALLOW = 'allow'
+
+_ACTIONS = {BLOCK: 1, ALLOW: 0}
+
+# رأس الملف: التوقيع، الإصدار، عدد النطاقات، فهرس جذر IPv4، فهرس جذر IPv6
+_HEADER = struct.Struct('<4sHIii')
+_MAGIC = b'RFIP'
+_VERSION = 2
+_COUNT = struct.Struct('<I')
+_COUNT_OFFSET = 6
+# العقدة: البادئة (16 بايت big-endian)، طولها، الإجراء (-1 لا شيء)، الابن الأيسر، الابن الأيمن
+_NODE = struct.Struct('<16sBbii')
+_ACTION = struct.Struct('<b')
+_ACTION_OFFSET = 17
+_CHILD = struct.Struct('<i')
+_CHILD_OFFSETS = (18, 22)
+
+# إعادة الترجمة الكاملة عندما تتجاوز العقد هذا الحد من النطاقات (عقد محذوفة متراكمة)
+_COMPACT_RATIO = 4
+_COMPACT_SLACK = 64
+
+
+class _Node:
+    __slots__ = ('key', 'plen', 'action', 'children')
+
+    def __init__(self, key, plen, action=-1):
+        self.key = key
+        self.plen = plen
+        self.action = action
+        self.children = [None, None]
+
+
+def _bit(key, position, width):
+    return (key >> (width - position - 1)) & 1
+
+
+def _mask(key, plen, width):
+    shift = width - plen
+    return key >> shift << shift
+
+
+class PatriciaTrie:
+    """شجرة Patricia (مضغوطة المسارات) لعائلة عناوين واحدة"""
+
+    def __init__(self, width):
+        self.width = width
+        self.root = _Node(0, 0)
+
+    def insert(self, key, plen, action):
+        width = self.width
+        key = _mask(key, plen, width)
+        node = self.root
+        while True:
+            # البادئة في node تسبق key دائماً هنا
+            if node.plen == plen:
+                node.action = action
+                return
+            bit = (key >> (width - node.plen - 1)) & 1
+            child = node.children[bit]
+            if child is None:
+                node.children[bit] = _Node(key, plen, action)
+                return
+
+            limit = child.plen if child.plen < plen else plen
+            common = limit - ((child.key ^ key) >> (width - limit)).bit_length()
+            if common == child.plen:
+                node = child
+                continue
+
+            if common == plen:
+                # النطاق الجديد يحتوي الابن
+                new = _Node(key, plen, action)
+                new.children[_bit(child.key, plen, width)] = child
+            else:
+                # تفرع عند أول بت مختلف
+                new = _Node(_mask(key, common, width), common)
+                new.children[_bit(key, common, width)] = _Node(key, plen, action)
+                new.children[_bit(child.key, common, width)] = child
+            node.children[bit] = new
+            return
+
+    def nodes(self, start=0):
+        """العقد بترتيب العمق أولاً (الجذر في الموضع start) مع فهارس الأبناء"""
+        order = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(child for child in reversed(node.children) if child is not None)
+        index = {id(node): start + i for i, node in enumerate(order)}
+        for node in order:
+            left, right = node.children
+            yield node, (index[id(left)] if left else -1), (index[id(right)] if right else -1)
+
+
+class _TrieFile:
+    """تعديل ملف الشجرة في مكانه (تحت قفل الكاتب): إلحاق عقد ثم تبديل مؤشر واحد"""
+
+    def __init__(self, fd):
+        self.fd = fd
+        # بقايا إلحاق لم يكتمل لا يشير إليها شيء، فيُكتب فوقها
+        self.next = (os.fstat(fd).st_size - _HEADER.size) // _NODE.size
+        self.header = _HEADER.unpack(os.pread(fd, _HEADER.size, 0))
+
+    @staticmethod
+    def _offset(index):
+        return _HEADER.size + index * _NODE.size
+
+    def read(self, index):
+        key, plen, action, left, right = _NODE.unpack(os.pread(self.fd, _NODE.size, self._offset(index)))
+        return int.from_bytes(key, 'big'), plen, action, left, right
+
+    def append(self, key, plen, action=-1, left=-1, right=-1):
+        index = self.next
+        os.pwrite(self.fd, _NODE.pack(key.to_bytes(16, 'big'), plen, action, left, right), self._offset(index))
+        self.next += 1
+        return index
+
+    def set_action(self, index, action):
+        os.pwrite(self.fd, _ACTION.pack(action), self._offset(index) + _ACTION_OFFSET)
+
+    def set_child(self, index, bit, child):
+        os.pwrite(self.fd, _CHILD.pack(child), self._offset(index) + _CHILD_OFFSETS[bit])
+
+    def set_count(self, count):
+        os.pwrite(self.fd, _COUNT.pack(count), _COUNT_OFFSET)
+
+    def root(self, version):
+        return self.header[3] if version == 4 else self.header[4]
+
+    def insert(self, version, key, plen, action):
+        """نفس خطوات PatriciaTrie.insert على الملف، والعقد الجديدة تُلحق قبل ربطها"""
+        width = 32 if version == 4 else 128
+        key = _mask(key, plen, width)
+        index = self.root(version)
+        node = self.read(index)
+        while True:
+            # البادئة في node تسبق key دائماً هنا
+            if node[1] == plen:
+                self.set_action(index, action)
+                return
+            bit = _bit(key, node[1], width)
+            child = node[3 + bit]
+            if child < 0:
+                self.set_child(index, bit, self.append(key, plen, action))
+                return
+
+            child_node = self.read(child)
+            child_key, child_plen = child_node[:2]
+            limit = child_plen if child_plen < plen else plen
+            common = limit - ((child_key ^ key) >> (width - limit)).bit_length()
+            if common == child_plen:
+                index, node = child, child_node
+                continue
+
+            children = [-1, -1]
+            if common == plen:
+                children[_bit(child_key, plen, width)] = child
+                new = self.append(key, plen, action, *children)
+            else:
+                children[_bit(key, common, width)] = self.append(key, plen, action)
+                children[_bit(child_key, common, width)] = child
+                new = self.append(_mask(key, common, width), common, -1, *children)
+            self.set_child(index, bit, new)
+            return
+
+    def clear(self, version, key, plen):
+        """إلغاء إجراء عقدة النطاق (تبقى العقدة فارغة حتى الترجمة الكاملة التالية)"""
+        width = 32 if version == 4 else 128
+        key = _mask(key, plen, width)
+        index = self.root(version)
+        while index >= 0:
+            node_key, node_plen, _, left, right = self.read(index)
+            if node_plen and (key ^ node_key) >> (width - node_plen):
+                return
+            if node_plen == plen:
+                self.set_action(index, -1)
+                return
+            index = right if _bit(key, node_plen, width) else left
+
+
+def parse_entries(lines):
+    """تحليل أسطر القائمة إلى (الشبكة، الإجراء، السبب) مع تجاهل الأسطر غير الصالحة"""
+    entries = []
+    for number, line in enumerate(lines, 1):
+        text, _, reason = line.partition('#')
+        fields = text.split()
+        if not fields:
+            continue
+        try:
+            network = ipaddress.ip_network(fields[0], strict=False)
+        except ValueError:
+            logger.warning('ip blocklist line %d ignored: %r', number, fields[0])
+            continue
+        action = fields[1].lower() if len(fields) > 1 else BLOCK
+        if action not in _ACTIONS:
+            logger.warning('ip blocklist line %d ignored: unknown action %r', number, action)
+            continue
+        entries.append((network, action, reason.strip()))
+    return entries
+
+
+def clean_reason(reason):
+    """سبب الحظر في سطر واحد: بلا أسطر جديدة ولا # (تبدأ تعليقاً في ملف المصدر)"""
+    return ' '.join(str(reason or '').replace('#', ' ').split())
+
+
+def format_entry(network, action=BLOCK, reason=''):
+    line = str(network)
+    if action != BLOCK:
+        line += f' {action}'
+    reason = clean_reason(reason)
+    if reason:
+        line += f'  # {reason}'
+    return line
+
+
+def compile_trie(entries):
+    """ترجمة النطاقات إلى محتوى ملف الشجرة الثنائي"""
+    tries = {4: PatriciaTrie(32), 6: PatriciaTrie(128)}
+    for network, action, _ in entries:
+        tries[network.version].insert(int(network.network_address), network.prefixlen, _ACTIONS[action])
+
+    chunks = []
+    roots = {}
+    for version in (4, 6):
+        roots[version] = len(chunks)
+        for node, left, right in tries[version].nodes(len(chunks)):
+            chunks.append(_NODE.pack(node.key.to_bytes(16, 'big'), node.plen, node.action, left, right))
+    return _HEADER.pack(_MAGIC, _VERSION, len(entries), roots[4], roots[6]) + b''.join(chunks)
+
+
+class IpBlocklist:
+    """قائمة الحظر: ملف المصدر النصي وملف الشجرة المشترك بـ mmap"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self._mmap = None
+        self._stamp = None
+        self._roots = {}  # الإصدار ← (فهرس الجذر، عرض العنوان)
+        self._checked_source = 0.0
+        self._entries = None  # الشبكة ← (الإجراء، السبب) كما في المصدر عند _entries_stamp
+        self._entries_stamp = None
+        self._lock = Lock()
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """تهيئة قائمة الحظر مع التطبيق"""
+        self.app = app
+        app.config.setdefault('IP_BLOCKLIST_FILE', os.path.join(app.instance_path, 'ip_blocklist.txt'))
+        app.config.setdefault('IP_BLOCKLIST_TRIE', os.path.join(app.instance_path, 'ip_blocklist.trie'))
+        app.config.setdefault('IP_BLOCKLIST_CHECK_INTERVAL', 1.0)  # ثوانٍ بين فحص تعديل ملف المصدر
+        app.extensions['ip_blocklist'] = self
+
+    @property
+    def source_path(self):
+        return self.app.config['IP_BLOCKLIST_FILE']
+
+    @property
+    def trie_path(self):
+        return self.app.config['IP_BLOCKLIST_TRIE']
+
+    # ==================== الترجمة ====================
+
+    def _locked(self):
+        """قفل ملفات بين العمليات لتعديل المصدر أو إعادة الترجمة"""
+        directory = os.path.dirname(self.source_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handle = open(f'{self.source_path}.lock', 'a')
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    def _read_source(self):
+        try:
+            with open(self.source_path, encoding='utf-8') as handle:
+                return handle.read().splitlines()
+        except FileNotFoundError:
+            return []
+
+    @staticmethod
+    def _write_atomic(path, data, mode='w'):
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, mode, encoding=None if 'b' in mode else 'utf-8') as handle:
+            handle.write(data)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def _file_stamp(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _load_entries(self):
+        """نطاقات المصدر (الأحدث يغلب)، تُحلَّل من جديد فقط إذا تغير الملف"""
+        stamp = self._file_stamp(self.source_path)
+        if self._entries is None or stamp != self._entries_stamp:
+            self._entries = {
+                network: (action, reason) for network, action, reason in parse_entries(self._read_source())
+            }
+            self._entries_stamp = stamp
+        return self._entries
+
+    def _compile(self, entries):
+        started = time.perf_counter()
+        self._write_atomic(self.trie_path, compile_trie(entries), 'wb')
+        logger.info('ip blocklist compiled: %d entries in %.0f ms',
+                    len(entries), (time.perf_counter() - started) * 1000)
+        return len(entries)
+
+    def _write_source(self, unique):
+        text = ''.join(format_entry(network, action, reason) + '\n' for network, (action, reason) in unique.items())
+        self._write_atomic(self.source_path, text)
+        self._entries, self._entries_stamp = unique, self._file_stamp(self.source_path)
+
+    def _save(self, entries):
+        """كتابة المصدر (سطر لكل نطاق، والأحدث يغلب) ثم ترجمة الشجرة كاملة"""
+        unique = {network: (action, clean_reason(reason)) for network, action, reason in entries}
+        self._write_source(unique)
+        return self._compile([(network, action, reason) for network, (action, reason) in unique.items()])
+
+    def _update(self, unique, changed, removed=False):
+        """كتابة المصدر ثم تعديل نطاق واحد في ملف الشجرة دون إعادة ترجمته"""
+        self._write_source(unique)
+        try:
+            fd = os.open(self.trie_path, os.O_RDWR)
+        except FileNotFoundError:
+            return self._compile([(network, action, reason) for network, (action, reason) in unique.items()])
+        try:
+            trie = _TrieFile(fd)
+            if trie.header[0] != _MAGIC or trie.header[1] != _VERSION \
+                    or trie.next > _COMPACT_RATIO * len(unique) + _COMPACT_SLACK:
+                os.close(fd)
+                fd = None
+                return self._compile([(network, action, reason) for network, (action, reason) in unique.items()])
+            key = int(changed.network_address)
+            if removed:
+                trie.clear(changed.version, key, changed.prefixlen)
+            else:
+                trie.insert(changed.version, key, changed.prefixlen, _ACTIONS[unique[changed][0]])
+            trie.set_count(len(unique))
+        finally:
+            if fd is not None:
+                os.close(fd)
+        return len(unique)
+
+    def _source_changed(self):
+        """هل عُدّل ملف المصدر بعد آخر ترجمة (تعديل يدوي أو نسخ قائمة جديدة)"""
+        try:
+            source_mtime = os.stat(self.source_path).st_mtime_ns
+        except OSError:
+            return False
+        try:
+            return source_mtime > os.stat(self.trie_path).st_mtime_ns
+        except OSError:
+            return True
+
+    def rebuild(self, force=False):
+        """إعادة ترجمة الشجرة إذا تغير المصدر (عملية واحدة تترجم والبقية تنتظر القفل)"""
+        with self._locked():
+            if force or self._source_changed():
+                return self._compile(self.entries())
+        return None
+
+    # ==================== التحميل ====================
+
+    def _sync(self):
+        """فتح ملف الشجرة من جديد إذا استُبدل (بصمة inode ووقت التعديل)"""
+        now = time.monotonic()
+        if now - self._checked_source >= self.app.config['IP_BLOCKLIST_CHECK_INTERVAL']:
+            self._checked_source = now
+            if self._source_changed():
+                self.rebuild()
+
+        try:
+            stat = os.stat(self.trie_path)
+        except OSError:
+            self._mmap, self._stamp, self._roots = None, None, {}
+            return
+        # التعديل في المكان يظهر عبر mmap المشترك، ويُعاد الفتح عند استبدال الملف أو نموه
+        stamp = (stat.st_ino, stat.st_size)
+        if stamp == self._stamp:
+            return
+
+        with self._lock:
+            if stamp == self._stamp:
+                return
+            with open(self.trie_path, 'rb') as handle:
+                try:
+                    mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                    mapped = None
+            try:
+                magic, version, _, v4_root, v6_root = _HEADER.unpack_from(mapped, 0)
+            except (struct.error, TypeError):
+                magic = version = None
+            if magic != _MAGIC or version != _VERSION:
+                # ملف فارغ أو مقطوع أو بصيغة قديمة: يُترجم من المصدر ويُفتح في الفحص التالي
+                logger.warning('ip blocklist trie ignored: unknown format, rebuilding')
+                if mapped is not None:
+                    mapped.close()
+                self.rebuild(force=True)
+                return
+            old = self._mmap
+            self._roots = {4: (v4_root, 32), 6: (v6_root, 128)}
+            self._mmap = mapped
+            self._stamp = stamp
+            if old is not None:
+                old.close()
+
+    def match(self, ip):
+        """أطول نطاق يطابق العنوان: (الشبكة، الإجراء) أو None"""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        self._sync()
+        try:
+            best = self._lookup(address)
+        except struct.error:
+            # عقدة أُلحقت بعد فتح الملف: إعادة الفتح بالحجم الجديد
+            self._stamp = None
+            self._sync()
+            best = self._lookup(address)
+
+        if best is None:
+            return None
+        plen, action = best
+        network = ipaddress.ip_network((int(address), plen), strict=False)
+        return network, BLOCK if action == _ACTIONS[BLOCK] else ALLOW
+
+    def _lookup(self, address):
+        mapped = self._mmap
+        if mapped is None:
+            return None
+        index, width = self._roots[address.version]
+        key = int(address)
+        best = None
+        while index >= 0:
+            raw_key, plen, action, left, right = _NODE.unpack_from(mapped, _HEADER.size + index * _NODE.size)
+            if plen and (key ^ int.from_bytes(raw_key, 'big')) >> (width - plen):
+                break
+            if action >= 0:
+                best = (plen, action)
+            if plen == width:
+                break
+            index = right if _bit(key, plen, width) else left
+        return best
+
+    def is_blocked(self, ip):
+        found = self.match(ip)
+        return found is not None and found[1] == BLOCK
+
+    # ==================== التعديل ====================
+
+    def entries(self):
+        """النطاقات المسجلة في ملف المصدر: [(الشبكة، الإجراء، السبب)]"""
+        return [(network, action, reason) for network, (action, reason) in self._load_entries().items()]
+
+    def count(self):
+        """عدد النطاقات من رأس ملف الشجرة (يُحدَّث مع كل تعديل) دون قراءة المصدر"""
+        self._sync()
+        mapped = self._mmap
+        if mapped is None:
+            return 0
+        return _COUNT.unpack_from(mapped, _COUNT_OFFSET)[0]
+
+    def add(self, cidr, action=BLOCK, reason=''):
+        """إضافة نطاق أو عنوان (يستبدل أي سطر لنفس النطاق)"""
+        network = ipaddress.ip_network(cidr, strict=False)
+        if action not in _ACTIONS:
+            raise ValueError(f'إجراء غير معروف: {action}')
+        with self._locked():
+            if self._source_changed():
+                self._compile(self.entries())
+            unique = dict(self._load_entries())
+            unique.pop(network, None)
+            unique[network] = (action, clean_reason(reason))
+            self._update(unique, network)
+        return network
+
+    def remove(self, cidr):
+        """حذف نطاق بعينه، ويُرجع False إن لم يكن في القائمة"""
+        network = ipaddress.ip_network(cidr, strict=False)
+        with self._locked():
+            if self._source_changed():
+                self._compile(self.entries())
+            unique = dict(self._load_entries())
+            if unique.pop(network, None) is None:
+                return False
+            self._update(unique, network, removed=True)
+        return True
+
+    def replace(self, lines, merge=False):
+        """استيراد قائمة كاملة (أو دمجها مع الحالية) وإرجاع عدد النطاقات الصالحة"""
+        entries = parse_entries(lines)
+        with self._locked():
+            if merge:
+                entries = self.entries() + entries
+            return self._save(entries)
+
+
+ip_blocklist = IpBlocklist()
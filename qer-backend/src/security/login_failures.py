@@ -0,0 +1,340 @@
+"""
+تتبع محاولات تسجيل الدخول الفاشلة بذاكرة محدودة
+لكل عنوان IP ولكل اسم مستخدم عداد متناقص أُسياً (بدل قائمة أوقات تُمسح في كل طلب)
+مع وقت آخر محاولة ونهاية القفل وعدد تقريبي لآخر 24 ساعة (نافذتان يوميتان متتاليتان).
+العدادات في ملف SQLite الخاص بمحدد المعدل (rate_limiter) فيتشاركها كل عمال gunicorn
+ويسري القفل على العنوان أياً كانت العملية التي استقبلت الطلب، والترتيب ثابت بين المحاولات
+فيُفهرس ويُقرأ "أكثر العناوين اشتباهاً" بالفهرس دون مسح الجدول. المفاتيح الخاملة تُحذف
+دورياً وعددها مقيد، وإذا تعذر الوصول إلى الملف تُستخدم عدادات محلية في ذاكرة العملية
+"""
+
+import logging
+import math
+import sqlite3
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from src.security.rate_limiter import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# مواضع الحقول في حالة المفتاح
+_SCORE, _LAST, _LOCKED_UNTIL, _TOTAL, _DAY, _DAY_COUNT, _PREVIOUS_COUNT = range(7)
+
+_DAY_SECONDS = 86400
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS login_failures ('
+    'kind TEXT NOT NULL, key TEXT NOT NULL, score REAL NOT NULL, last REAL NOT NULL, '
+    'locked_until REAL NOT NULL DEFAULT 0, total INTEGER NOT NULL, rank REAL NOT NULL, '
+    'day INTEGER NOT NULL, day_count INTEGER NOT NULL, previous_count INTEGER NOT NULL, '
+    'PRIMARY KEY (kind, key)) WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS login_failures_rank ON login_failures (kind, rank)'
+)
+
+_COLUMNS = 'score, last, locked_until, total, day, day_count, previous_count'
+
+
+def _roll(slot, now):
+    """محاولة جديدة في نافذة اليوم الحالي (اليوم السابق يصبح النافذة السابقة)"""
+    day = int(now // _DAY_SECONDS)
+    if slot[_DAY] == day:
+        slot[_DAY_COUNT] += 1
+        return
+    slot[_PREVIOUS_COUNT] = slot[_DAY_COUNT] if slot[_DAY] == day - 1 else 0
+    slot[_DAY], slot[_DAY_COUNT] = day, 1
+
+
+def _last_24h(slot, now):
+    """تقدير عدد المحاولات في آخر 24 ساعة: اليوم الحالي + الجزء المتبقي من السابق"""
+    day = int(now // _DAY_SECONDS)
+    remaining = 1 - (now % _DAY_SECONDS) / _DAY_SECONDS
+    if slot[_DAY] == day:
+        return slot[_DAY_COUNT] + slot[_PREVIOUS_COUNT] * remaining
+    if slot[_DAY] == day - 1:
+        return slot[_DAY_COUNT] * remaining
+    return 0.0
+
+
+class DecayingCounters:
+    """عداد متناقص لكل مفتاح في ذاكرة العملية: score(t) = score * exp(-(t - last) / decay)"""
+
+    def __init__(self, decay, max_keys=100000, top_size=20):
+        self.decay = decay
+        self.max_keys = max_keys
+        self.top_size = top_size
+        self._slots = OrderedDict()  # المفتاح ← [العداد، آخر محاولة، نهاية القفل، المجموع، اليوم، عدده، عدد السابق]
+        # التناقص بنفس المعدل للجميع، فترتيب المفاتيح ثابت بين المحاولات:
+        # ln(score) + last / decay لا يتغير إلا عند محاولة جديدة
+        self._top = {}  # المفتاح ← الرتبة
+        self._lock = Lock()
+
+    def _decayed(self, slot, now):
+        return slot[_SCORE] * math.exp(-(now - slot[_LAST]) / self.decay)
+
+    def _rank(self, slot):
+        return math.log(slot[_SCORE]) + slot[_LAST] / self.decay
+
+    def _index(self, key, slot):
+        """تحديث فهرس الأعلى (حجمه ثابت فالمرور عليه زمن ثابت)"""
+        rank = self._rank(slot)
+        if key in self._top or len(self._top) < self.top_size:
+            self._top[key] = rank
+            return
+        lowest = min(self._top, key=self._top.get)
+        if rank > self._top[lowest]:
+            del self._top[lowest]
+            self._top[key] = rank
+
+    def _state(self, slot, now):
+        return {
+            'score': self._decayed(slot, now),
+            'total': slot[_TOTAL],
+            'last_24h': _last_24h(slot, now),
+            'last_attempt': slot[_LAST],
+            'locked_until': slot[_LOCKED_UNTIL] if slot[_LOCKED_UNTIL] > now else None
+        }
+
+    def hit(self, key, now=None):
+        """تسجيل محاولة فاشلة وإرجاع قيمة العداد بعدها"""
+        now = time.time() if now is None else now
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = [1.0, now, 0.0, 1, int(now // _DAY_SECONDS), 1, 0]
+                self._slots[key] = slot
+                if len(self._slots) > self.max_keys:
+                    evicted, _ = self._slots.popitem(last=False)
+                    self._top.pop(evicted, None)
+            else:
+                slot[_SCORE] = self._decayed(slot, now) + 1
+                slot[_LAST] = now
+                slot[_TOTAL] += 1
+                _roll(slot, now)
+                self._slots.move_to_end(key)
+            self._index(key, slot)
+            return slot[_SCORE]
+
+    def lock(self, key, until):
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is not None:
+                slot[_LOCKED_UNTIL] = max(slot[_LOCKED_UNTIL], until)
+
+    def locked_until(self, key, now=None):
+        """نهاية القفل إن كان سارياً، وإلا None"""
+        slot = self._slots.get(key)
+        if slot is None:
+            return None
+        now = time.time() if now is None else now
+        until = slot[_LOCKED_UNTIL]
+        return until if until > now else None
+
+    def get(self, key, now=None):
+        """حالة المفتاح: {'score', 'total', 'last_24h', 'last_attempt', 'locked_until'} أو None"""
+        slot = self._slots.get(key)
+        if slot is None:
+            return None
+        return self._state(slot, time.time() if now is None else now)
+
+    def clear(self, key):
+        with self._lock:
+            self._slots.pop(key, None)
+            self._top.pop(key, None)
+
+    def top(self, limit=10, now=None):
+        """أعلى المفاتيح حسب العداد الحالي: [(المفتاح، الحالة)]"""
+        now = time.time() if now is None else now
+        with self._lock:
+            keys = sorted(self._top, key=self._top.get, reverse=True)[:limit]
+        return [(key, state) for key, state in ((key, self.get(key, now)) for key in keys) if state]
+
+    def __len__(self):
+        return len(self._slots)
+
+
+class SharedDecayingCounters(DecayingCounters):
+    """نفس العدادات في جدول login_failures بمخزن محدد المعدل المشترك بين العمليات
+
+    kind يفصل عدادات العناوين عن أسماء المستخدمين في نفس الجدول، والرتبة مخزنة في عمود
+    مفهرس. عند تعطل المخزن تعمل العدادات المحلية الموروثة حتى يعود.
+    """
+
+    def __init__(self, kind, decay, max_keys=100000, top_size=20, sweep_interval=60):
+        super().__init__(decay, max_keys, top_size)
+        self.kind = kind
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0.0
+        self._schema_conn = None
+
+    def _connection(self):
+        conn = rate_limiter.connection()
+        if conn is not self._schema_conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            self._schema_conn = conn
+        return conn
+
+    def _row(self, conn, key):
+        row = conn.execute(
+            f'SELECT {_COLUMNS} FROM login_failures WHERE kind = ? AND key = ?', (self.kind, key)
+        ).fetchone()
+        return list(row) if row else None
+
+    def hit(self, key, now=None):
+        now = time.time() if now is None else now
+        try:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                slot = self._row(conn, key)
+                if slot is None:
+                    slot = [1.0, now, 0.0, 1, int(now // _DAY_SECONDS), 1, 0]
+                else:
+                    slot[_SCORE] = self._decayed(slot, now) + 1
+                    slot[_LAST] = now
+                    slot[_TOTAL] += 1
+                    _roll(slot, now)
+                conn.execute(
+                    f'INSERT OR REPLACE INTO login_failures (kind, key, rank, {_COLUMNS}) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (self.kind, key, self._rank(slot), *slot)
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+            self._maybe_sweep(conn, now)
+            return slot[_SCORE]
+        except sqlite3.Error as e:
+            logger.error('login failure store unavailable, using local counters: %s', e)
+            return super().hit(key, now)
+
+    def lock(self, key, until):
+        try:
+            self._connection().execute(
+                'UPDATE login_failures SET locked_until = max(locked_until, ?) WHERE kind = ? AND key = ?',
+                (until, self.kind, key)
+            )
+        except sqlite3.Error as e:
+            logger.error('login failure store unavailable, using local counters: %s', e)
+        super().lock(key, until)
+
+    def locked_until(self, key, now=None):
+        now = time.time() if now is None else now
+        local = super().locked_until(key, now)
+        try:
+            row = self._connection().execute(
+                'SELECT locked_until FROM login_failures WHERE kind = ? AND key = ?', (self.kind, key)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.error('login failure store unavailable, using local counters: %s', e)
+            return local
+        until = max(row[0] if row else 0.0, local or 0.0)
+        return until if until > now else None
+
+    def get(self, key, now=None):
+        now = time.time() if now is None else now
+        try:
+            slot = self._row(self._connection(), key)
+        except sqlite3.Error as e:
+            logger.error('login failure store unavailable, using local counters: %s', e)
+            return super().get(key, now)
+        return self._state(slot, now) if slot else None
+
+    def clear(self, key):
+        super().clear(key)
+        try:
+            self._connection().execute('DELETE FROM login_failures WHERE kind = ? AND key = ?', (self.kind, key))
+        except sqlite3.Error as e:
+            logger.error('login failure store unavailable, cleared only local counters: %s', e)
+
+    def top(self, limit=10, now=None):
+        now = time.time() if now is None else now
+        try:
+            rows = self._connection().execute(
+                f'SELECT key, {_COLUMNS} FROM login_failures WHERE kind = ? ORDER BY rank DESC LIMIT ?',
+                (self.kind, limit)
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.error('login failure store unavailable, using local counters: %s', e)
+            return super().top(limit, now)
+        return [(row[0], self._state(row[1:], now)) for row in rows]
+
+    def __len__(self):
+        try:
+            return self._connection().execute(
+                'SELECT count(*) FROM login_failures WHERE kind = ?', (self.kind,)
+            ).fetchone()[0]
+        except sqlite3.Error:
+            return super().__len__()
+
+    def _maybe_sweep(self, conn, now):
+        """حذف المفاتيح التي تناقص عدادها وخرجت من نافذة اليومين ولا قفل عليها، ثم الأدنى رتبة فوق الحد"""
+        if now - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = now
+        idle = now - max(2 * _DAY_SECONDS, 10 * self.decay)
+        conn.execute(
+            'DELETE FROM login_failures WHERE kind = ? AND last < ? AND locked_until < ?', (self.kind, idle, now)
+        )
+        excess = len(self) - self.max_keys
+        if excess > 0:
+            conn.execute(
+                'DELETE FROM login_failures WHERE kind = ? AND key IN ('
+                'SELECT key FROM login_failures WHERE kind = ? AND locked_until < ? ORDER BY rank LIMIT ?)',
+                (self.kind, self.kind, now, excess)
+            )
+
+
+class LoginFailureTracker:
+    """عدادات محاولات الدخول الفاشلة لعناوين IP وأسماء المستخدمين"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self.ips = None
+        self.usernames = None
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """تهيئة المتتبع مع التطبيق (بعد rate_limiter الذي يملك المخزن المشترك)"""
+        self.app = app
+        config = app.config
+        config.setdefault('MAX_USERNAME_LOGIN_ATTEMPTS', 10)  # أعلى من حد IP حتى لا يُقفل حساب بسهولة
+        config.setdefault('FAILED_LOGIN_DECAY', config['LOCKOUT_DURATION'])  # ثابت زمن التناقص بالثواني
+        config.setdefault('FAILED_LOGIN_MAX_KEYS', 100000)
+        config.setdefault('FAILED_LOGIN_TOP_SIZE', 20)
+        options = (config['FAILED_LOGIN_DECAY'], config['FAILED_LOGIN_MAX_KEYS'], config['FAILED_LOGIN_TOP_SIZE'],
+                   config.get('RATE_LIMIT_SWEEP_INTERVAL', 60))
+        self.ips = SharedDecayingCounters('ip', *options)
+        self.usernames = SharedDecayingCounters('username', *options)
+        app.extensions['login_failures'] = self
+
+    @staticmethod
+    def normalize(username):
+        return (username or '').strip().lower()
+
+    def record(self, ip, username=None):
+        """تسجيل محاولة فاشلة وقفل المفتاح الذي تجاوز حده"""
+        config = self.app.config
+        now = time.time()
+        # التقريب: محاولات متتالية سريعة تُحسب كاملة رغم التناقص الطفيف بينها
+        if ip and round(self.ips.hit(ip, now)) >= config['MAX_LOGIN_ATTEMPTS']:
+            self.ips.lock(ip, now + config['LOCKOUT_DURATION'])
+        username = self.normalize(username)
+        if username and round(self.usernames.hit(username, now)) >= config['MAX_USERNAME_LOGIN_ATTEMPTS']:
+            self.usernames.lock(username, now + config['LOCKOUT_DURATION'])
+
+    def clear(self, ip=None, username=None):
+        if ip:
+            self.ips.clear(ip)
+        username = self.normalize(username)
+        if username:
+            self.usernames.clear(username)
+
+
+login_failures = LoginFailureTracker()
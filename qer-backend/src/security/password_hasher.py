@@ -0,0 +1,154 @@
+"""
+خدمة تشفير كلمات المرور خارج عمليات الخادم
+يجري التشفير والتحقق في مجمع عمليات مخصص ذي طابور محدود، فإذا امتلأ يُرفض الطلب فوراً
+برمز 503 وRetry-After بدلاً من حجز عمليات gunicorn كلها أثناء موجات تسجيل الدخول،
+ويُعاد تشفير كلمة المرور تلقائياً عند الدخول إذا كانت مشفرة بمعاملات قديمة.
+عمليات المجمع تبدأ بـ forkserver لا fork، فلا تنسخ عامل gunicorn متعدد الخيوط وأقفاله
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from threading import BoundedSemaphore, Lock
+import bcrypt
+from flask import jsonify
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
+
+
+class PasswordHasherBusy(RuntimeError):
+    """مجمع التشفير ممتلئ أو تجاوز المهلة"""
+
+    def __init__(self, retry_after):
+        super().__init__('خدمة التحقق من كلمات المرور مشغولة')
+        self.retry_after = retry_after
+
+
+def _lower_priority(niceness):
+    """تهيئة عمليات المجمع بأولوية أقل فلا تزاحم معالجة التحويلات"""
+    if niceness:
+        os.nice(niceness)
+
+
+def _method_prefix(method):
+    """بادئة التجزئة التي ينتجها werkzeug للطريقة (يكمل المعاملات الافتراضية) دون تشفير فعلي"""
+    name, *args = method.split(':')
+    if name == 'scrypt' and not args:
+        return 'scrypt:32768:8:1'
+    if name == 'pbkdf2' and len(args) < 2:
+        return f"pbkdf2:{args[0] if args else 'sha256'}:{DEFAULT_PBKDF2_ITERATIONS}"
+    return method
+
+
+def _hash(raw, method):
+    return generate_password_hash(raw, method=method)
+
+
+def _verify(stored, raw):
+    if stored.startswith(('$2a$', '$2b$', '$2y$')):
+        # تجزئات bcrypt القديمة من SecurityManager.hash_password
+        return bcrypt.checkpw(raw.encode('utf-8'), stored.encode('utf-8'))
+    return check_password_hash(stored, raw)
+
+
+class PasswordHasher:
+    """مجمع عمليات التشفير مع حد للتزامن"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self._executor = None
+        self._owner_pid = None
+        self._slots = None
+        self._lock = Lock()
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """تهيئة خدمة التشفير مع التطبيق"""
+        self.app = app
+        app.config.setdefault('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')  # أو pbkdf2:sha256:600000
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 2)  # 0 = التشفير داخل العملية نفسها
+        app.config.setdefault('PASSWORD_HASH_QUEUE_SIZE', 16)  # الطلبات المنتظرة فوق عدد العمليات
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 5)  # ثوانٍ
+        app.config.setdefault('PASSWORD_HASH_RETRY_AFTER', 2)
+        app.config.setdefault('PASSWORD_HASH_NICE', 5)
+        app.config.setdefault('PASSWORD_HASH_START_METHOD', 'forkserver')  # أو spawn
+        app.extensions['password_hasher'] = self
+        app.register_error_handler(PasswordHasherBusy, self.busy_response)
+
+    @property
+    def method(self):
+        return self.app.config['PASSWORD_HASH_METHOD'] if self.app else 'scrypt'
+
+    # ==================== المجمع ====================
+
+    def _pool(self):
+        """المجمع الخاص بالعملية الحالية (يُنشأ بعد تفرع gunicorn)"""
+        if self._owner_pid != os.getpid():
+            with self._lock:
+                if self._owner_pid != os.getpid():
+                    config = self.app.config
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=config['PASSWORD_HASH_WORKERS'],
+                        mp_context=multiprocessing.get_context(config['PASSWORD_HASH_START_METHOD']),
+                        initializer=_lower_priority,
+                        initargs=(config['PASSWORD_HASH_NICE'],)
+                    )
+                    self._slots = BoundedSemaphore(config['PASSWORD_HASH_WORKERS'] + config['PASSWORD_HASH_QUEUE_SIZE'])
+                    self._owner_pid = os.getpid()
+        return self._executor
+
+    def _run(self, func, *args):
+        if not self.app or not self.app.config['PASSWORD_HASH_WORKERS']:
+            return func(*args)
+
+        executor = self._pool()
+        retry_after = self.app.config['PASSWORD_HASH_RETRY_AFTER']
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy(retry_after)
+
+        try:
+            future = executor.submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(timeout=self.app.config['PASSWORD_HASH_TIMEOUT'])
+        except FutureTimeout:
+            raise PasswordHasherBusy(retry_after)
+
+    def shutdown(self):
+        if self._executor is not None and self._owner_pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self._owner_pid = None
+
+    # ==================== الواجهة ====================
+
+    def hash(self, raw):
+        """تشفير كلمة مرور بالمعاملات الحالية"""
+        return self._run(_hash, raw, self.method)
+
+    def verify(self, stored, raw):
+        """التحقق من كلمة مرور مقابل تجزئة مخزنة (werkzeug أو bcrypt)"""
+        if not stored:
+            return False
+        try:
+            return self._run(_verify, stored, raw)
+        except ValueError:
+            return False
+
+    def needs_rehash(self, stored):
+        """هل التجزئة المخزنة بخوارزمية أو معاملات غير الحالية"""
+        return not stored or stored.split('$', 1)[0] != _method_prefix(self.method)
+
+    def busy_response(self, error):
+        response = jsonify({'error': str(error), 'retry_after': error.retry_after})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(error.retry_after)
+        return response
+
+
+password_hasher = PasswordHasher()
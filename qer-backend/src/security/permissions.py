@@ -0,0 +1,170 @@
+"""
+مُصرِّف الصلاحيات إلى أقنعة بتات
+لكل صلاحية موضع بت ثابت لا يتغير ولا يُعاد استخدامه، ولكل دور قناع صحيح
+مخزّن في جدول الأدوار، فيصبح فحص الصلاحية عملية AND واحدة
+بدلاً من تحميل كائنات الصلاحيات والمرور عليها في كل طلب
+"""
+
+from threading import Lock
+from sqlalchemy import bindparam, func, inspect, text
+from src.models.user import db
+
+
+class PermissionCompiler:
+    """إسناد مواضع البتات وتصريف أقنعة الأدوار"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self._flags = {}  # اسم الصلاحية ← 1 << bit (ذاكرة داخل العملية)
+        self._width = 0  # عدد البتات المعروفة في الخريطة
+        self._lock = Lock()
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """تهيئة المُصرِّف مع التطبيق"""
+        self.app = app
+        app.extensions['permission_compiler'] = self
+
+    # ==================== المخطط ====================
+
+    def ensure_schema(self):
+        """إضافة عمودي البت والقناع، وربط المستخدم بدوره، للجداول المنشأة قبل هذا التغيير"""
+        engine = db.engine
+        inspector = inspect(engine)
+        permission_columns = {col['name'] for col in inspector.get_columns('permissions')}
+        role_columns = {col['name'] for col in inspector.get_columns('roles')}
+        user_columns = {col['name'] for col in inspector.get_columns('users')}
+
+        with engine.begin() as conn:
+            if 'bit' not in permission_columns:
+                conn.execute(text('ALTER TABLE permissions ADD COLUMN bit INTEGER'))
+            if 'permission_mask' not in role_columns:
+                conn.execute(text('ALTER TABLE roles ADD COLUMN permission_mask VARCHAR(64)'))
+            if 'role_id' not in user_columns:
+                conn.execute(text('ALTER TABLE users ADD COLUMN role_id INTEGER REFERENCES roles (id)'))
+            conn.execute(text('CREATE UNIQUE INDEX IF NOT EXISTS ix_permissions_bit ON permissions (bit)'))
+            conn.execute(text('CREATE INDEX IF NOT EXISTS ix_users_role_id ON users (role_id)'))
+
+    # ==================== التصريف ====================
+
+    def assign_bits(self):
+        """إسناد مواضع بتات للصلاحيات الجديدة بعد أكبر موضع مستخدم
+
+        المواضع تُلحق فقط، فلا تتغير أقنعة الأدوار الموجودة عند إضافة صلاحية.
+        """
+        from src.models.role import Permission
+
+        pending = Permission.query.filter(Permission.bit.is_(None)).order_by(Permission.id).all()
+        if not pending:
+            return 0
+
+        next_bit = db.session.query(func.max(Permission.bit)).scalar()
+        next_bit = 0 if next_bit is None else next_bit + 1
+        for permission in pending:
+            permission.bit = next_bit
+            next_bit += 1
+        db.session.flush()
+        return len(pending)
+
+    def compile_roles(self, role_ids=None):
+        """إعادة حساب أقنعة الأدوار من جدول الربط باستعلام واحد"""
+        from src.models.role import Role, Permission, role_permissions
+
+        rows = db.session.query(role_permissions.c.role_id, Permission.bit).join(
+            Permission, Permission.id == role_permissions.c.permission_id
+        ).filter(Permission.is_active == True, Permission.bit.isnot(None))
+        roles = db.session.query(Role.id, Role.permission_mask)
+        if role_ids is not None:
+            rows = rows.filter(role_permissions.c.role_id.in_(role_ids))
+            roles = roles.filter(Role.id.in_(role_ids))
+
+        previous = dict(roles.all())
+        masks = {role_id: 0 for role_id in previous}
+        for role_id, bit in rows.all():
+            masks[role_id] = masks.get(role_id, 0) | (1 << bit)
+
+        # الأدوار التي تغير قناعها تُبطل مطالبات جلسات مستخدميها
+        from src.security.identity import identity_manager
+        for role_id, mask in masks.items():
+            if previous.get(role_id) != format(mask, 'x'):
+                identity_manager.bump_role(role_id)
+
+        if masks:
+            db.session.execute(Role.__table__.update().where(
+                Role.__table__.c.id == bindparam('role_id')
+            ).values(permission_mask=bindparam('mask')), [
+                {'role_id': role_id, 'mask': format(mask, 'x')} for role_id, mask in masks.items()
+            ])
+            # الكائنات المحملة في الجلسة تقرأ القناع الجديد
+            for role in list(db.session.identity_map.values()):
+                if isinstance(role, Role) and role.id in masks:
+                    db.session.expire(role, ['permission_mask'])
+        return masks
+
+    def rebuild(self, role_ids=None):
+        """إسناد البتات الناقصة ثم تصريف الأقنعة (يُستدعى قبل commit المُعدِّل)"""
+        self.assign_bits()
+        masks = self.compile_roles(role_ids)
+        self.reload()
+        return masks
+
+    # ==================== الفحص ====================
+
+    def reload(self):
+        """تحميل خريطة الاسم ← البت من قاعدة البيانات"""
+        from src.models.role import Permission
+
+        rows = db.session.query(Permission.name, Permission.bit).filter(Permission.bit.isnot(None)).all()
+        with self._lock:
+            self._flags = {name: 1 << bit for name, bit in rows}
+            self._width = max((bit + 1 for _, bit in rows), default=0)
+
+    def flag(self, permission_name):
+        """بت الصلاحية (0 لاسم غير معروف)"""
+        return self._flags.get(permission_name, 0)
+
+    def mask_for(self, permission_names):
+        """قناع مجموعة صلاحيات (لفحص عدة صلاحيات بعملية واحدة)"""
+        mask = 0
+        for name in permission_names:
+            mask |= self.flag(name)
+        return mask
+
+    def allows(self, role, permission_name):
+        """فحص صلاحية في دور بقناعه المُصرَّف"""
+        if role.permission_mask is None:
+            # دور لم يُصرَّف بعد (قاعدة بيانات قديمة قبل أول إعادة بناء)
+            return any(perm.name == permission_name for perm in role.permissions if perm.is_active)
+        return self.mask_allows(int(role.permission_mask, 16), permission_name)
+
+    def mask_allows(self, mask, permission_name):
+        """فحص صلاحية في قناع صحيح (من الدور أو من مطالبات الجلسة)"""
+        flag = self.flag(permission_name)
+        if not flag and mask.bit_length() > self._width:
+            # القناع يحمل بتات أسندتها عملية أخرى بعد آخر تحميل للخريطة
+            self.reload()
+            flag = self.flag(permission_name)
+        return bool(mask & flag)
+
+    def verify(self):
+        """مقارنة الأقنعة المُصرَّفة بالفحص الخطي لكل دور وصلاحية
+
+        يُرجع قائمة (الدور، الصلاحية، المتوقع، الفعلي) لكل اختلاف، وتكون فارغة عند التطابق.
+        """
+        from src.models.role import Role, Permission
+
+        mismatches = []
+        permissions = Permission.query.all()
+        for role in Role.query.all():
+            granted = {perm.name for perm in role.permissions if perm.is_active}
+            for permission in permissions:
+                expected = permission.name in granted
+                actual = self.allows(role, permission.name)
+                if expected != actual:
+                    mismatches.append((role.name, permission.name, expected, actual))
+        return mismatches
+
+
+permission_compiler = PermissionCompiler()
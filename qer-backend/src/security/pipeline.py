@@ -0,0 +1,163 @@
+"""
+خط فحوص الأمان حسب فئة المسار
+تُصنَّف نقاط النهاية مرة واحدة عند أول طلب (بعد تسجيل كل المخططات) إلى:
+static، redirect، public، authenticated، admin
+ولكل فئة سلسلة فحوص مُجهزة مسبقاً، فلا تكلف الملفات الثابتة وفحص الصحة شيئاً
+وتمر التحويلات بالفحوص الرخيصة فقط. الفئة الافتراضية public، ولا يُعفى من الفحوص
+إلا ما في القائمة الصريحة (نقطة static ومسارات الصحة وبادئات الأصول)
+"""
+
+import time
+from flask import g, request, jsonify, session
+from src.security.rate_limiter import rate_limiter
+from src.security.rate_policies import DEFAULT_POLICY, RatePolicyRegistry
+
+STATIC = 'static'
+REDIRECT = 'redirect'
+PUBLIC = 'public'
+AUTHENTICATED = 'authenticated'
+ADMIN = 'admin'
+
+ROUTE_CLASSES = (STATIC, REDIRECT, PUBLIC, AUTHENTICATED, ADMIN)
+
+# القائمة الصريحة للمسارات بلا أي فحص
+STATIC_PATHS = ('/health', '/healthz', '/api/health', '/favicon.ico')
+STATIC_PREFIXES = ('/assets/',)
+
+# مخططات لوحة الإدارة والأمان
+ADMIN_BLUEPRINTS = ('admin', 'security')
+
+UNSAFE_METHODS = frozenset(['POST', 'PUT', 'DELETE', 'PATCH'])
+
+
+def route_class(name):
+    """ديكوريتر لتحديد فئة المسار صراحة (مثل redirect لمسار الرابط المختصر)"""
+    if name not in ROUTE_CLASSES:
+        raise ValueError(f'فئة مسار غير معروفة: {name}')
+
+    def decorator(f):
+        f.route_class = name
+        return f
+    return decorator
+
+
+def mark_authenticated(f):
+    """تعليم دالة العرض بأنها تتطلب مصادقة (تستدعيه ديكوريترات require_*)"""
+    f.requires_auth = True
+    return f
+
+
+def classify(rule, view):
+    """فئة مسار واحد من قاعدته ودالة العرض"""
+    explicit = getattr(view, 'route_class', None)
+    if explicit:
+        return explicit
+    if rule.endpoint == 'static' or rule.rule in STATIC_PATHS or rule.rule.startswith(STATIC_PREFIXES):
+        return STATIC
+    if rule.endpoint.split('.', 1)[0] in ADMIN_BLUEPRINTS:
+        return ADMIN
+    if getattr(view, 'requires_auth', False):
+        return AUTHENTICATED
+    # كل ما ليس في القائمة الصريحة يمر بفحوص الواجهة العامة
+    return PUBLIC
+
+
+class SecurityPipeline:
+    """تصنيف المسارات وتنفيذ سلسلة فحوص فئتها"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.policies = RatePolicyRegistry(manager.app)
+        self._endpoint_chains = None
+        self._endpoint_policies = {}
+        self._class_chains = {
+            STATIC: (),
+            REDIRECT: (self.check_blocked_ip, self.check_redirect_rate),
+            PUBLIC: (self.check_blocked_ip, self.check_policy, self.check_headers, self.check_csrf),
+            AUTHENTICATED: (self.check_blocked_ip, self.check_policy, self.check_headers, self.check_csrf),
+            ADMIN: (self.check_blocked_ip, self.check_policy, self.check_headers, self.check_csrf)
+        }
+
+    def compile(self, app):
+        """بناء جدول نقطة النهاية ← سلسلة الفحوص من خريطة المسارات"""
+        classes = {}
+        for rule in app.url_map.iter_rules():
+            name = classify(rule, app.view_functions.get(rule.endpoint))
+            # نقطة نهاية بعدة قواعد تأخذ أشد فئاتها
+            previous = classes.get(rule.endpoint, STATIC)
+            classes[rule.endpoint] = max(previous, name, key=ROUTE_CLASSES.index)
+        chains = {endpoint: self._class_chains[name] for endpoint, name in classes.items()}
+        # سياسة التكلفة لكل نقطة نهاية تمر بفحص الحدود
+        self._endpoint_policies = {
+            endpoint: self.policies.resolve(endpoint, app.view_functions.get(endpoint))
+            for endpoint, name in classes.items() if name in (PUBLIC, AUTHENTICATED, ADMIN)
+        }
+        self._endpoint_chains = chains
+        self.classes = classes
+        return classes
+
+    def dispatch(self):
+        """before_request: تنفيذ سلسلة فئة المسار الحالي"""
+        if self._endpoint_chains is None:
+            from flask import current_app
+            self.compile(current_app)
+
+        # الطلبات التي لا تطابق أي مسار (404) تخضع لفحوص الواجهة العامة
+        chain = self._endpoint_chains.get(request.endpoint, self._class_chains[PUBLIC])
+        if not chain:
+            return None
+
+        client_ip = self.manager.get_client_ip()
+        for check in chain:
+            response = check(client_ip)
+            if response is not None:
+                return response
+        return None
+
+    # ==================== الفحوص ====================
+
+    def check_blocked_ip(self, client_ip):
+        if self.manager.is_ip_blocked(client_ip):
+            return jsonify({
+                'error': 'تم حظر عنوان IP الخاص بك مؤقتاً بسبب النشاط المشبوه',
+                'blocked_until': self.manager.get_block_expiry(client_ip)
+            }), 429
+
+    def _rate_response(self, allowed, retry_after):
+        if not allowed:
+            return jsonify({
+                'error': 'تم تجاوز الحد المسموح من الطلبات، يرجى المحاولة لاحقاً',
+                'retry_after': retry_after
+            }), 429, {'Retry-After': str(retry_after)}
+
+    def check_policy(self, client_ip):
+        """استهلاك تكلفة الطلب من دلوَي IP والمستخدم في ميزانية سياسته"""
+        endpoint = request.endpoint or '<unmatched>'
+        policy = self._endpoint_policies.get(endpoint, DEFAULT_POLICY)
+        buckets = self.policies.buckets(endpoint, policy, client_ip, session.get('user_id'))
+        allowed, retry_after, _ = rate_limiter.hit_many(buckets)
+        if allowed:
+            g.rate_policy_started = time.perf_counter()
+        return self._rate_response(allowed, retry_after)
+
+    def after_request(self, response):
+        """after_request: قياس زمن نقاط النهاية الخاضعة للسياسات لمعايرة تكلفتها"""
+        started = g.pop('rate_policy_started', None)
+        if started is not None:
+            self.policies.finished(request.endpoint or '<unmatched>', started)
+        return response
+
+    def check_redirect_rate(self, client_ip):
+        config = self.manager.app.config
+        return self._rate_response(*self.manager.check_rate_limit(
+            client_ip, config['REDIRECT_RATE_LIMIT_REQUESTS'], config['REDIRECT_RATE_LIMIT_WINDOW'],
+            scope=REDIRECT
+        ))
+
+    def check_headers(self, client_ip):
+        if not self.manager.validate_security_headers():
+            return jsonify({'error': 'طلب غير آمن'}), 400
+
+    def check_csrf(self, client_ip):
+        if request.method in UNSAFE_METHODS and not self.manager.validate_csrf_token():
+            return jsonify({'error': 'رمز CSRF غير صالح'}), 403
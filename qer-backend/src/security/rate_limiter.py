@@ -0,0 +1,169 @@
+"""
+محدد معدل الطلبات بخوارزمية GCRA مشترك بين عمليات gunicorn
+يُحفظ لكل مفتاح رقم واحد فقط (وقت الوصول النظري TAT) في ملف SQLite بوضع WAL
+يتشاركه كل العمال، فيُطبَّق حد واحد مهما كان عدد العمليات.
+الفحص عبارة UPSERT ذرية واحدة، والمفاتيح الخاملة (TAT في الماضي = دلو ممتلئ)
+تُحذف دورياً دون أي فقدان في الدقة. إذا تعذر الوصول إلى الملف (قفل أو عطل) يُطبَّق
+الحد نفسه من دلاء محلية في ذاكرة العملية بدلاً من السماح بكل الطلبات
+"""
+
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = 'CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, tat REAL NOT NULL) WITHOUT ROWID'
+
+# يُحدَّث TAT فقط إذا بقي ضمن حد الاندفاع، وإلا لا يُرجع صفاً (طلب مرفوض)
+_HIT = (
+    'INSERT INTO rate_limits (key, tat) VALUES (:key, :now + :interval) '
+    'ON CONFLICT (key) DO UPDATE SET tat = max(tat, :now) + :interval '
+    'WHERE max(tat, :now) + :interval - :now <= :period '
+    'RETURNING tat'
+)
+
+
+class GcraRateLimiter:
+    """محدد GCRA: limit طلب لكل period ثانية مع اندفاع حتى limit"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self._local = threading.local()
+        self._last_sweep = 0.0
+        self._fallback = {}  # المفتاح ← TAT عند تعذر المخزن المشترك
+        self._fallback_lock = threading.Lock()
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """تهيئة المحدد مع التطبيق"""
+        self.app = app
+        app.config.setdefault('RATE_LIMIT_DB', os.path.join(app.instance_path, 'ratelimit.db'))
+        app.config.setdefault('RATE_LIMIT_SWEEP_INTERVAL', 60)  # ثوانٍ بين حذف المفاتيح الخاملة
+        app.extensions['rate_limiter'] = self
+
+    def connection(self):
+        """اتصال المخزن المشترك الخاص بالعملية والخيط (يُعاد فتحه بعد تفرع gunicorn)
+
+        تحفظ فيه مكونات أخرى حالتها المشتركة بين العمال (مثل login_failures).
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        path = self.app.config['RATE_LIMIT_DB']
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(path, timeout=1.0, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(_SCHEMA)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def hit(self, key, limit, period):
+        """تسجيل طلب للمفتاح وإرجاع (مسموح، ثواني الانتظار قبل المحاولة التالية)"""
+        now = time.time()
+        interval = period / limit
+        try:
+            conn = self.connection()
+            row = conn.execute(_HIT, {'key': key, 'now': now, 'interval': interval, 'period': period}).fetchone()
+            if row is not None:
+                self._maybe_sweep(conn, now)
+                return True, 0
+
+            tat = conn.execute('SELECT tat FROM rate_limits WHERE key = ?', (key,)).fetchone()[0]
+            return False, max(1, math.ceil(tat + interval - period - now))
+        except sqlite3.Error as e:
+            # لا نفتح الحد عند تعطل المخزن: دلو محلي بنفس المعاملات
+            logger.error('rate limiter store unavailable, using local buckets: %s', e)
+            allowed, wait, _ = self._local_hit_many([(key, limit, period, 1)], now)
+            return allowed, wait
+
+    def hit_many(self, buckets):
+        """استهلاك عدة دلاء معاً (كل شيء أو لا شيء)
+
+        buckets: قائمة (المفتاح، الحد، الفترة، التكلفة). يُرجع (مسموح، ثواني الانتظار، المفتاح الرافض).
+        """
+        now = time.time()
+        try:
+            conn = self.connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for key, limit, period, cost in buckets:
+                    interval = period / limit
+                    cost = min(cost, limit)  # تكلفة تفوق السعة لن تمر أبداً
+                    row = conn.execute(_HIT, {
+                        'key': key, 'now': now, 'interval': interval * cost, 'period': period
+                    }).fetchone()
+                    if row is None:
+                        # التراجع عن استهلاك الدلاء السابقة في نفس الطلب
+                        conn.execute('ROLLBACK')
+                        tat = conn.execute('SELECT tat FROM rate_limits WHERE key = ?', (key,)).fetchone()
+                        wait = (tat[0] if tat else now) + interval * cost - period - now
+                        return False, max(1, math.ceil(wait)), key
+                conn.execute('COMMIT')
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+            self._maybe_sweep(conn, now)
+            return True, 0, None
+        except sqlite3.Error as e:
+            logger.error('rate limiter store unavailable, using local buckets: %s', e)
+            return self._local_hit_many(buckets, now)
+
+    def _local_hit_many(self, buckets, now):
+        """نفس GCRA على دلاء في ذاكرة العملية (كل شيء أو لا شيء)"""
+        with self._fallback_lock:
+            updates = {}
+            for key, limit, period, cost in buckets:
+                interval = period / limit * min(cost, limit)
+                tat = max(updates.get(key, self._fallback.get(key, now)), now) + interval
+                if tat - now > period:
+                    return False, max(1, math.ceil(tat - period - now)), key
+                updates[key] = tat
+            self._fallback.update(updates)
+
+            if len(self._fallback) > 10000:
+                self._fallback = {key: tat for key, tat in self._fallback.items() if tat > now}
+        return True, 0, None
+
+    def remaining(self, key, limit, period):
+        """عدد الطلبات المتاحة حالياً للمفتاح دون استهلاك"""
+        now = time.time()
+        try:
+            row = self.connection().execute('SELECT tat FROM rate_limits WHERE key = ?', (key,)).fetchone()
+            tat = row[0] if row else None
+        except sqlite3.Error as e:
+            logger.error('rate limiter store unavailable, using local buckets: %s', e)
+            tat = self._fallback.get(key)
+        if tat is None or tat <= now:
+            return limit
+        interval = period / limit
+        return max(0, int((period - (tat - now)) // interval))
+
+    def reset(self, key):
+        with self._fallback_lock:
+            self._fallback.pop(key, None)
+        try:
+            self.connection().execute('DELETE FROM rate_limits WHERE key = ?', (key,))
+        except sqlite3.Error as e:
+            logger.error('rate limiter store unavailable, reset only local bucket: %s', e)
+
+    def _maybe_sweep(self, conn, now):
+        """حذف المفاتيح الخاملة: TAT في الماضي يعني دلواً ممتلئاً مطابقاً لعدم وجود المفتاح"""
+        if now - self._last_sweep < self.app.config['RATE_LIMIT_SWEEP_INTERVAL']:
+            return
+        self._last_sweep = now
+        conn.execute('DELETE FROM rate_limits WHERE tat < ?', (now,))
+
+
+rate_limiter = GcraRateLimiter()
@@ -0,0 +1,142 @@
+"""
+سياسات حدود الطلبات الموزونة بالتكلفة
+لكل نقطة نهاية سياسة (التكلفة والميزانية التي تسحب منها) تُحدد بالديكوريتر rate_policy
+أو في RATE_LIMIT_POLICIES على مستوى المخطط أو نقطة النهاية. لكل ميزانية دلو لعنوان IP
+ودلو للمستخدم، وتُعاير التكلفة تلقائياً من زمن الاستجابة المقاس، فتُقيَّد التحليلات الثقيلة
+قبل أن تُشبع قاعدة البيانات دون أن تستنزف حصة الطلبات الرخيصة
+"""
+
+import time
+from dataclasses import dataclass
+from threading import Lock
+
+
+@dataclass(frozen=True)
+class RatePolicy:
+    """تكلفة الطلب بالوحدات والميزانية التي يسحب منها"""
+    cost: int = 1
+    budget: str = 'default'
+
+
+DEFAULT_POLICY = RatePolicy()
+
+# السياسات الافتراضية: المفتاح اسم مخطط أو نقطة نهاية (blueprint.function)
+DEFAULT_POLICIES = {
+    'analytics': {'budget': 'analytics', 'cost': 5},
+    'admin': {'budget': 'admin'},
+    'security': {'budget': 'admin'},
+    'auth_enhanced.check_session': {'cost': 1}
+}
+
+
+def rate_policy(cost=1, budget='default'):
+    """ديكوريتر لتحديد سياسة نقطة نهاية بعينها (الأولوية على الإعدادات)"""
+    def decorator(f):
+        f.rate_policy = RatePolicy(cost=cost, budget=budget)
+        return f
+    return decorator
+
+
+class LatencyCalibrator:
+    """متوسط أُسّي لزمن استجابة كل نقطة نهاية يُحوَّل إلى تكلفة"""
+
+    def __init__(self, baseline_ms=50.0, max_cost=50, min_samples=20, alpha=0.1):
+        self.baseline_ms = baseline_ms
+        self.max_cost = max_cost
+        self.min_samples = min_samples
+        self.alpha = alpha
+        self._stats = {}  # نقطة النهاية ← [المتوسط بالملي ثانية، عدد العينات]
+        self._lock = Lock()
+
+    def record(self, endpoint, elapsed_ms):
+        with self._lock:
+            stats = self._stats.get(endpoint)
+            if stats is None:
+                self._stats[endpoint] = [elapsed_ms, 1]
+            else:
+                stats[0] += self.alpha * (elapsed_ms - stats[0])
+                stats[1] += 1
+
+    def cost(self, endpoint, declared):
+        """التكلفة الفعلية: المعايَرة بعد عدد كافٍ من العينات، والمعلنة حداً أدنى"""
+        stats = self._stats.get(endpoint)
+        if stats is None or stats[1] < self.min_samples:
+            return declared
+        measured = min(self.max_cost, max(1, round(stats[0] / self.baseline_ms)))
+        return max(declared, measured)
+
+    def snapshot(self):
+        """حالة المعايرة لكل نقطة نهاية (للعرض في لوحة الأمان)"""
+        with self._lock:
+            return {
+                endpoint: {'avg_ms': round(avg, 1), 'samples': samples}
+                for endpoint, (avg, samples) in self._stats.items()
+            }
+
+
+class RatePolicyRegistry:
+    """حل سياسة كل نقطة نهاية وبناء الدلاء التي يستهلكها الطلب"""
+
+    def __init__(self, app):
+        self.app = app
+        config = app.config
+        self.calibrator = LatencyCalibrator(
+            baseline_ms=config['RATE_COST_BASELINE_MS'],
+            max_cost=config['RATE_COST_MAX'],
+            min_samples=config['RATE_COST_MIN_SAMPLES']
+        )
+
+    def budgets(self):
+        """الميزانيات: الاسم ← {'ip': (الحد، الفترة)، 'user': (الحد، الفترة)}"""
+        config = self.app.config
+        window = config['RATE_LIMIT_WINDOW']
+        budgets = {
+            'default': {
+                'ip': (config['RATE_LIMIT_REQUESTS'], window),
+                'user': (config['RATE_LIMIT_USER_REQUESTS'], window)
+            },
+            'analytics': {
+                'ip': (config['ANALYTICS_RATE_LIMIT_UNITS'], window),
+                'user': (config['ANALYTICS_RATE_LIMIT_UNITS'], window)
+            },
+            'admin': {
+                'ip': (config['ADMIN_RATE_LIMIT_REQUESTS'], window),
+                'user': (config['ADMIN_RATE_LIMIT_REQUESTS'], window)
+            }
+        }
+        budgets.update(config.get('RATE_LIMIT_BUDGETS') or {})
+        return budgets
+
+    def resolve(self, endpoint, view):
+        """سياسة نقطة النهاية: الديكوريتر ثم الإعدادات (نقطة النهاية ثم المخطط) ثم الافتراضي"""
+        declared = getattr(view, 'rate_policy', None)
+        if declared is not None:
+            return declared
+
+        policies = dict(DEFAULT_POLICIES)
+        policies.update(self.app.config.get('RATE_LIMIT_POLICIES') or {})
+        blueprint = endpoint.split('.', 1)[0] if '.' in endpoint else None
+        for key in (endpoint, blueprint):
+            if key in policies:
+                return RatePolicy(**policies[key])
+        return DEFAULT_POLICY
+
+    def buckets(self, endpoint, policy, client_ip, user_id):
+        """دلاء الطلب الحالي مع التكلفة المعايَرة"""
+        cost = self.calibrator.cost(endpoint, policy.cost)
+        budgets = self.budgets()
+        budget = budgets.get(policy.budget) or budgets['default']
+        limit, period = budget['ip']
+        buckets = [(f'{policy.budget}:ip:{client_ip}', limit, period, cost)]
+        if user_id is not None:
+            limit, period = budget['user']
+            buckets.append((f'{policy.budget}:user:{user_id}', limit, period, cost))
+        return buckets
+
+    def finished(self, endpoint, started):
+        """تسجيل زمن طلب انتهى (started من time.perf_counter)"""
+        self.calibrator.record(endpoint, (time.perf_counter() - started) * 1000)
+
+    def costs(self):
+        """التكلفة الحالية ومتوسط الزمن لكل نقطة نهاية مقاسة"""
+        return self.calibrator.snapshot()
@@ -0,0 +1,204 @@
+"""
+ذاكرة رموز JWT المُتحقق منها ومخزن إلغائها
+تُحفظ نتيجة فك الرمز والتحقق من توقيعه في ذاكرة LRU حتى انتهاء صلاحيته،
+وتُفحص معرفات الرموز (jti) الملغاة عبر مرشح Bloom في الذاكرة مبني من جدول،
+فلا تُسأل قاعدة البيانات إلا عند تطابق المرشح (رمز ملغى فعلاً أو إيجابي كاذب نادر)
+"""
+
+import hashlib
+import math
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from threading import Lock
+from sqlalchemy import event
+from src.models.user import db
+from src.security.epoch import EpochFile
+
+
+class RevokedToken(db.Model):
+    """رموز ملغاة (jti) ونقاط قطع المستخدمين (user:<id>)"""
+    __tablename__ = 'revoked_tokens'
+
+    key = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.Integer, nullable=True, index=True)
+    reason = db.Column(db.String(30), nullable=True)  # logout, password_change
+    revoked_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)  # يُحذف السجل بعده
+
+
+class BloomFilter:
+    """مرشح Bloom ثابت الحجم بتجزئة مزدوجة من SHA-256"""
+
+    def __init__(self, capacity, error_rate):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.sha256(value.encode('utf-8')).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:16], 'big') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class TokenRevocationStore:
+    """ذاكرة LRU للرموز المتحقق منها مع مخزن الإلغاء"""
+
+    def __init__(self, app=None):
+        self.app = app
+        self._verified = OrderedDict()  # بصمة الرمز ← (payload، وقت الانتهاء)
+        self._bloom = None
+        self._user_cutoffs = {}  # المستخدم ← آخر iat ملغى (تغيير كلمة المرور)
+        self._stamp = None
+        self._lock = Lock()
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """تهيئة مخزن الإلغاء مع التطبيق"""
+        self.app = app
+        app.config.setdefault('JWT_VERIFIED_CACHE_SIZE', 10000)
+        app.config.setdefault('REVOCATION_BLOOM_CAPACITY', 100000)
+        app.config.setdefault('REVOCATION_BLOOM_ERROR_RATE', 0.001)
+        app.config.setdefault('REVOCATION_EPOCH_FILE', os.path.join(app.instance_path, 'revocations.epoch'))
+        app.extensions['token_revocations'] = self
+
+    @property
+    def epoch(self):
+        return EpochFile(self.app.config['REVOCATION_EPOCH_FILE'])
+
+    # ==================== ذاكرة الرموز المتحقق منها ====================
+
+    @staticmethod
+    def fingerprint(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def cached(self, token):
+        """payload رمز تحقق منه سابقاً ولم تنتهِ صلاحيته، أو None"""
+        key = self.fingerprint(token)
+        with self._lock:
+            entry = self._verified.get(key)
+            if entry is None:
+                return None
+            payload, expires = entry
+            if expires <= time.time():
+                del self._verified[key]
+                return None
+            self._verified.move_to_end(key)
+            return payload
+
+    def remember(self, token, payload):
+        """حفظ رمز تحقق منه حتى exp"""
+        key = self.fingerprint(token)
+        with self._lock:
+            self._verified[key] = (payload, payload['exp'])
+            self._verified.move_to_end(key)
+            while len(self._verified) > self.app.config['JWT_VERIFIED_CACHE_SIZE']:
+                self._verified.popitem(last=False)
+
+    # ==================== الإلغاء ====================
+
+    def _sync(self):
+        """إعادة بناء المرشح إذا تغير ملف الحقبة منذ آخر بناء"""
+        stamp = self.epoch.stamp()
+        if self._bloom is not None and stamp == self._stamp:
+            return
+
+        rows = db.session.query(RevokedToken.key, RevokedToken.user_id, RevokedToken.revoked_at).filter(
+            RevokedToken.expires_at > datetime.utcnow()
+        ).all()
+        # السعة تتسع مع عدد السجلات حتى لا ترتفع نسبة الإيجابيات الكاذبة
+        bloom = BloomFilter(max(self.app.config['REVOCATION_BLOOM_CAPACITY'], 2 * len(rows)),
+                            self.app.config['REVOCATION_BLOOM_ERROR_RATE'])
+        cutoffs = {}
+        for key, user_id, revoked_at in rows:
+            if key.startswith('user:'):
+                # بدقة أجزاء الثانية حتى لا يُلغى رمز صدر في نفس ثانية تغيير كلمة المرور بعده
+                revoked = revoked_at.replace(tzinfo=timezone.utc).timestamp()
+                cutoffs[user_id] = max(cutoffs.get(user_id, 0), revoked)
+            else:
+                bloom.add(key)
+
+        with self._lock:
+            self._bloom = bloom
+            self._user_cutoffs = cutoffs
+            self._stamp = stamp
+
+    def is_revoked(self, payload):
+        """فحص الرمز: المرشح أولاً ثم الجدول عند التطابق فقط"""
+        self._sync()
+
+        cutoff = self._user_cutoffs.get(payload.get('user_id'))
+        if cutoff is not None and payload.get('iat', 0) < cutoff:
+            return True
+
+        jti = payload.get('jti')
+        if not jti or jti not in self._bloom:
+            return False
+        return db.session.get(RevokedToken, jti) is not None
+
+    def revoke(self, payload, reason='logout'):
+        """إلغاء رمز بعينه حتى انتهاء صلاحيته"""
+        jti = payload.get('jti')
+        if not jti or db.session.get(RevokedToken, jti):
+            return
+        db.session.add(RevokedToken(
+            key=jti,
+            user_id=payload.get('user_id'),
+            reason=reason,
+            expires_at=datetime.utcfromtimestamp(payload['exp'])
+        ))
+        db.session.info['revocations_changed'] = True
+
+    def revoke_user(self, user_id, reason='password_change'):
+        """إلغاء كل رموز المستخدم الصادرة حتى الآن"""
+        key = f'user:{user_id}'
+        now = datetime.utcnow()
+        expires_at = now + self.app.config['JWT_REFRESH_TOKEN_EXPIRES']
+        row = db.session.get(RevokedToken, key)
+        if row is None:
+            db.session.add(RevokedToken(key=key, user_id=user_id, reason=reason,
+                                        revoked_at=now, expires_at=expires_at))
+        else:
+            row.reason = reason
+            row.revoked_at = now
+            row.expires_at = expires_at
+        db.session.info['revocations_changed'] = True
+
+    def purge_expired(self):
+        """حذف سجلات الإلغاء المنتهية (لا حاجة لها بعد انتهاء الرموز)"""
+        deleted = RevokedToken.query.filter(RevokedToken.expires_at <= datetime.utcnow()).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+        return deleted
+
+    def changed(self):
+        """إعلام كل العمليات بتغير سجلات الإلغاء"""
+        self.epoch.touch()
+        self._bloom = None
+
+
+token_revocations = TokenRevocationStore()
+
+
+@event.listens_for(db.session, 'after_commit')
+def _touch_epoch_after_commit(db_session):
+    if db_session.info.pop('revocations_changed', False):
+        token_revocations.changed()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_revocations(db_session):
+    db_session.info.pop('revocations_changed', None)
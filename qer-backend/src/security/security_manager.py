@@ -6,21 +6,27 @@
 import hashlib
 import secrets
 import jwt
-import bcrypt
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from functools import wraps
 from flask import request, jsonify, current_app, session
+import math
 import re
 import time
-from collections import defaultdict
 import ipaddress
+from src.security.revocation import token_revocations
+from src.security.password_hasher import password_hasher
+from src.security.rate_limiter import rate_limiter
+from src.security.ip_blocklist import ip_blocklist
+from src.security.login_failures import login_failures
+from src.security.breached_passwords import breached_passwords
+from src.security.sanitizer import input_sanitizer
+from src.security.pipeline import SecurityPipeline, mark_authenticated
 
 class SecurityManager:
     def __init__(self, app=None):
         self.app = app
-        self.failed_attempts = defaultdict(list)
-        self.blocked_ips = set()
-        self.rate_limits = defaultdict(list)
+        self.login_failures = login_failures
+        self.blocklist = ip_blocklist
         
         if app:
             self.init_app(app)
@@ -38,38 +44,33 @@ class SecurityManager:
         app.config.setdefault('LOCKOUT_DURATION', 900)  # 15 دقيقة
         app.config.setdefault('RATE_LIMIT_REQUESTS', 100)
         app.config.setdefault('RATE_LIMIT_WINDOW', 3600)  # ساعة واحدة
+        app.config.setdefault('REDIRECT_RATE_LIMIT_REQUESTS', 600)  # للروابط المختصرة
+        app.config.setdefault('REDIRECT_RATE_LIMIT_WINDOW', 60)
+        app.config.setdefault('ADMIN_RATE_LIMIT_REQUESTS', app.config['RATE_LIMIT_REQUESTS'])
+        app.config.setdefault('RATE_LIMIT_USER_REQUESTS', 1000)  # ميزانية المستخدم المسجل بالوحدات
+        app.config.setdefault('ANALYTICS_RATE_LIMIT_UNITS', 200)  # ميزانية التحليلات الثقيلة
+        app.config.setdefault('RATE_LIMIT_POLICIES', {})  # {'blueprint' أو 'blueprint.endpoint': {'cost', 'budget'}}
+        app.config.setdefault('RATE_COST_BASELINE_MS', 50)  # زمن الوحدة الواحدة في المعايرة
+        app.config.setdefault('RATE_COST_MAX', 50)
+        app.config.setdefault('RATE_COST_MIN_SAMPLES', 20)
         app.config.setdefault('PASSWORD_MIN_LENGTH', 8)
         app.config.setdefault('REQUIRE_STRONG_PASSWORD', True)
-        
-        # تسجيل middleware للأمان
+        app.extensions['security_manager'] = self
+        token_revocations.init_app(app)
+        password_hasher.init_app(app)
+        rate_limiter.init_app(app)
+        ip_blocklist.init_app(app)
+        login_failures.init_app(app)
+        breached_passwords.init_app(app)
+        
+        # خط فحوص الأمان حسب فئة المسار
+        self.pipeline = SecurityPipeline(self)
         app.before_request(self.security_middleware)
+        app.after_request(self.pipeline.after_request)
     
     def security_middleware(self):
-        """Middleware للأمان يتم تنفيذه قبل كل طلب"""
-        client_ip = self.get_client_ip()
-        
-        # فحص IP المحظور
-        if self.is_ip_blocked(client_ip):
-            return jsonify({
-                'error': 'تم حظر عنوان IP الخاص بك مؤقتاً بسبب النشاط المشبوه',
-                'blocked_until': self.get_block_expiry(client_ip)
-            }), 429
-        
-        # فحص معدل الطلبات
-        if not self.check_rate_limit(client_ip):
-            return jsonify({
-                'error': 'تم تجاوز الحد المسموح من الطلبات، يرجى المحاولة لاحقاً',
-                'retry_after': 3600
-            }), 429
-        
-        # فحص الأمان للرؤوس
-        if not self.validate_security_headers():
-            return jsonify({'error': 'طلب غير آمن'}), 400
-        
-        # حماية من CSRF
-        if request.method in ['POST', 'PUT', 'DELETE', 'PATCH']:
-            if not self.validate_csrf_token():
-                return jsonify({'error': 'رمز CSRF غير صالح'}), 403
+        """Middleware للأمان يتم تنفيذه قبل كل طلب (سلسلة فحوص فئة المسار)"""
+        return self.pipeline.dispatch()
     
     def get_client_ip(self):
         """الحصول على عنوان IP الحقيقي للعميل"""
@@ -103,64 +104,38 @@ class SecurityManager:
             return False
     
     def is_ip_blocked(self, ip):
-        """فحص ما إذا كان IP محظوراً"""
-        if ip in self.blocked_ips:
+        """فحص ما إذا كان IP محظوراً (قائمة النطاقات ثم محاولات الدخول الفاشلة)"""
+        if self.blocklist.is_blocked(ip):
             return True
         
-        # فحص محاولات تسجيل الدخول الفاشلة
-        failed_attempts = self.failed_attempts.get(ip, [])
-        recent_attempts = [
-            attempt for attempt in failed_attempts
-            if time.time() - attempt < current_app.config['LOCKOUT_DURATION']
-        ]
-        
-        return len(recent_attempts) >= current_app.config['MAX_LOGIN_ATTEMPTS']
+        # قفل محاولات تسجيل الدخول الفاشلة
+        return self.login_failures.ips.locked_until(ip) is not None
     
     def get_block_expiry(self, ip):
         """الحصول على وقت انتهاء الحظر"""
-        failed_attempts = self.failed_attempts.get(ip, [])
-        if failed_attempts:
-            last_attempt = max(failed_attempts)
-            expiry = last_attempt + current_app.config['LOCKOUT_DURATION']
-            return datetime.fromtimestamp(expiry).isoformat()
+        until = self.login_failures.ips.locked_until(ip)
+        if until is not None:
+            return datetime.fromtimestamp(until).isoformat()
         return None
     
-    def record_failed_login(self, ip):
-        """تسجيل محاولة تسجيل دخول فاشلة"""
-        self.failed_attempts[ip].append(time.time())
-        
-        # تنظيف المحاولات القديمة
-        cutoff = time.time() - current_app.config['LOCKOUT_DURATION']
-        self.failed_attempts[ip] = [
-            attempt for attempt in self.failed_attempts[ip]
-            if attempt > cutoff
-        ]
+    def username_lockout(self, username):
+        """ثواني القفل المتبقية لاسم المستخدم (0 إن لم يكن مقفلاً)"""
+        until = self.login_failures.usernames.locked_until(self.login_failures.normalize(username))
+        return math.ceil(until - time.time()) if until is not None else 0
     
-    def clear_failed_attempts(self, ip):
-        """مسح محاولات تسجيل الدخول الفاشلة بعد نجاح تسجيل الدخول"""
-        if ip in self.failed_attempts:
-            del self.failed_attempts[ip]
+    def record_failed_login(self, ip, username=None):
+        """تسجيل محاولة تسجيل دخول فاشلة لعنوان IP واسم المستخدم"""
+        self.login_failures.record(ip, username)
     
-    def check_rate_limit(self, ip):
-        """فحص معدل الطلبات"""
-        now = time.time()
-        window = current_app.config['RATE_LIMIT_WINDOW']
-        max_requests = current_app.config['RATE_LIMIT_REQUESTS']
-        
-        # تنظيف الطلبات القديمة
-        cutoff = now - window
-        self.rate_limits[ip] = [
-            timestamp for timestamp in self.rate_limits[ip]
-            if timestamp > cutoff
-        ]
-        
-        # فحص الحد الأقصى
-        if len(self.rate_limits[ip]) >= max_requests:
-            return False
-        
-        # تسجيل الطلب الحالي
-        self.rate_limits[ip].append(now)
-        return True
+    def clear_failed_attempts(self, ip=None, username=None):
+        """مسح محاولات تسجيل الدخول الفاشلة (اسم المستخدم بعد نجاح الدخول، والعنوان عند إلغاء حظره)"""
+        self.login_failures.clear(ip, username)
+    
+    def check_rate_limit(self, ip, max_requests=None, window=None, scope='global'):
+        """فحص معدل الطلبات (GCRA مشترك بين العمال) وإرجاع (مسموح، ثواني الانتظار)"""
+        max_requests = max_requests or current_app.config['RATE_LIMIT_REQUESTS']
+        window = window or current_app.config['RATE_LIMIT_WINDOW']
+        return rate_limiter.hit(f'{scope}:{ip}', max_requests, window)
     
     def validate_security_headers(self):
         """التحقق من رؤوس الأمان"""
@@ -193,21 +168,22 @@ class SecurityManager:
         return token and token == session.get('csrf_token')
     
     def hash_password(self, password):
-        """تشفير كلمة المرور باستخدام bcrypt"""
-        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        """تشفير كلمة المرور عبر خدمة التشفير (خارج عملية الخادم)"""
+        return password_hasher.hash(password)
     
     def verify_password(self, password, hashed):
-        """التحقق من كلمة المرور"""
-        try:
-            return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
-        except Exception:
-            return False
+        """التحقق من كلمة المرور (يدعم تجزئات bcrypt القديمة)"""
+        return password_hasher.verify(hashed, password)
     
     def validate_password_strength(self, password):
         """التحقق من قوة كلمة المرور"""
         if len(password) < current_app.config['PASSWORD_MIN_LENGTH']:
             return False, f"كلمة المرور يجب أن تكون {current_app.config['PASSWORD_MIN_LENGTH']} أحرف على الأقل"
         
+        # قائمة كلمات المرور المسربة (ملف بصمات مرتب مشترك عبر mmap)
+        if breached_passwords.is_breached(password):
+            return False, "كلمة المرور هذه ظهرت في تسريبات بيانات معروفة، يرجى اختيار كلمة مرور أخرى"
+        
         if not current_app.config['REQUIRE_STRONG_PASSWORD']:
             return True, "كلمة المرور صالحة"
         
@@ -253,7 +229,7 @@ class SecurityManager:
         payload = {
             'user_id': user_id,
             'type': token_type,
-            'iat': now,
+            'iat': now.replace(tzinfo=timezone.utc).timestamp(),  # بأجزاء الثانية لمقارنته بوقت الإلغاء
             'exp': expires,
             'jti': secrets.token_hex(16)  # JWT ID للإلغاء
         }
@@ -265,43 +241,35 @@ class SecurityManager:
         )
     
     def verify_jwt_token(self, token):
-        """التحقق من JWT token"""
-        try:
-            payload = jwt.decode(
-                token,
-                current_app.config['JWT_SECRET_KEY'],
-                algorithms=['HS256']
-            )
-            return payload
-        except jwt.ExpiredSignatureError:
-            return None
-        except jwt.InvalidTokenError:
+        """التحقق من JWT token (من ذاكرة الرموز المتحقق منها إن وُجد فيها)"""
+        payload = token_revocations.cached(token)
+        if payload is None:
+            try:
+                payload = jwt.decode(
+                    token,
+                    current_app.config['JWT_SECRET_KEY'],
+                    algorithms=['HS256']
+                )
+            except jwt.ExpiredSignatureError:
+                return None
+            except jwt.InvalidTokenError:
+                return None
+            token_revocations.remember(token, payload)
+
+        if token_revocations.is_revoked(payload):
             return None
+        return payload
     
-    def sanitize_input(self, data):
-        """تنظيف المدخلات من المحتوى الضار"""
-        if isinstance(data, str):
-            # إزالة HTML tags
-            data = re.sub(r'<[^>]+>', '', data)
-            # إزالة JavaScript
-            data = re.sub(r'javascript:', '', data, flags=re.IGNORECASE)
-            # إزالة SQL injection patterns
-            sql_patterns = [
-                r'(\b(SELECT|INSERT|UPDATE|DELETE|DROP|CREATE|ALTER|EXEC|UNION)\b)',
-                r'(--|#|/\*|\*/)',
-                r'(\bOR\b.*=.*\bOR\b)',
-                r'(\bAND\b.*=.*\bAND\b)'
-            ]
-            for pattern in sql_patterns:
-                data = re.sub(pattern, '', data, flags=re.IGNORECASE)
-        
-        elif isinstance(data, dict):
-            return {key: self.sanitize_input(value) for key, value in data.items()}
-        
-        elif isinstance(data, list):
-            return [self.sanitize_input(item) for item in data]
-        
-        return data
+    def revoke_jwt_token(self, token, reason='logout'):
+        """إلغاء رمز (عند تسجيل الخروج)، يسري بعد commit"""
+        payload = self.verify_jwt_token(token)
+        if payload:
+            token_revocations.revoke(payload, reason)
+        return payload
+    
+    def sanitize_input(self, data, schema=None):
+        """تنظيف المدخلات من المحتوى الضار حسب مخطط الحقول (انظر src.security.sanitizer)"""
+        return input_sanitizer.sanitize(data, schema)
     
     def log_security_event(self, event_type, details, severity='INFO'):
         """تسجيل أحداث الأمان"""
@@ -376,7 +344,7 @@ def require_auth(f):
         request.current_user_id = payload['user_id']
         return f(*args, **kwargs)
     
-    return decorated_function
+    return mark_authenticated(decorated_function)
 
 def require_permission(permission):
     """ديكوريتر للتحقق من الصلاحيات"""
@@ -393,7 +361,7 @@ def require_permission(permission):
             # ...
             
             return f(*args, **kwargs)
-        return decorated_function
+        return mark_authenticated(decorated_function)
     return decorator
 
 def rate_limit(max_requests=100, window=3600):
@@ -404,10 +372,14 @@ def rate_limit(max_requests=100, window=3600):
             security_manager = current_app.extensions.get('security_manager')
             if security_manager:
                 client_ip = security_manager.get_client_ip()
-                if not security_manager.check_rate_limit(client_ip):
+                allowed, retry_after = security_manager.check_rate_limit(
+                    client_ip, max_requests, window, scope=f.__name__
+                )
+                if not allowed:
                     return jsonify({
-                        'error': 'تم تجاوز الحد المسموح من الطلبات'
-                    }), 429
+                        'error': 'تم تجاوز الحد المسموح من الطلبات',
+                        'retry_after': retry_after
+                    }), 429, {'Retry-After': str(retry_after)}
             
             return f(*args, **kwargs)
         return decorated_function
@@ -0,0 +1,66 @@
+"""
+إعداد الاختبارات: تطبيق Flask بقاعدة SQLite في الذاكرة لكل اختبار
+
+    python -m pytest tests
+"""
+
+import pytest
+from flask import Flask
+
+from src.models.user import db
+import src.models.url  # noqa: F401
+import src.models.analytics  # noqa: F401
+import src.models.role  # noqa: F401
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app, tmp_path):
+    """عميل اختبار بمسارات الإدارة والروابط والأدوار الافتراضية"""
+    from src.models.role import create_default_roles_and_permissions
+    from src.routes.admin import admin_bp
+    from src.routes.url_enhanced import url_enhanced_bp
+    from src.security.identity import identity_manager
+
+    app.config['SECRET_KEY'] = 'test'
+    app.config['IDENTITY_EPOCH_FILE'] = str(tmp_path / 'authz.epoch')
+    identity_manager.init_app(app)
+    app.register_blueprint(admin_bp, url_prefix='/api/admin')
+    app.register_blueprint(url_enhanced_bp, url_prefix='/api')
+    create_default_roles_and_permissions()
+    return app.test_client()
+
+
+@pytest.fixture
+def login(client):
+    """إنشاء مستخدم بالدور المعطى وتسجيل دخوله في العميل"""
+    from flask import g
+    from src.models.role import Role
+    from src.models.user import User
+
+    def login(username, role_name=None, is_admin=False):
+        role = Role.query.filter_by(name=role_name).one() if role_name else None
+        user = User(username=username, email=f'{username}@rfah.me', password_hash='x',
+                    is_admin=is_admin, role_id=role.id if role else None)
+        db.session.add(user)
+        db.session.commit()
+        # الاختبار يعمل داخل سياق تطبيق واحد، فتُزال الهوية المخزنة من الطلب السابق
+        g.pop('identity', None)
+        with client.session_transaction() as sess:
+            sess['user_id'] = user.id
+        return user
+
+    return login
@@ -0,0 +1,36 @@
+import pytest
+
+from src.models.user import db
+from src.models.url import ShortenedUrl
+from src.migrations.indexes import apply_performance_indexes, check_index_usage, explain_query_plan, hot_path_queries
+import src.security.audit_logger  # noqa: F401
+
+
+@pytest.fixture
+def indexed(app):
+    report = apply_performance_indexes()
+    assert report and all(item['status'] in ('created', 'exists', 'dropped') for item in report)
+    return report
+
+
+def test_apply_is_idempotent(indexed):
+    assert all(item['status'] == 'exists' for item in apply_performance_indexes())
+
+
+def test_hot_path_queries_use_expected_indexes(indexed):
+    results = check_index_usage()
+    assert len(results) == len(hot_path_queries())
+    for result in results:
+        assert result['uses_index'], (result['query'], result['plan'])
+
+
+def test_active_urls_use_partial_index(indexed):
+    plan = explain_query_plan(ShortenedUrl.query.filter(
+        ShortenedUrl.user_id == 1, ShortenedUrl.is_active == True, ShortenedUrl.deleted_at.is_(None)
+    ))
+    assert any('ix_shortened_urls_user_active' in line for line in plan), plan
+
+    sql = db.session.execute(db.text(
+        "SELECT sql FROM sqlite_master WHERE name = 'ix_shortened_urls_user_active'"
+    )).scalar()
+    assert sql.endswith('WHERE deleted_at IS NULL')
@@ -0,0 +1,39 @@
+from src.models.user import db
+from src.models.role import Role
+
+
+def test_initialize_system_compiles_default_role_masks(client, login):
+    Role.query.update({'permission_mask': None})
+    db.session.commit()
+    login('admin', is_admin=True)
+    assert client.post('/api/admin/system/init').status_code == 200
+
+    db.session.expire_all()
+    for name in ('super_admin', 'admin', 'employee', 'viewer'):
+        role = Role.query.filter_by(name=name).one()
+        assert int(role.permission_mask, 16) != 0
+    assert Role.query.filter_by(name='super_admin').one().has_permission('roles.view')
+    assert not Role.query.filter_by(name='employee').one().has_permission('roles.view')
+
+
+def test_user_permissions_follow_role(client, login):
+    employee = login('employee', 'employee')
+    admin = login('admin', is_admin=True)
+
+    assert employee.role_obj.name == 'employee'
+    assert employee.has_permission('urls.create')
+    assert not employee.has_permission('roles.view')
+    assert admin.has_permission('roles.view')
+
+
+def test_require_permission_uses_role_mask(client, login):
+    login('manager', 'super_admin')
+    assert client.get('/api/admin/roles').status_code == 200
+
+    login('employee', 'employee')
+    assert client.get('/api/admin/roles').status_code == 403
+
+
+def test_require_permission_allows_admin_without_role(client, login):
+    login('admin', is_admin=True)
+    assert client.get('/api/admin/roles').status_code == 200
@@ -0,0 +1,34 @@
+import pytest
+
+from benchmarks.sanitizer import ADVERSARIAL, legacy_sanitize
+from src.security.sanitizer import InputSanitizer, TEXT, URL
+
+
+@pytest.fixture
+def sanitizer():
+    return InputSanitizer()
+
+
+@pytest.mark.parametrize('value, expected', ADVERSARIAL.items())
+def test_text_matches_legacy_on_adversarial_input(sanitizer, value, expected):
+    assert sanitizer.sanitize(value, default=TEXT) == expected
+    assert legacy_sanitize(value) == expected
+
+
+def test_text_strips_until_stable(sanitizer):
+    # الطريقة القديمة تُبقي javascript: هنا لأنها تمر على كل نمط مرة واحدة
+    assert sanitizer.sanitize('javajavascript:script:alert(1)', default=TEXT) == 'alert(1)'
+
+
+@pytest.mark.parametrize('value', [
+    'javascript:javascript:alert(1)',
+    'java\tscript:JavaScript:alert(1)',
+    'data:javascript:alert(1)'
+])
+def test_url_strips_repeated_schemes(sanitizer, value):
+    assert sanitizer.sanitize(value, default=URL) == 'alert(1)'
+
+
+def test_clean_text_unchanged(sanitizer):
+    value = {'title': 'عرض خاص', 'original_url': 'https://example.com/a?b=1#c--d'}
+    assert sanitizer.sanitize(value, 'url') == value
@@ -0,0 +1,45 @@
+from datetime import datetime
+
+import pytest
+
+from src.models.user import db, User
+from src.models.serializers import InvalidFields, UserSerializer
+
+
+@pytest.fixture
+def user(app):
+    user = User(
+        username='ahmad', email='ahmad@rfah.me', password_hash='x',
+        full_name='أحمد', created_at=datetime(2026, 1, 2, 3, 4, 5)
+    )
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def test_user_serializer_dumps_real_user(user):
+    serializer = UserSerializer()
+    users = serializer.apply(User.query, User.created_at).all()
+
+    assert serializer.dump_many(users) == [{
+        'id': user.id,
+        'username': 'ahmad',
+        'email': 'ahmad@rfah.me',
+        'full_name': 'أحمد',
+        'is_active': True,
+        'is_admin': False,
+        'created_at': '2026-01-02 03:04:05'
+    }]
+
+
+def test_user_serializer_sparse_fields(user):
+    serializer = UserSerializer('id,username')
+    users = serializer.apply(User.query).all()
+
+    assert serializer.dump_many(users) == [{'id': user.id, 'username': 'ahmad'}]
+
+
+@pytest.mark.parametrize('fields', ['role', 'last_login', 'deleted_at', 'password_hash'])
+def test_user_serializer_rejects_unknown_fields(fields):
+    with pytest.raises(InvalidFields):
+        UserSerializer(fields)
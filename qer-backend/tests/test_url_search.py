@@ -0,0 +1,40 @@
+import pytest
+
+from src.models.user import db
+from src.models.url import ShortenedUrl
+from src.models.url_search import url_search
+
+
+@pytest.fixture
+def urls(client, login):
+    url_search.ensure_schema()
+    other = login('other', 'employee')
+    owner = login('employee', 'employee')
+    db.session.add_all([
+        ShortenedUrl('https://example.com/a', custom_alias='docs', user_id=owner.id),
+        ShortenedUrl('https://example.com/b', user_id=owner.id, title='docs guide'),
+        ShortenedUrl('https://example.com/c', user_id=owner.id, description='see the docs'),
+        ShortenedUrl('https://example.com/d', user_id=other.id, title='docs elsewhere'),
+    ])
+    db.session.commit()
+    return owner
+
+
+def test_search_ranks_and_pages_own_urls(client, urls):
+    first = client.get('/api/my-urls/search?q=docs&per_page=2')
+    assert first.status_code == 200
+    body = first.get_json()
+    assert [item['short_code'] for item in body['data']][0] == 'docs'
+    assert body['data'][0]['rank'] <= body['data'][1]['rank']
+    assert body['pagination']['has_next'] is True
+
+    second = client.get('/api/my-urls/search?q=docs&per_page=2&page=2').get_json()
+    assert len(second['data']) == 1
+    assert second['pagination']['has_next'] is False
+    assert second['data'][0]['description'] == 'see the docs'
+
+
+def test_suggest_completes_own_aliases(client, urls):
+    response = client.get('/api/my-urls/suggest?q=do')
+    assert response.status_code == 200
+    assert [item['short_code'] for item in response.get_json()['data']] == ['docs']
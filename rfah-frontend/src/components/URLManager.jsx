@@ -14,30 +14,63 @@ import {
 } from 'lucide-react';
 import { Button } from '@/components/ui/button';
 
+const PAGE_SIZE = 50;
+
 const URLManager = ({ user }) => {
   const [urls, setUrls] = useState([]);
   const [filteredUrls, setFilteredUrls] = useState([]);
   const [loading, setLoading] = useState(true);
   const [searchTerm, setSearchTerm] = useState('');
+  const [query, setQuery] = useState('');
+  const [suggestions, setSuggestions] = useState([]);
+  const [nextPage, setNextPage] = useState(null);
   const [filterStatus, setFilterStatus] = useState('all');
   const [showCreateModal, setShowCreateModal] = useState(false);
   const [selectedUrl, setSelectedUrl] = useState(null);
 
+  // البحث على الخادم بعد توقف الكتابة، بدل تحميل كل الروابط وتصفيتها هنا
+  useEffect(() => {
+    const timer = setTimeout(() => setQuery(searchTerm.trim()), 300);
+    return () => clearTimeout(timer);
+  }, [searchTerm]);
+
   useEffect(() => {
     loadUrls();
-  }, []);
+  }, [query]);
+
+  // إكمال تلقائي على رموز الروابط ونطاقاتها
+  useEffect(() => {
+    if (query.length < 2) {
+      setSuggestions([]);
+      return;
+    }
+    fetch(`/api/urls/my-urls/suggest?q=${encodeURIComponent(query)}`)
+      .then((response) => response.json())
+      .then((data) => setSuggestions(data.success ? data.data : []))
+      .catch(() => setSuggestions([]));
+  }, [query]);
 
   useEffect(() => {
     filterUrls();
-  }, [urls, searchTerm, filterStatus]);
+  }, [urls, filterStatus]);
 
-  const loadUrls = async () => {
+  const loadUrls = async (page = null) => {
     try {
-      const response = await fetch('/api/urls/my-urls');
+      // بدون بحث: تصفح بالمؤشر، ومع البحث: صفحات مرتبة حسب الصلة
+      const url = query
+        ? `/api/urls/my-urls/search?q=${encodeURIComponent(query)}&prefix=true&per_page=${PAGE_SIZE}&page=${page || 1}`
+        : `/api/urls/my-urls?per_page=${PAGE_SIZE}${page ? `&cursor=${encodeURIComponent(page)}` : ''}`;
+      const response = await fetch(url);
       const data = await response.json();
       
       if (data.success) {
-        setUrls(data.urls);
+        setUrls((current) => (page ? [...current, ...data.data] : data.data));
+        const { pagination } = data;
+        if (!pagination.has_next) {
+          setNextPage(null);
+        } else {
+          setNextPage(query ? pagination.page + 1 : pagination.next_cursor);
+        }
       }
     } catch (error) {
       console.error('خطأ في جلب الروابط:', error);
@@ -49,16 +82,7 @@ const URLManager = ({ user }) => {
   const filterUrls = () => {
     let filtered = urls;
 
-    // تصفية حسب البحث
-    if (searchTerm) {
-      filtered = filtered.filter(url => 
-        url.title?.toLowerCase().includes(searchTerm.toLowerCase()) ||
-        url.original_url.toLowerCase().includes(searchTerm.toLowerCase()) ||
-        url.short_code.toLowerCase().includes(searchTerm.toLowerCase())
-      );
-    }
-
-    // تصفية حسب الحالة
+    // تصفية حسب الحالة (البحث النصي يتم على الخادم)
     if (filterStatus !== 'all') {
       filtered = filtered.filter(url => {
         switch (filterStatus) {
@@ -237,7 +261,15 @@ const URLManager = ({ user }) => {
             placeholder="البحث في الروابط..."
             value={searchTerm}
             onChange={(e) => setSearchTerm(e.target.value)}
+            list="url-suggestions"
           />
+          <datalist id="url-suggestions">
+            {suggestions.map((suggestion) => (
+              <option key={suggestion.id} value={suggestion.short_code}>
+                {suggestion.title || suggestion.domain}
+              </option>
+            ))}
+          </datalist>
         </div>
 
         <div className="filters">
@@ -261,6 +293,11 @@ const URLManager = ({ user }) => {
             {filteredUrls.map((url) => (
               <URLCard key={url.id} url={url} />
             ))}
+            {nextPage && (
+              <Button variant="outline" onClick={() => loadUrls(nextPage)}>
+                تحميل المزيد
+              </Button>
+            )}
           </div>
         ) : (
           <div className="empty-state">